@@ -1,28 +1,58 @@
-﻿from fastapi import FastAPI, HTTPException, Depends, status, Request
+﻿from fastapi import FastAPI, HTTPException, Depends, status, Request, Query, Response, Header
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer
+from starlette.datastructures import Headers, MutableHeaders
 from pydantic import BaseModel, Field, EmailStr
 from typing import List, Optional
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument, UpdateOne, monitoring
+from pymongo.database import Database
+from pymongo.read_preferences import read_pref_mode_from_name, make_read_preference
+from pymongo.errors import DuplicateKeyError, OperationFailure, PyMongoError
 from bson import ObjectId
-from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from pathlib import Path
 from jose import JWTError, jwt
 import os
+import io
+import csv
 import json
+import orjson
+import gzip
+import zlib
 import base64
-import urllib.request
 import urllib.parse
-import urllib.error
 import stripe
+import httpx
 import secrets
 import hashlib
 import smtplib
 import ssl
 import time
+import random
+import socket
+import re
+import bisect
+import logging
+import unicodedata
+import threading
+import ipaddress
+import asyncio
+import multiprocessing
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from concurrent.futures import ProcessPoolExecutor
 from email.message import EmailMessage
 from dotenv import load_dotenv # Indispensable pour lire le fichier .env
+from app.passwords import hash_password, verify_password
+
+try:
+    import brotli
+except ImportError:  # brotli absent : seul gzip est propose
+    brotli = None
 # --- 1. CONFIGURATION ET CHARGEMENT ---
 # Rigueur : Charger le .env avant toute chose
 env_path = Path(__file__).resolve().parents[1] / ".env"
@@ -50,6 +80,9 @@ except ValueError:
 
 # Configuration Stripe avec verification
 stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
+# Rejeu sur erreur reseau : sans risque, les creations portent une cle d'idempotence
+stripe.max_network_retries = int(os.getenv("STRIPE_MAX_NETWORK_RETRIES", "2"))
+STRIPE_SESSION_REUSE_MARGIN_SEC = int(os.getenv("STRIPE_SESSION_REUSE_MARGIN_SEC", "120"))
 
 # SMTP (Brevo)
 SMTP_HOST = os.getenv("SMTP_HOST")
@@ -57,13 +90,56 @@ SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
 SMTP_USER = os.getenv("SMTP_USER")
 SMTP_PASS = os.getenv("SMTP_PASS")
 SMTP_FROM = os.getenv("SMTP_FROM") or SMTP_USER or "no-reply@localhost"
+# SMTP_STARTTLS=false pour un serveur local de test (ex. python -m aiosmtpd -n -l 127.0.0.1:1025)
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() not in ("0", "false", "no")
+SMTP_TIMEOUT_SEC = int(os.getenv("SMTP_TIMEOUT_SEC", "20"))
+# Au-dela, la session est verifiee par NOOP avant reutilisation
+SMTP_KEEPALIVE_SEC = int(os.getenv("SMTP_KEEPALIVE_SEC", "60"))
+
+# File d'envoi email (collection email_outbox)
+EMAIL_WORKER_ENABLED = os.getenv("EMAIL_WORKER_ENABLED", "true").lower() not in ("0", "false", "no")
+EMAIL_BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", "20"))
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "6"))
+EMAIL_RETRY_BASE_SEC = int(os.getenv("EMAIL_RETRY_BASE_SEC", "30"))
+EMAIL_RETRY_MAX_SEC = int(os.getenv("EMAIL_RETRY_MAX_SEC", "3600"))
+# Bail par message : doit couvrir un envoi complet (connexion, TLS, login, DATA)
+EMAIL_LEASE_SEC = int(os.getenv("EMAIL_LEASE_SEC", "120"))
+EMAIL_LEASE_MIN_TIMEOUTS = 4
+EMAIL_POLL_INTERVAL_SEC = float(os.getenv("EMAIL_POLL_INTERVAL_SEC", "5"))
+EMAIL_SENT_RETENTION_DAYS = int(os.getenv("EMAIL_SENT_RETENTION_DAYS", "7"))
+# Boite de reception des webhooks Stripe (collection stripe_events)
+WEBHOOK_WORKER_ENABLED = os.getenv("WEBHOOK_WORKER_ENABLED", "true").lower() not in ("0", "false", "no")
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "50"))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+WEBHOOK_RETRY_BASE_SEC = int(os.getenv("WEBHOOK_RETRY_BASE_SEC", "10"))
+WEBHOOK_RETRY_MAX_SEC = int(os.getenv("WEBHOOK_RETRY_MAX_SEC", "1800"))
+WEBHOOK_LEASE_SEC = int(os.getenv("WEBHOOK_LEASE_SEC", "120"))
+WEBHOOK_POLL_INTERVAL_SEC = float(os.getenv("WEBHOOK_POLL_INTERVAL_SEC", "2"))
+# Fenetre de dedoublonnage : les relivraisons automatiques s'arretent apres 3 jours, mais un
+# evenement reste renvoyable a la main depuis le dashboard Stripe pendant 30 jours
+WEBHOOK_EVENT_RETENTION_DAYS = int(os.getenv("WEBHOOK_EVENT_RETENTION_DAYS", "30"))
 
 RESET_RATE_LIMIT_WINDOW_SEC = int(os.getenv("RESET_RATE_LIMIT_WINDOW_SEC", "600"))
 RESET_RATE_LIMIT_MAX = int(os.getenv("RESET_RATE_LIMIT_MAX", "5"))
 ADMIN_INVITE_EXPIRE_MINUTES = int(os.getenv("ADMIN_INVITE_EXPIRE_MINUTES", "5"))
 ADMIN_INVITE_RATE_LIMIT_WINDOW_SEC = int(os.getenv("ADMIN_INVITE_RATE_LIMIT_WINDOW_SEC", "600"))
 ADMIN_INVITE_RATE_LIMIT_MAX = int(os.getenv("ADMIN_INVITE_RATE_LIMIT_MAX", "5"))
-_reset_rate_limit_store: dict[str, list[float]] = {}
+# "memory" : un seul worker ; "mongo" : compteurs partages (collection rate_limits, TTL)
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+# Proxys de confiance (IP ou CIDR, separes par des virgules) : X-Forwarded-For n'est
+# lu que si la connexion vient de l'un d'eux, sinon l'adresse du pair fait foi
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(p.strip(), strict=False) for p in os.getenv("TRUSTED_PROXIES", "").split(",") if p.strip()
+]
+LOGIN_RATE_LIMIT_WINDOW_SEC = int(os.getenv("LOGIN_RATE_LIMIT_WINDOW_SEC", "300"))
+LOGIN_RATE_LIMIT_MAX = int(os.getenv("LOGIN_RATE_LIMIT_MAX", "20"))
+REGISTER_RATE_LIMIT_WINDOW_SEC = int(os.getenv("REGISTER_RATE_LIMIT_WINDOW_SEC", "3600"))
+REGISTER_RATE_LIMIT_MAX = int(os.getenv("REGISTER_RATE_LIMIT_MAX", "10"))
+NEWSLETTER_RATE_LIMIT_WINDOW_SEC = int(os.getenv("NEWSLETTER_RATE_LIMIT_WINDOW_SEC", "3600"))
+NEWSLETTER_RATE_LIMIT_MAX = int(os.getenv("NEWSLETTER_RATE_LIMIT_MAX", "10"))
+QUOTE_RATE_LIMIT_WINDOW_SEC = int(os.getenv("QUOTE_RATE_LIMIT_WINDOW_SEC", "60"))
+QUOTE_RATE_LIMIT_MAX = int(os.getenv("QUOTE_RATE_LIMIT_MAX", "60"))
 
 # PayPal
 PAYPAL_CLIENT_ID = os.getenv("PAYPAL_CLIENT_ID")
@@ -74,11 +150,84 @@ try:
     PAYPAL_FX_RATE = float(os.getenv("PAYPAL_FX_RATE", "655"))
 except ValueError:
     PAYPAL_FX_RATE = 655.0
+PAYPAL_TIMEOUT_SEC = float(os.getenv("PAYPAL_TIMEOUT_SEC", "20"))
+PAYPAL_POOL_SIZE = int(os.getenv("PAYPAL_POOL_SIZE", "10"))
+PAYPAL_TOKEN_REFRESH_MARGIN_SEC = int(os.getenv("PAYPAL_TOKEN_REFRESH_MARGIN_SEC", "300"))
+
+BOOTSTRAP_PRODUCTS_LIMIT = int(os.getenv("BOOTSTRAP_PRODUCTS_LIMIT", "32"))
+QUOTE_TOKEN_TTL_SEC = int(os.getenv("QUOTE_TOKEN_TTL_SEC", "900"))
+# Idempotency-Key : conservation des reponses, bail du premier appel
+IDEMPOTENCY_TTL_SEC = int(os.getenv("IDEMPOTENCY_TTL_SEC", str(24 * 3600)))
+IDEMPOTENCY_LEASE_SEC = int(os.getenv("IDEMPOTENCY_LEASE_SEC", "60"))
+PRODUCTS_PAGE_MAX = int(os.getenv("PRODUCTS_PAGE_MAX", "100"))
+# check_index_usage : cles/documents examines toleres par document renvoye
+INDEX_CHECK_MAX_EXAMINED_RATIO = int(os.getenv("INDEX_CHECK_MAX_EXAMINED_RATIO", "10"))
+INDEX_CHECK_MIN_EXAMINED = int(os.getenv("INDEX_CHECK_MIN_EXAMINED", "200"))
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+ADMIN_ORDERS_PAGE_MAX = int(os.getenv("ADMIN_ORDERS_PAGE_MAX", "200"))
+SIMILAR_STORED = int(os.getenv("SIMILAR_STORED", "24"))
+SIMILAR_CANDIDATES_MAX = int(os.getenv("SIMILAR_CANDIDATES_MAX", "500"))
+SIMILAR_IN_STOCK_BONUS = 1.0
+SEARCH_CANDIDATES_MAX = int(os.getenv("SEARCH_CANDIDATES_MAX", "300"))
+SEARCH_DESCRIPTION_TOKENS = 60
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(2, os.cpu_count() or 1))))
+PASSWORD_HASH_QUEUE_MAX = int(os.getenv("PASSWORD_HASH_QUEUE_MAX", "16"))
+PASSWORD_HASH_RETRY_AFTER_SEC = int(os.getenv("PASSWORD_HASH_RETRY_AFTER_SEC", "2"))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", "10000"))
+# Invalidation locale au process : avec plusieurs workers, un compte supprime ou
+# retrograde reste authentifie jusqu'a ce delai sur les autres workers (0 = sans cache)
+PRINCIPAL_CACHE_TTL_SEC = int(os.getenv("PRINCIPAL_CACHE_TTL_SEC", "10"))
+CATALOG_CACHE_MAX_ENTRIES = int(os.getenv("CATALOG_CACHE_MAX_ENTRIES", "512"))
+CATALOG_CACHE_MAX_BYTES = int(os.getenv("CATALOG_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# Filet de securite multi-workers : une ecriture faite par un autre process est vue apres ce delai
+CATALOG_CACHE_TTL_SEC = int(os.getenv("CATALOG_CACHE_TTL_SEC", "30"))
+
+# Compression : seuil, niveaux a la volee et niveaux des variantes precompressees
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+PRECOMPRESS_GZIP_LEVEL = int(os.getenv("PRECOMPRESS_GZIP_LEVEL", "9"))
+PRECOMPRESS_BROTLI_QUALITY = int(os.getenv("PRECOMPRESS_BROTLI_QUALITY", "9"))
+
+# Pool MongoDB (valeurs par defaut du driver si la variable est absente)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS")
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "10000"))
+# Ex. "zstd,snappy,zlib" (zstd/snappy demandent les paquets zstandard / python-snappy)
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "")
+# Lectures routees (opt-in) : "collection:mode[,collection:mode]" ; ecritures toujours sur le primaire.
+# Attention : le cache catalogue se reconstruit via read_db juste apres une ecriture
+# admin ; un secondaire en retard y figerait l'ancien document jusqu'au TTL du cache.
+MONGO_READ_PREFERENCES = os.getenv("MONGO_READ_PREFERENCES", "")
+
+# Jeton du scraper Prometheus : sans lui, GET /metrics repond 404
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+logger = logging.getLogger("tkb_shop")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
-app = FastAPI(title="TKB Shop API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Ouverture : client Mongo, index, worker email ; fermeture en ordre inverse
+    connect_mongo()
+    await run_in_threadpool(_startup_catalog)
+    if EMAIL_WORKER_ENABLED:
+        _mail_queue.start()
+    if WEBHOOK_WORKER_ENABLED:
+        _webhook_inbox.start()
+    try:
+        yield
+    finally:
+        await run_in_threadpool(_webhook_inbox.stop)
+        await run_in_threadpool(_mail_queue.stop)
+        _paypal_client.close()
+        _password_hasher.shutdown()
+        close_mongo()
+
+app = FastAPI(title="TKB Shop API", lifespan=lifespan)
 
 # --- 2. CONFIGURATION CORS ---
 app.add_middleware(
@@ -87,13 +236,439 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Lus par le client : relance d'une requete idempotente en cours (409)
+    expose_headers=["Retry-After", "Idempotent-Replayed"],
+)
+
+# --- 2b. COMPRESSION (negociee via Accept-Encoding) ---
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+# Ordre de preference serveur a poids q egal
+SUPPORTED_ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+def _negotiate_encoding(header: str) -> Optional[str]:
+    if not header:
+        return None
+    weights = {}
+    for part in header.split(","):
+        coding, _, params = part.partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[coding.strip().lower()] = weight
+    best, best_weight = None, 0.0
+    for coding in SUPPORTED_ENCODINGS:
+        weight = weights.get(coding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+def _compress(body: bytes, encoding: str, precompressed: bool = False) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=PRECOMPRESS_BROTLI_QUALITY if precompressed else BROTLI_QUALITY)
+    # mtime=0 : meme entree => memes octets (variantes precompressees stables)
+    return gzip.compress(body, compresslevel=PRECOMPRESS_GZIP_LEVEL if precompressed else GZIP_LEVEL, mtime=0)
+
+class _StreamCompressor:
+    """Compression incrementale pour les reponses en plusieurs morceaux (exports)."""
+
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=BROTLI_QUALITY)
+            self._zlib = None
+        else:
+            self._brotli = None
+            self._zlib = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._brotli.process(data) if self._brotli else self._zlib.compress(data)
+
+    def finish(self) -> bytes:
+        return self._brotli.finish() if self._brotli else self._zlib.flush()
+
+class CompressionMiddleware:
+    """Middleware ASGI pur : compresse a la volee les reponses sans Content-Encoding.
+
+    Les reponses catalogue arrivent deja compressees depuis le cache (une
+    compression par version de contenu) et sont transmises telles quelles.
+    """
+
+    def __init__(self, app, minimum_size: int):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = _negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        compressor = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, compressor, passthrough
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if compressor is not None:
+                chunk = compressor.compress(body)
+                if not more_body:
+                    chunk += compressor.finish()
+                if chunk or not more_body:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+                return
+
+            headers = MutableHeaders(raw=start_message["headers"])
+            content_type = headers.get("content-type", "")
+            compressible = (
+                "content-encoding" not in headers
+                and start_message["status"] not in (204, 304)
+                and content_type.startswith(COMPRESSIBLE_TYPES)
+            )
+            if not compressible or (not more_body and len(body) < self.minimum_size):
+                passthrough = True
+                if compressible:
+                    headers.add_vary_header("Accept-Encoding")
+                await send(start_message)
+                await send(message)
+                return
+
+            headers["Content-Encoding"] = encoding
+            headers.add_vary_header("Accept-Encoding")
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                # Representation differente de l'identite : ETag faible (comme nginx)
+                headers["ETag"] = "W/" + etag
+            if more_body:
+                del headers["content-length"]
+                compressor = _StreamCompressor(encoding)
+                await send(start_message)
+                chunk = compressor.compress(body)
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                return
+            body = _compress(body, encoding)
+            headers["Content-Length"] = str(len(body))
+            await send(start_message)
+            await send({"type": "http.response.body", "body": body, "more_body": False})
+
+        await self.app(scope, receive, send_wrapper)
+
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MIN_BYTES)
+
+# --- 2c. METRIQUES (format texte Prometheus) ---
+# Compteurs par process : avec plusieurs workers uvicorn, chaque scrape lit le
+# worker qui repond (agreger cote Prometheus ou exposer un port par worker).
+HTTP_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MONGO_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+OUTBOUND_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0)
+
+def _label_text(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+class Histogram:
+    """Histogramme a seaux fixes ; une observation = un bisect + trois increments."""
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple, buckets: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series: dict = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(labels, list(s[0]), s[1], s[2]) for labels, s in self._series.items()]
+        for labels, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                label_text = _label_text(self.labelnames + ("le",), labels + (le,))
+                lines.append(f"{self.name}_bucket{label_text} {cumulative}")
+            label_text = _label_text(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {total}")
+            lines.append(f"{self.name}_count{label_text} {count}")
+        return lines
+
+class Gauge:
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._values: dict = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, amount: float = 1, *labels):
+        self.inc(-amount, *labels)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_label_text(self.labelnames, labels)} {value}")
+        return lines
+
+HTTP_LATENCY = Histogram(
+    "tkb_http_request_duration_seconds", "Duree des requetes HTTP par route.",
+    ("method", "route", "status"), HTTP_LATENCY_BUCKETS,
+)
+HTTP_IN_FLIGHT = Gauge("tkb_http_requests_in_flight", "Requetes HTTP en cours.")
+MONGO_LATENCY = Histogram(
+    "tkb_mongo_command_duration_seconds", "Duree des commandes MongoDB.",
+    ("command", "collection", "outcome"), MONGO_LATENCY_BUCKETS,
 )
+OUTBOUND_LATENCY = Histogram(
+    "tkb_outbound_call_duration_seconds", "Duree des appels sortants (PayPal, Stripe, SMTP).",
+    ("provider", "operation", "outcome"), OUTBOUND_LATENCY_BUCKETS,
+)
+
+class MetricsMiddleware:
+    """Middleware ASGI pur (pas de BaseHTTPMiddleware) : latence par modele de route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            # Modele (/api/products/{id}) et non chemin brut : cardinalite bornee
+            route = scope.get("route")
+            HTTP_LATENCY.observe(
+                time.perf_counter() - start,
+                scope["method"],
+                getattr(route, "path", "unmatched"),
+                str(status),
+            )
+
+app.add_middleware(MetricsMiddleware)
+
+class CommandMetrics(monitoring.CommandListener):
+    """Duree des commandes Mongo par commande et collection (duration_micros du driver)."""
+
+    def __init__(self):
+        self._collections: dict = {}
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            target = event.command.get("collection")
+        # dict : operations atomiques sous le GIL, pas de verrou sur ce chemin chaud
+        self._collections[(event.connection_id, event.request_id)] = target if isinstance(target, str) else ""
+
+    def _observe(self, event, outcome: str):
+        collection = self._collections.pop((event.connection_id, event.request_id), "")
+        MONGO_LATENCY.observe(event.duration_micros / 1e6, event.command_name, collection, outcome)
+
+    def succeeded(self, event):
+        self._observe(event, "ok")
+
+    def failed(self, event):
+        self._observe(event, "error")
+
+_command_metrics = CommandMetrics()
+
+class _Span:
+    __slots__ = ("outcome",)
+
+    def __init__(self):
+        self.outcome = "ok"
+
+@contextmanager
+def _outbound_span(provider: str, operation: str):
+    span = _Span()
+    start = time.perf_counter()
+    try:
+        yield span
+    except BaseException:
+        span.outcome = "error"
+        raise
+    finally:
+        OUTBOUND_LATENCY.observe(time.perf_counter() - start, provider, operation, span.outcome)
+
+def render_metrics() -> str:
+    lines = []
+    for metric in (HTTP_LATENCY, HTTP_IN_FLIGHT, MONGO_LATENCY, OUTBOUND_LATENCY):
+        lines.extend(metric.render())
+    # Etat du pool lu a la demande depuis les evenements CMAP
+    pool = _pool_stats.snapshot()
+    lines.append("# HELP tkb_mongo_pool_connections Connexions du pool MongoDB par etat.")
+    lines.append("# TYPE tkb_mongo_pool_connections gauge")
+    for address, stats in pool["servers"].items():
+        for state in ("open", "inUse", "waiting"):
+            lines.append(f"tkb_mongo_pool_connections{_label_text(('address', 'state'), (address, state))} {stats[state]}")
+    return "\n".join(lines) + "\n"
 
 # --- 3. CONNEXION BDD ---
 mongo_uri = os.getenv("MONGO_URI", "mongodb://127.0.0.1:27017")
 db_name = os.getenv("MONGO_DB_NAME", "protel_shop")
-client = MongoClient(mongo_uri)
-db = client.get_database(db_name) # Utilisation du nom de base final
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Utilisation du pool par serveur, alimentee par les evenements CMAP du driver."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._servers: dict[str, dict] = {}
+
+    def _update(self, event, **deltas):
+        address = f"{event.address[0]}:{event.address[1]}"
+        with self._lock:
+            stats = self._servers.setdefault(address, {
+                "open": 0, "inUse": 0, "waiting": 0,
+                "created": 0, "closed": 0, "checkoutFailures": 0, "cleared": 0,
+            })
+            for key, value in deltas.items():
+                stats[key] += value
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._update(event, cleared=1)
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._update(event, open=1, created=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._update(event, open=-1, closed=1)
+
+    def connection_check_out_started(self, event):
+        self._update(event, waiting=1)
+
+    def connection_check_out_failed(self, event):
+        self._update(event, waiting=-1, checkoutFailures=1)
+
+    def connection_checked_out(self, event):
+        self._update(event, waiting=-1, inUse=1)
+
+    def connection_checked_in(self, event):
+        self._update(event, inUse=-1)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            servers = {address: dict(stats) for address, stats in self._servers.items()}
+        for stats in servers.values():
+            stats["utilisation"] = round(stats["inUse"] / MONGO_MAX_POOL_SIZE, 3) if MONGO_MAX_POOL_SIZE else None
+        return {"maxPoolSize": MONGO_MAX_POOL_SIZE, "minPoolSize": MONGO_MIN_POOL_SIZE, "servers": servers}
+
+_pool_stats = PoolStats()
+
+class RoutedDatabase(Database):
+    """Database dont certaines collections lisent avec une preference dediee."""
+
+    def __init__(self, client, name: str, read_preferences: dict):
+        super().__init__(client, name)
+        self._read_preferences = read_preferences
+
+    def __getitem__(self, name: str):
+        preference = self._read_preferences.get(name)
+        if preference is None:
+            return super().__getitem__(name)
+        return self.get_collection(name, read_preference=preference)
+
+def _parse_read_preferences(spec: str) -> dict:
+    preferences = {}
+    for part in spec.split(","):
+        name, _, mode = part.strip().partition(":")
+        if name and mode:
+            preferences[name.strip()] = make_read_preference(read_pref_mode_from_name(mode.strip()), None)
+    return preferences
+
+def _mongo_client_options() -> dict:
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "event_listeners": [_pool_stats, _command_metrics],
+    }
+    if MONGO_WAIT_QUEUE_TIMEOUT_MS:
+        options["waitQueueTimeoutMS"] = int(MONGO_WAIT_QUEUE_TIMEOUT_MS)
+    if MONGO_COMPRESSORS:
+        options["compressors"] = MONGO_COMPRESSORS
+    return options
+
+# Ouverts par le lifespan de l'application (ou connect_mongo() dans les scripts).
+# `db` : primaire (ecritures, lectures apres ecriture) ; `read_db` : lectures
+# catalogue / reporting routees selon MONGO_READ_PREFERENCES (primaire par defaut).
+client = None
+db = None
+read_db = None
+
+def connect_mongo():
+    global client, db, read_db
+    if client is None:
+        client = MongoClient(mongo_uri, **_mongo_client_options())
+        db = client.get_database(db_name) # Utilisation du nom de base final
+        read_db = RoutedDatabase(client, db_name, _parse_read_preferences(MONGO_READ_PREFERENCES))
+    return db
+
+def close_mongo():
+    global client, db, read_db
+    if client is not None:
+        client.close()
+    client = db = read_db = None
 
 # --- 4. MODÃˆLES DE DONNÃ‰ES (Pydantic) ---
 
@@ -147,8 +722,9 @@ class Product(BaseModel):
     category: str
     categoryGroup: Optional[str] = None
     subcategory: Optional[str] = None
-    price: float
-    oldPrice: Optional[float] = None
+    # json.loads accepte NaN/Infinity : refuses ici, ils deviendraient null dans l'API (orjson)
+    price: float = Field(ge=0, allow_inf_nan=False)
+    oldPrice: Optional[float] = Field(None, ge=0, allow_inf_nan=False)
     stock: int = 0
     image: str = ""
     images: List[str] = Field(default_factory=list)
@@ -174,6 +750,8 @@ class Order(BaseModel):
     status: str = "En attente"
     paymentId: Optional[str] = None
     createdAt: datetime = Field(default_factory=datetime.now)
+    # Devis signe renvoye par /api/orders/quote (evite la re-tarification)
+    quoteToken: Optional[str] = None
 
 class SiteSettings(BaseModel):
     bannerText: str
@@ -203,17 +781,18 @@ def _coerce_items(items: list):
     return normalized
 
 def _get_products_map(item_list: list):
-    ids = [ObjectId(i["product"]) for i in item_list]
+    # Un meme produit peut apparaitre sur plusieurs lignes (tailles differentes)
+    ids = list({ObjectId(i["product"]) for i in item_list})
     products = {str(p["_id"]): p for p in db.products.find({"_id": {"$in": ids}})}
     if len(products) != len(ids):
         raise HTTPException(400, "Produit introuvable")
     return products
 
 def _check_stock(item_list: list, products_map: dict):
-    for item in item_list:
-        p = products_map.get(item["product"])
+    for product_id, quantity in _stock_quantities(item_list).items():
+        p = products_map.get(str(product_id))
         stock = int(p.get("stock", 0) or 0)
-        if stock < item["quantity"]:
+        if stock < quantity:
             raise HTTPException(409, f"Stock insuffisant pour {p.get('name', 'Produit')}")
 
 def _build_priced_items(item_list: list, products_map: dict):
@@ -237,44 +816,244 @@ def _build_priced_items(item_list: list, products_map: dict):
         total += price * item["quantity"]
     return normalized_items, total
 
-def _decrement_stock(item_list: list, strict: bool = False):
+def _catalog_price_version() -> int:
+    # Compteur partage entre workers, incremente a chaque modification de produit
+    doc = db.counters.find_one({"_id": "catalogPrices"}, {"version": 1})
+    return int(doc["version"]) if doc else 0
+
+def _bump_catalog_price_version():
+    db.counters.update_one({"_id": "catalogPrices"}, {"$inc": {"version": 1}}, upsert=True)
+
+def _cart_hash(item_list: list) -> str:
+    canonical = json.dumps(item_list, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()[:32]
+
+def _issue_quote(user_id: str, item_list: list, normalized_items: list, total: float) -> str:
+    payload = {
+        "typ": "quote",
+        "sub": user_id,
+        "cart": _cart_hash(item_list),
+        "cv": _catalog_price_version(),
+        "items": normalized_items,
+        "total": total,
+        "exp": datetime.utcnow() + timedelta(seconds=QUOTE_TOKEN_TTL_SEC),
+    }
+    return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
+
+def _redeem_quote(token: str, user_id: str, item_list: list):
+    """Articles et total du devis s'il vaut encore pour ce panier, sinon None."""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    if payload.get("typ") != "quote" or payload.get("sub") != user_id:
+        return None
+    if payload.get("cart") != _cart_hash(item_list):
+        return None
+    # Un prix a pu changer depuis le devis : on re-tarifie
+    if payload.get("cv") != _catalog_price_version():
+        return None
+    return payload["items"], float(payload["total"])
+
+def _stock_quantities(item_list: list) -> dict:
+    totals = {}
     for item in item_list:
-        result = db.products.update_one(
-            {"_id": ObjectId(item["product"]), "stock": {"$gte": item["quantity"]}},
-            {"$inc": {"stock": -item["quantity"]}}
-        )
-        if strict and result.modified_count == 0:
+        product_id = ObjectId(item["product"])
+        totals[product_id] = totals.get(product_id, 0) + int(item["quantity"])
+    return totals
+
+class _StockShortage(Exception):
+    pass
+
+_transactions_supported = None
+
+def _supports_transactions() -> bool:
+    # Transactions : replica set ou mongos uniquement (Atlas), pas en standalone
+    global _transactions_supported
+    if _transactions_supported is None:
+        try:
+            hello = client.admin.command("hello")
+        except PyMongoError:
+            return False
+        _transactions_supported = bool(hello.get("setName")) or hello.get("msg") == "isdbgrid"
+    return _transactions_supported
+
+def _reserve_stock(item_list: list, reservation_id: ObjectId | None = None):
+    """Reserve toutes les lignes de la commande en un seul bulk_write, ou aucune (409).
+
+    Avec `reservation_id`, les marqueurs restent sur les produits jusqu'a
+    _settle_stock_reservation : un nouvel essai voit que la reservation est faite.
+    """
+    totals = _stock_quantities(item_list)
+    if not totals:
+        return
+    try:
+        if _supports_transactions():
+            _reserve_stock_transaction(totals, reservation_id)
+        else:
+            _reserve_stock_compensated(totals, reservation_id)
+    finally:
+        # Le stock est expose dans le catalogue : seules les reponses contenant ces
+        # produits sont retirees. Le classement "en stock" de la recherche et des
+        # similaires peut faire entrer un autre produit : ecart borne par le TTL
+        _catalog_cache.invalidate_products(totals)
+
+def _stock_reserved(item_list: list, reservation_id: ObjectId) -> bool:
+    """True si toutes les lignes portent deja le marqueur ; une reservation partielle
+    (crash en cours de bulk_write) est annulee pour etre refaite."""
+    totals = _stock_quantities(item_list)
+    marked = db.products.count_documents({"_id": {"$in": list(totals)}, "stockReservations": reservation_id})
+    if marked and marked == len(totals):
+        return True
+    if marked:
+        _rollback_stock(totals, reservation_id)
+    return False
+
+def _settle_stock_reservation(item_list: list, reservation_id: ObjectId):
+    # Issue de la reservation enregistree ailleurs (commande) : marqueurs inutiles
+    db.products.update_many(
+        {"_id": {"$in": list(_stock_quantities(item_list))}, "stockReservations": reservation_id},
+        {"$pull": {"stockReservations": reservation_id}},
+    )
+
+def _reserve_stock_transaction(totals: dict, reservation_id: ObjectId | None = None):
+    marker = {"$push": {"stockReservations": reservation_id}} if reservation_id is not None else {}
+    ops = [
+        UpdateOne({"_id": pid, "stock": {"$gte": qty}}, {"$inc": {"stock": -qty}, **marker})
+        for pid, qty in totals.items()
+    ]
+
+    def apply(session):
+        result = db.products.bulk_write(ops, ordered=True, session=session)
+        if result.modified_count != len(ops):
+            raise _StockShortage()
+
+    with client.start_session() as session:
+        try:
+            session.with_transaction(apply)
+        except _StockShortage:
             raise HTTPException(409, "Stock insuffisant")
 
+def _reserve_stock_compensated(totals: dict, reservation_id: ObjectId | None = None):
+    # Sans transaction : chaque ligne decrementee porte l'id de reservation,
+    # ce qui permet d'annuler exactement celles-ci si une ligne manque.
+    # Pas de $slice : un marqueur evince laisserait fuir le stock de sa ligne ;
+    # il n'en reste que pendant les reservations en cours.
+    keep_markers = reservation_id is not None
+    reservation_id = reservation_id or ObjectId()
+    ops = [
+        UpdateOne(
+            {"_id": pid, "stock": {"$gte": qty}},
+            {"$inc": {"stock": -qty}, "$push": {"stockReservations": reservation_id}},
+        )
+        for pid, qty in totals.items()
+    ]
+    result = db.products.bulk_write(ops, ordered=False)
+    if result.modified_count == len(ops):
+        if not keep_markers:
+            # Reservation complete : plus rien a annuler, on retire les marqueurs
+            db.products.update_many(
+                {"_id": {"$in": list(totals)}, "stockReservations": reservation_id},
+                {"$pull": {"stockReservations": reservation_id}},
+            )
+        return
+    _rollback_stock(totals, reservation_id)
+    raise HTTPException(409, "Stock insuffisant")
+
+def _rollback_stock(totals: dict, reservation_id: ObjectId):
+    # Filtre sur le marqueur + $pull : chaque ligne n'est rendue qu'une fois
+    rollback = [
+        UpdateOne(
+            {"_id": pid, "stockReservations": reservation_id},
+            {"$inc": {"stock": qty}, "$pull": {"stockReservations": reservation_id}},
+        )
+        for pid, qty in totals.items()
+    ]
+    db.products.bulk_write(rollback, ordered=False)
+
 def _paypal_base_url():
     return "https://api-m.paypal.com" if PAYPAL_ENV == "live" else "https://api-m.sandbox.paypal.com"
 
-def _paypal_get_access_token():
-    if not PAYPAL_CLIENT_ID or not PAYPAL_CLIENT_SECRET:
-        raise HTTPException(500, "PayPal non configure")
-    base = _paypal_base_url()
-    auth = base64.b64encode(f"{PAYPAL_CLIENT_ID}:{PAYPAL_CLIENT_SECRET}".encode()).decode()
-    data = urllib.parse.urlencode({"grant_type": "client_credentials"}).encode()
-    req = urllib.request.Request(f"{base}/v1/oauth2/token", data=data, method="POST")
-    req.add_header("Authorization", f"Basic {auth}")
-    req.add_header("Content-Type", "application/x-www-form-urlencoded")
-    try:
-        with urllib.request.urlopen(req, timeout=20) as resp:
-            payload = json.loads(resp.read().decode())
-    except urllib.error.HTTPError as e:
-        raise HTTPException(502, f"PayPal token error: {e.code}")
-    return payload.get("access_token")
+class PayPalClient:
+    """Client PayPal partage : connexions keep-alive et jeton OAuth en cache.
+
+    Le jeton est reutilise jusqu'a PAYPAL_TOKEN_REFRESH_MARGIN_SEC avant son
+    `expires_in` ; un seul thread le renouvelle, les autres attendent le verrou
+    puis reprennent le jeton frais.
+    """
+
+    def __init__(self):
+        # Aucune connexion n'est ouverte avant la premiere requete
+        self.http = httpx.Client(
+            base_url=_paypal_base_url(),
+            timeout=httpx.Timeout(PAYPAL_TIMEOUT_SEC, connect=5.0),
+            limits=httpx.Limits(max_connections=PAYPAL_POOL_SIZE, max_keepalive_connections=PAYPAL_POOL_SIZE),
+        )
+        self._token = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def access_token(self) -> str:
+        token = self._token
+        if token and time.monotonic() < self._expires_at:
+            return token
+        with self._lock:
+            # Un autre thread a pu renouveler pendant l'attente du verrou
+            if self._token and time.monotonic() < self._expires_at:
+                return self._token
+            payload = self._request_token()
+            expires_in = float(payload.get("expires_in") or 0)
+            self._token = payload.get("access_token")
+            self._expires_at = time.monotonic() + max(0.0, expires_in - PAYPAL_TOKEN_REFRESH_MARGIN_SEC)
+            return self._token
+
+    def invalidate(self, token: str):
+        with self._lock:
+            if self._token == token:
+                self._token = None
+                self._expires_at = 0.0
+
+    def _request_token(self) -> dict:
+        if not PAYPAL_CLIENT_ID or not PAYPAL_CLIENT_SECRET:
+            raise HTTPException(500, "PayPal non configure")
+        with _outbound_span("paypal", "oauth_token"):
+            try:
+                resp = self.http.post(
+                    "/v1/oauth2/token",
+                    data={"grant_type": "client_credentials"},
+                    auth=(PAYPAL_CLIENT_ID, PAYPAL_CLIENT_SECRET),
+                )
+            except httpx.HTTPError:
+                raise HTTPException(502, "PayPal token error: connexion")
+            if resp.status_code >= 400:
+                raise HTTPException(502, f"PayPal token error: {resp.status_code}")
+        return resp.json()
+
+    def get(self, path: str, operation: str = "get") -> dict:
+        for attempt in range(2):
+            token = self.access_token()
+            with _outbound_span("paypal", operation) as span:
+                try:
+                    resp = self.http.get(path, headers={"Authorization": f"Bearer {token}"})
+                except httpx.HTTPError:
+                    raise HTTPException(502, "PayPal order error: connexion")
+                if resp.status_code == 401 and attempt == 0:
+                    span.outcome = "unauthorized"
+            if span.outcome == "unauthorized":
+                # Jeton revoque avant son expiration annoncee : un renouvellement
+                self.invalidate(token)
+                continue
+            if resp.status_code >= 400:
+                raise HTTPException(502, f"PayPal order error: {resp.status_code}")
+            return resp.json()
+
+    def close(self):
+        self.http.close()
+
+_paypal_client = PayPalClient()
 
 def _paypal_fetch_order(order_id: str):
-    token = _paypal_get_access_token()
-    base = _paypal_base_url()
-    req = urllib.request.Request(f"{base}/v2/checkout/orders/{order_id}")
-    req.add_header("Authorization", f"Bearer {token}")
-    try:
-        with urllib.request.urlopen(req, timeout=20) as resp:
-            return json.loads(resp.read().decode())
-    except urllib.error.HTTPError as e:
-        raise HTTPException(502, f"PayPal order error: {e.code}")
+    return _paypal_client.get(f"/v2/checkout/orders/{urllib.parse.quote(order_id, safe='')}", "fetch_order")
 
 def _paypal_verify_order(order_id: str, expected_total: float):
     order = _paypal_fetch_order(order_id)
@@ -298,6 +1077,930 @@ def _paypal_verify_order(order_id: str, expected_total: float):
         raise HTTPException(400, "Montant PayPal invalide")
     return order
 
+# --- 4b bis. IDEMPOTENCE (en-tete Idempotency-Key) ---
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+class IdempotencyStore:
+    """Reponses memorisees par cle (collection idempotency_keys, index TTL).
+
+    Le premier appel pose un document "pending" en un seul upsert ; les
+    rejeux lisent la reponse stockee (code et corps), un doublon concurrent
+    recoit aussitot 409 + Retry-After plutot que d'occuper un worker a attendre.
+    """
+
+    def __init__(self, ttl_sec: int, lease_sec: int):
+        self.ttl_sec = ttl_sec
+        self.lease_sec = lease_sec
+
+    def run(self, scope: str, user_id: str, key: Optional[str], payload, handler):
+        if key is None:
+            return handler()
+        key = key.strip()
+        if not key or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise HTTPException(400, "Idempotency-Key invalide")
+        doc_id = f"{scope}:{user_id}:{key}"
+        request_hash = hashlib.sha256(_json_bytes(payload)).hexdigest()
+
+        existing = self._acquire(doc_id, request_hash)
+        if existing is None:
+            return self._execute(doc_id, handler)
+        if existing.get("requestHash") != request_hash:
+            raise HTTPException(422, "Idempotency-Key deja utilisee pour une autre requete")
+        if existing.get("state") == "done":
+            return Response(
+                content=existing["body"],
+                status_code=existing.get("statusCode", 200),
+                media_type="application/json",
+                headers={"Idempotent-Replayed": "true"},
+            )
+        # Premier appel encore en cours : le client reessaiera et lira la reponse stockee
+        raise HTTPException(409, "Requete identique en cours", headers={"Retry-After": "1"})
+
+    def _acquire(self, doc_id: str, request_hash: str):
+        """None si l'appelant devient proprietaire de la cle, sinon le document existant."""
+        now = datetime.utcnow()
+        lease = {"state": "pending", "leaseUntil": now + timedelta(seconds=self.lease_sec)}
+        try:
+            existing = db.idempotency_keys.find_one_and_update(
+                {"_id": doc_id},
+                {"$setOnInsert": {
+                    **lease,
+                    "requestHash": request_hash,
+                    "createdAt": now,
+                    "expiresAt": now + timedelta(seconds=self.ttl_sec),
+                }},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # Deux upserts simultanes : le perdant relit le document du gagnant
+            existing = db.idempotency_keys.find_one({"_id": doc_id})
+        if existing is None or existing.get("state") == "done" or existing.get("requestHash") != request_hash:
+            return existing
+        # Proprietaire disparu (crash, timeout) : bail expire, on reprend la cle
+        taken = db.idempotency_keys.find_one_and_update(
+            {"_id": doc_id, "state": "pending", "leaseUntil": {"$lt": now}},
+            {"$set": lease},
+        )
+        return None if taken is not None else existing
+
+    def _execute(self, doc_id: str, handler):
+        try:
+            result = handler()
+        except BaseException:
+            # Echec (stock, paiement refuse, erreur reseau) : la cle est liberee et
+            # un nouvel essai rejoue entierement la requete
+            db.idempotency_keys.delete_one({"_id": doc_id, "state": "pending"})
+            raise
+        # Le handler peut renvoyer une Response (201, 202...) : le rejeu garde son code
+        if isinstance(result, Response):
+            status_code, body = result.status_code, bytes(result.body)
+        else:
+            status_code, body = 200, _json_bytes(result)
+        try:
+            db.idempotency_keys.update_one(
+                {"_id": doc_id},
+                {"$set": {"state": "done", "statusCode": status_code, "body": body, "completedAt": datetime.utcnow()},
+                 "$unset": {"leaseUntil": ""}},
+            )
+        except PyMongoError as e:
+            logger.error("Reponse idempotente non enregistree (%s): %s", doc_id, e)
+        return result
+
+_idempotency = IdempotencyStore(IDEMPOTENCY_TTL_SEC, IDEMPOTENCY_LEASE_SEC)
+
+# --- 4c. OUTILS CATALOGUE (miroir de frontend/src/utils/product.js) ---
+CATEGORY_GROUPS = [
+    {"label": "Sacs", "subcategories": []},
+    {"label": "Chaussures", "subcategories": ["Femme", "Homme", "Bebe"]},
+    {"label": "Accessoires", "subcategories": ["Colliers", "Bagues", "Bracelets"]},
+    {"label": "Vetements", "subcategories": ["Robes", "Abayas", "Voiles & Hijabs"]},
+]
+
+GROUP_ALIASES = {
+    "sac": "Sacs",
+    "sacs": "Sacs",
+    "chaussure": "Chaussures",
+    "chaussures": "Chaussures",
+    "chassure": "Chaussures",
+    "chassures": "Chaussures",
+    "accessoire": "Accessoires",
+    "accessoires": "Accessoires",
+    "vetement": "Vetements",
+    "vetements": "Vetements",
+    "vatement": "Vetements",
+    "vatements": "Vetements",
+}
+
+CATEGORY_SLUG_ALIASES = {
+    "sac": "sacs",
+    "chaussure": "chaussures",
+    "accessoire": "accessoires",
+    "vetement": "vetements",
+}
+
+# Tri -> cles de tri Mongo (toujours terminees par _id pour un curseur stable)
+PRODUCT_SORTS = {
+    "recent": [("_id", -1)],
+    "price-asc": [("price", 1), ("_id", 1)],
+    "price-desc": [("price", -1), ("_id", -1)],
+    "name-asc": [("name", 1), ("_id", 1)],
+}
+
+# Vue -> projection Mongo ; "card" = champs lus par les cartes de grille du front
+PRODUCT_CARD_FIELDS = (
+    "name", "price", "oldPrice", "image", "category", "categoryGroup",
+    "subcategory", "stock", "status", "createdAt",
+)
+CARD_IMAGES_MAX = 4
+CARD_DESCRIPTION_MAX = 90
+PRODUCT_VIEWS = {
+    "full": None,
+    "card": {
+        **{field: 1 for field in PRODUCT_CARD_FIELDS},
+        "images": {"$slice": CARD_IMAGES_MAX},
+        "description": 1,
+    },
+}
+
+# Index composes alignes sur les filtres + tris de GET /api/products
+PRODUCT_INDEXES = [
+    [("groupKey", 1), ("_id", -1)],
+    [("groupKey", 1), ("subcategoryKey", 1), ("_id", -1)],
+    # Page categorie filtree par sous-categorie seule (tous groupes confondus)
+    [("subcategoryKey", 1), ("_id", -1)],
+    [("groupKey", 1), ("price", 1), ("_id", 1)],
+    [("groupKey", 1), ("name", 1), ("_id", 1)],
+    [("status", 1), ("_id", -1)],
+    [("price", 1), ("_id", 1)],
+    [("name", 1), ("_id", 1)],
+    [("searchIndex.t", 1)],
+]
+
+# Index commandes : liste admin (keyset createdAt) + filtres, historique client
+ORDER_INDEXES = [
+    [("createdAt", -1), ("_id", -1)],
+    [("status", 1), ("createdAt", -1), ("_id", -1)],
+    [("paymentMethod", 1), ("createdAt", -1), ("_id", -1)],
+    [("userEmail", 1), ("createdAt", -1), ("_id", -1)],
+    [("userId", 1), ("createdAt", -1), ("_id", -1)],
+]
+ADMIN_ORDERS_SORT = [("createdAt", -1), ("_id", -1)]
+# Ordre des exports admin : filtre createdAt et tri servis par (createdAt, _id)
+# parcouru a l'envers ; c'est aussi la cle du curseur de reprise.
+EXPORT_SORT = [("createdAt", 1), ("_id", 1)]
+
+# Registre declaratif des index : (collection, cles, options), applique au
+# demarrage. create_index est idempotent pour une definition identique.
+INDEX_REGISTRY = [
+    *[("products", keys, {}) for keys in PRODUCT_INDEXES],
+    ("product_neighbours", [("neighbours.id", 1)], {}),
+    *[("orders", keys, {}) for keys in ORDER_INDEXES],
+    ("users", [("email", 1)], {"unique": True}),
+    ("newsletter", [("email", 1)], {"unique": True}),
+    ("users", [("createdAt", -1), ("_id", -1)], {}),
+    ("newsletter", [("createdAt", -1), ("_id", -1)], {}),
+    ("password_resets", [("tokenHash", 1)], {"unique": True}),
+    ("password_resets", [("userId", 1), ("usedAt", 1)], {}),
+    ("password_resets", [("expiresAt", 1)], {"expireAfterSeconds": 0}),
+    ("admin_invites", [("tokenHash", 1)], {"unique": True}),
+    ("admin_invites", [("userId", 1), ("usedAt", 1)], {}),
+    ("admin_invites", [("expiresAt", 1)], {"expireAfterSeconds": 0}),
+    ("email_outbox", [("status", 1), ("nextAttemptAt", 1)], {}),
+    ("email_outbox", [("status", 1), ("lockedUntil", 1)], {}),
+    ("email_outbox", [("sentAt", 1)], {"expireAfterSeconds": EMAIL_SENT_RETENTION_DAYS * 86400}),
+    ("stripe_events", [("status", 1), ("nextAttemptAt", 1)], {}),
+    ("stripe_events", [("status", 1), ("lockedUntil", 1)], {}),
+    ("stripe_events", [("lockedBy", 1)], {"sparse": True}),
+    ("stripe_events", [("processedAt", 1)], {"expireAfterSeconds": WEBHOOK_EVENT_RETENTION_DAYS * 86400}),
+    ("rate_limits", [("expiresAt", 1)], {"expireAfterSeconds": 0}),
+    ("idempotency_keys", [("expiresAt", 1)], {"expireAfterSeconds": 0}),
+]
+
+# Requetes chaudes de main.py : (nom, collection, filtre, tri) verifiees par explain()
+HOT_QUERIES = [
+    ("users.email", "users", {"email": "x@example.com"}, None),
+    ("newsletter.email", "newsletter", {"email": "x@example.com"}, None),
+    ("password_resets.tokenHash", "password_resets", {"tokenHash": "0" * 64, "usedAt": None}, None),
+    ("admin_invites.tokenHash", "admin_invites", {"tokenHash": "0" * 64, "usedAt": None}, None),
+    ("orders.mine", "orders", {"userId": "0" * 24}, [("createdAt", -1)]),
+    ("orders.admin", "orders", {}, ADMIN_ORDERS_SORT),
+    ("orders.status", "orders", {"status": "En attente"}, ADMIN_ORDERS_SORT),
+    ("orders.export", "orders", {"createdAt": {"$gte": datetime(2000, 1, 1)}}, EXPORT_SORT),
+    ("products.group", "products", {"groupKey": "sacs"}, [("_id", -1)]),
+    ("products.price", "products", {"groupKey": "sacs"}, [("price", 1), ("_id", 1)]),
+    ("products.subcategory", "products", {"subcategoryKey": "robes"}, [("_id", -1)]),
+    ("products.search", "products", {"searchIndex.t": "sac"}, None),
+    ("product_neighbours.reverse", "product_neighbours", {"neighbours.id": ObjectId("0" * 24)}, None),
+    ("email_outbox.claim", "email_outbox", {"status": "pending", "nextAttemptAt": {"$lte": datetime(2000, 1, 1)}}, [("nextAttemptAt", 1)]),
+    ("stripe_events.claim", "stripe_events", {"status": "pending", "nextAttemptAt": {"$lte": datetime(2000, 1, 1)}}, [("nextAttemptAt", 1)]),
+]
+
+# Poids des champs pour le classement de la recherche
+SEARCH_FIELD_WEIGHTS = (("name", 5), ("group", 3), ("subcategory", 3), ("category", 2), ("description", 1))
+
+def _normalize_text(value) -> str:
+    text = unicodedata.normalize("NFD", str(value or "").lower())
+    text = "".join(ch for ch in text if not ("\u0300" <= ch <= "\u036f"))
+    return text.replace("ª", "").replace("º", "").strip()
+
+def _slugify(value) -> str:
+    text = _normalize_text(value).replace("&", "et")
+    return re.sub(r"[^a-z0-9]+", "-", text).strip("-")
+
+def _resolve_group(raw) -> str:
+    key = _normalize_text(raw)
+    if key in GROUP_ALIASES:
+        return GROUP_ALIASES[key]
+    for group in CATEGORY_GROUPS:
+        base = _normalize_text(group["label"])
+        group_keys = {base}
+        if base.endswith("s"):
+            group_keys.add(base[:-1])
+        for k in group_keys:
+            if k and (key == k or k in key):
+                return group["label"]
+        for sub in group["subcategories"]:
+            sub_key = _normalize_text(sub)
+            if sub_key and (key == sub_key or sub_key in key):
+                return group["label"]
+    return raw or ""
+
+def _group_slug(value) -> str:
+    slug = _slugify(value)
+    return CATEGORY_SLUG_ALIASES.get(slug, slug)
+
+def _product_keys(p: dict) -> dict:
+    # Cles denormalisees pour filtrer cote serveur via index
+    group = _resolve_group(p.get("categoryGroup") or p.get("category") or "")
+    return {
+        "groupKey": _group_slug(group),
+        "subcategoryKey": _slugify(p.get("subcategory") or ""),
+    }
+
+def _search_tokens(value) -> list:
+    # Memes regles que slugify() cote front : NFD, sans accents, "&" -> "et"
+    return [t for t in _slugify(value).split("-") if len(t) > 1]
+
+def _query_tokens(value) -> list:
+    tokens = []
+    for t in _search_tokens(value):
+        alias = GROUP_ALIASES.get(t)
+        tokens.append(_normalize_text(alias) if alias else t)
+    return tokens
+
+def _search_entries(p: dict) -> list:
+    """Postings du produit pour l'index inverse (champ multikey searchIndex.t)."""
+    sources = {
+        "name": p.get("name"),
+        "group": _resolve_group(p.get("categoryGroup") or p.get("category") or ""),
+        "subcategory": p.get("subcategory"),
+        "category": p.get("category"),
+        "description": p.get("description"),
+    }
+    weights = {}
+    for field, weight in SEARCH_FIELD_WEIGHTS:
+        tokens = _search_tokens(sources[field])
+        if field == "description":
+            tokens = list(dict.fromkeys(tokens))[:SEARCH_DESCRIPTION_TOKENS]
+        for t in tokens:
+            weights[t] = max(weights.get(t, 0), weight)
+    return [{"t": t, "w": w} for t, w in weights.items()]
+
+def _serialize_card(p: dict) -> dict:
+    # Meme extrait que les cartes du front (89 caracteres + ellipse)
+    description = (p.get("description") or "").strip()
+    if len(description) > CARD_DESCRIPTION_MAX:
+        p["description"] = description[:CARD_DESCRIPTION_MAX - 1] + "\u2026"
+    return _serialize_product(p)
+
+def _serialize_product(p: dict) -> dict:
+    if "createdAt" not in p and isinstance(p.get("_id"), ObjectId):
+        p["createdAt"] = p["_id"].generation_time
+    p["id"] = str(p["_id"])
+    del p["_id"]
+    p.pop("groupKey", None)
+    p.pop("subcategoryKey", None)
+    p.pop("searchIndex", None)
+    p.pop("stockReservations", None)
+    return p
+
+def _cursor_value(value):
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    return value
+
+def _encode_cursor(doc: dict, sort_keys: list) -> str:
+    values = [str(doc["_id"]) if field == "_id" else _cursor_value(doc.get(field)) for field, _ in sort_keys]
+    raw = json.dumps(values, default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(cursor: str, sort_keys: list) -> dict:
+    # Keyset : (f1, f2, ..., _id) strictement apres le dernier element vu
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw.decode())
+        if not isinstance(values, list) or len(values) != len(sort_keys):
+            raise ValueError
+        if not ObjectId.is_valid(values[-1]):
+            raise ValueError
+        values[-1] = ObjectId(values[-1])
+        values = [
+            datetime.fromisoformat(v["$date"]) if isinstance(v, dict) and "$date" in v else v
+            for v in values
+        ]
+    except (ValueError, TypeError, UnicodeDecodeError):
+        raise HTTPException(400, "Curseur invalide")
+
+    clauses = []
+    for i, (field, direction) in enumerate(sort_keys):
+        clause = {f: values[j] for j, (f, _) in enumerate(sort_keys[:i])}
+        clause[field] = {"$gt" if direction == 1 else "$lt": values[i]}
+        clauses.append(clause)
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+def _build_products_query(
+    category: Optional[str] = None,
+    categoryGroup: Optional[str] = None,
+    subcategory: Optional[str] = None,
+    status_value: Optional[str] = None,
+    minPrice: Optional[float] = None,
+    maxPrice: Optional[float] = None,
+    size: Optional[str] = None,
+    color: Optional[str] = None,
+) -> dict:
+    query = {}
+    if categoryGroup:
+        query["groupKey"] = _group_slug(_resolve_group(categoryGroup))
+    if category:
+        query["category"] = category
+    if subcategory:
+        query["subcategoryKey"] = _slugify(subcategory)
+    if status_value:
+        query["status"] = status_value
+    if minPrice is not None or maxPrice is not None:
+        price_filter = {}
+        if minPrice is not None:
+            price_filter["$gte"] = minPrice
+        if maxPrice is not None:
+            price_filter["$lte"] = maxPrice
+        query["price"] = price_filter
+    if size:
+        query["sizes"] = size
+    if color:
+        query["colors"] = color
+    return query
+
+def _ensure_indexes():
+    for collection, keys, options in INDEX_REGISTRY:
+        try:
+            db[collection].create_index(keys, **options)
+        except OperationFailure as e:
+            # Duree TTL modifiee par configuration : on met a jour l'index existant
+            if e.code == 85 and "expireAfterSeconds" in options:
+                db.command("collMod", collection, index={
+                    "keyPattern": dict(keys), "expireAfterSeconds": options["expireAfterSeconds"],
+                })
+            else:
+                # Ex. doublons empechant un index unique : l'API demarre quand meme
+                logger.warning("Index %s %s non cree: %s", collection, keys, e)
+        except PyMongoError as e:
+            logger.warning("Index %s %s non cree: %s", collection, keys, e)
+
+def _plan_stages(plan) -> list[str]:
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(_plan_stages(value))
+    return stages
+
+def _assess_plan(explain: dict, sorted_query: bool) -> dict:
+    """Verdict sur un explain "executionStats" : COLLSCAN, tri bloquant ou index peu selectif."""
+    stages = _plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {}))
+    stats = explain.get("executionStats", {})
+    returned = stats.get("nReturned", 0)
+    examined = max(stats.get("totalKeysExamined", 0), stats.get("totalDocsExamined", 0))
+    problems = []
+    if "COLLSCAN" in stages:
+        problems.append("collscan")
+    if sorted_query and "SORT" in stages:
+        problems.append("blocking_sort")
+    # Un IXSCAN qui parcourt toute la collection pour filtrer n'est pas mieux qu'un COLLSCAN
+    if examined > INDEX_CHECK_MIN_EXAMINED and examined > INDEX_CHECK_MAX_EXAMINED_RATIO * max(returned, 1):
+        problems.append("unselective")
+    return {
+        "stages": stages,
+        "nReturned": returned,
+        "totalKeysExamined": stats.get("totalKeysExamined", 0),
+        "totalDocsExamined": stats.get("totalDocsExamined", 0),
+        "problems": problems,
+        "ok": not problems,
+    }
+
+def check_index_usage() -> list[dict]:
+    """Explain "executionStats" de chaque requete chaude (a lancer sur un vrai mongod
+    avec des donnees representatives : sur une collection vide tout passe)."""
+    report = []
+    for name, collection, query, sort in HOT_QUERIES:
+        command = {"find": collection, "filter": query, "limit": 50}
+        if sort:
+            command["sort"] = dict(sort)
+        explain = db.command("explain", command, verbosity="executionStats")
+        report.append({"query": name, **_assess_plan(explain, bool(sort))})
+    return report
+
+def _backfill_product_keys():
+    # Rattrapage des produits crees avant l'ajout des cles de filtre
+    for p in db.products.find({"groupKey": {"$exists": False}}, {"category": 1, "categoryGroup": 1, "subcategory": 1}):
+        db.products.update_one({"_id": p["_id"]}, {"$set": _product_keys(p)})
+    search_fields = {"name": 1, "category": 1, "categoryGroup": 1, "subcategory": 1, "description": 1}
+    for p in db.products.find({"searchIndex": {"$exists": False}}, search_fields):
+        db.products.update_one({"_id": p["_id"]}, {"$set": {"searchIndex": _search_entries(p)}})
+
+# --- 4c bis. PRODUITS SIMILAIRES (voisins precalcules) ---
+SIMILAR_FIELDS = {"category": 1, "groupKey": 1, "subcategoryKey": 1, "price": 1, "colors": 1, "sizes": 1}
+
+def _jaccard(a, b) -> float:
+    a, b = set(a or []), set(b or [])
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def _similarity_score(a: dict, b: dict) -> float:
+    score = 0.0
+    if a.get("groupKey") and a.get("groupKey") == b.get("groupKey"):
+        score += 4
+    if a.get("subcategoryKey") and a.get("subcategoryKey") == b.get("subcategoryKey"):
+        score += 2
+    if a.get("category") and a.get("category") == b.get("category"):
+        score += 1
+    pa, pb = float(a.get("price") or 0), float(b.get("price") or 0)
+    if pa > 0 and pb > 0:
+        score += 2 * (1 - min(1.0, abs(pa - pb) / max(pa, pb)))
+    score += 1.5 * _jaccard(a.get("colors"), b.get("colors"))
+    score += _jaccard(a.get("sizes"), b.get("sizes"))
+    return round(score, 4)
+
+def _rank_neighbours(neighbours: list) -> list:
+    neighbours.sort(key=lambda n: (-n["score"], str(n["id"])))
+    return neighbours[:SIMILAR_STORED]
+
+def _similar_candidates(p: dict) -> list:
+    others = {"_id": {"$ne": p["_id"]}}
+    docs = list(db.products.find({**others, "groupKey": p.get("groupKey")}, SIMILAR_FIELDS).limit(SIMILAR_CANDIDATES_MAX))
+    if len(docs) < SIMILAR_STORED:
+        # Petit groupe : on complete avec le reste du catalogue
+        seen = {d["_id"] for d in docs}
+        for d in db.products.find(others, SIMILAR_FIELDS).sort("_id", -1).limit(SIMILAR_STORED * 2):
+            if d["_id"] not in seen:
+                docs.append(d)
+    return docs
+
+def _compute_neighbours(p: dict, candidates: Optional[list] = None) -> list:
+    if candidates is None:
+        candidates = _similar_candidates(p)
+    neighbours = _rank_neighbours([{"id": c["_id"], "score": _similarity_score(p, c)} for c in candidates])
+    db.product_neighbours.update_one(
+        {"_id": p["_id"]},
+        {"$set": {"neighbours": neighbours, "updatedAt": datetime.utcnow()}},
+        upsert=True,
+    )
+    return neighbours
+
+def _recompute_neighbours(ids):
+    for p in db.products.find({"_id": {"$in": list(ids)}}, SIMILAR_FIELDS):
+        _compute_neighbours(p)
+
+def _refresh_neighbours(pid: ObjectId):
+    """Met a jour la liste du produit puis celles des voisins impactes, sans rescanner le catalogue."""
+    p = db.products.find_one({"_id": pid}, SIMILAR_FIELDS)
+    if not p:
+        _remove_neighbours(pid)
+        return
+    candidates = _similar_candidates(p)
+    _compute_neighbours(p, candidates)
+
+    by_id = {c["_id"]: c for c in candidates}
+    ops = []
+    full_recompute = set()
+    for doc in db.product_neighbours.find({"_id": {"$in": list(by_id)}}):
+        current = doc.get("neighbours") or []
+        others = [n for n in current if n["id"] != pid]
+        score = _similarity_score(by_id[doc["_id"]], p)
+        was_listed = len(others) != len(current)
+        list_full = len(current) >= SIMILAR_STORED
+        floor = others[-1]["score"] if others else 0
+        if was_listed and list_full and score < floor:
+            # Le produit recule : le remplacant n'est pas connu, recalcul complet
+            full_recompute.add(doc["_id"])
+            continue
+        if not was_listed and list_full and score <= current[-1]["score"]:
+            continue
+        updated = _rank_neighbours(others + [{"id": pid, "score": score}])
+        if updated != current:
+            ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"neighbours": updated, "updatedAt": datetime.utcnow()}}))
+    if ops:
+        db.product_neighbours.bulk_write(ops, ordered=False)
+
+    # Produits qui listaient celui-ci mais ne sont plus candidats (changement de groupe)
+    for doc in db.product_neighbours.find({"neighbours.id": pid, "_id": {"$nin": list(by_id) + [pid]}}, {"_id": 1}):
+        full_recompute.add(doc["_id"])
+    if full_recompute:
+        _recompute_neighbours(full_recompute)
+
+def _remove_neighbours(pid: ObjectId):
+    db.product_neighbours.delete_one({"_id": pid})
+    impacted = [doc["_id"] for doc in db.product_neighbours.find({"neighbours.id": pid}, {"_id": 1})]
+    if impacted:
+        _recompute_neighbours(impacted)
+
+def _load_similar(id: str, limit: int):
+    if not ObjectId.is_valid(id):
+        raise HTTPException(400, "Format d'ID invalide")
+    pid = ObjectId(id)
+    doc = read_db.product_neighbours.find_one({"_id": pid})
+    if doc is not None:
+        neighbours = doc.get("neighbours") or []
+    else:
+        # Calcul paresseux pour les produits anterieurs a la table
+        p = read_db.products.find_one({"_id": pid}, SIMILAR_FIELDS)
+        if not p:
+            raise HTTPException(404, "Produit introuvable")
+        neighbours = _compute_neighbours(p)
+
+    products = {p["_id"]: p for p in read_db.products.find({"_id": {"$in": [n["id"] for n in neighbours]}})}
+
+    def live_score(n):
+        in_stock = int(products[n["id"]].get("stock", 0) or 0) > 0
+        return n["score"] + (SIMILAR_IN_STOCK_BONUS if in_stock else 0)
+
+    ranked = sorted((n for n in neighbours if n["id"] in products), key=live_score, reverse=True)
+    return [_serialize_product(products[n["id"]]) for n in ranked[:limit]]
+
+def _startup_catalog():
+    # L'API reste disponible si Mongo refuse : les requetes fonctionnent sans index
+    _ensure_indexes()
+    try:
+        _backfill_product_keys()
+    except PyMongoError as e:
+        logger.warning("Cles produits non rattrapees: %s", e)
+
+# --- 4d. CACHE CATALOGUE (LRU versionne + ETag) ---
+class CatalogCache:
+    """Reponses catalogue deja serialisees, invalidees a chaque ecriture produit.
+
+    Une ecriture produit vide tout le cache (bump) ; un mouvement de stock ne retire
+    que les reponses contenant les produits concernes (invalidate_products).
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl_sec: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_sec = ttl_sec
+        self.version = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._by_product: dict[str, set] = {}
+        self._size = 0
+        # Generation de la derniere invalidation par produit (bornee, cf. PrincipalCache)
+        self._generation = 0
+        self._invalidated: OrderedDict = OrderedDict()
+        self._floor = 0
+        self._lock = threading.Lock()
+
+    def bump(self):
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+            self._by_product.clear()
+            self._size = 0
+
+    def ticket(self) -> tuple[int, int]:
+        """(version, generation) a prendre avant de calculer une reponse, puis a passer a put."""
+        with self._lock:
+            return self.version, self._generation
+
+    def invalidate_products(self, product_ids):
+        with self._lock:
+            for pid in map(str, product_ids):
+                self._generation += 1
+                self._invalidated[pid] = self._generation
+                self._invalidated.move_to_end(pid)
+                for key in list(self._by_product.get(pid, ())):
+                    self._drop(key)
+            while len(self._invalidated) > max(1, self.max_entries):
+                _, self._floor = self._invalidated.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            version, expires_at, body, etag, _, _ = entry
+            if version != self.version or expires_at <= time.monotonic():
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return body, etag
+
+    def encoded(self, key, body: bytes, encoding: str) -> bytes:
+        """Variante compressee de `body`, calculee une fois par version de l'entree."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is body and encoding in entry[4]:
+                return entry[4][encoding]
+        data = _compress(body, encoding, precompressed=True)
+        with self._lock:
+            entry = self._entries.get(key)
+            # L'entree a pu etre remplacee pendant la compression : on ne la rattache pas
+            if entry is not None and entry[2] is body and encoding not in entry[4]:
+                entry[4][encoding] = data
+                self._size += len(data)
+                self._evict()
+        return data
+
+    def put(self, key, ticket: tuple[int, int], body: bytes, etag: str, product_ids: frozenset = frozenset()):
+        if len(body) > self.max_bytes:
+            return
+        version, generation = ticket
+        with self._lock:
+            # Une ecriture a eu lieu pendant le calcul : on ne fige pas un etat perime
+            if version != self.version:
+                return
+            if product_ids and (
+                generation < self._floor or any(self._invalidated.get(pid, 0) > generation for pid in product_ids)
+            ):
+                return
+            self._drop(key)
+            self._entries[key] = (version, time.monotonic() + self.ttl_sec, body, etag, {}, product_ids)
+            for pid in product_ids:
+                self._by_product.setdefault(pid, set()).add(key)
+            self._size += len(body)
+            self._evict()
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._size > self.max_bytes):
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._size -= len(entry[2]) + sum(len(v) for v in entry[4].values())
+        for pid in entry[5]:
+            keys = self._by_product.get(pid)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_product[pid]
+
+_catalog_cache = CatalogCache(CATALOG_CACHE_MAX_ENTRIES, CATALOG_CACHE_MAX_BYTES, CATALOG_CACHE_TTL_SEC)
+
+def _orjson_default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Type non serialisable: {type(value).__name__}")
+
+def _json_bytes(payload) -> bytes:
+    # orjson encode datetime nativement (ISO 8601, comme jsonable_encoder) sans
+    # la passe jsonable_encoder element par element
+    return orjson.dumps(payload, default=_orjson_default)
+
+class FastJSONResponse(Response):
+    """JSONResponse encodee par orjson ; a retourner directement depuis la route."""
+
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return _json_bytes(content)
+
+@app.exception_handler(RequestValidationError)
+async def validation_error_handler(request: Request, exc: RequestValidationError):
+    # Meme corps que le gestionnaire par defaut, mais un NaN/Infinity recu (json.loads
+    # l'accepte) ressort en null au lieu de faire echouer json.dumps en 500
+    return FastJSONResponse(status_code=422, content={"detail": jsonable_encoder(exc.errors())})
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [c.strip() for c in header.split(",")]
+    return "*" in candidates or any(c.removeprefix("W/") == etag for c in candidates)
+
+def _payload_product_ids(payload, found: set | None = None) -> frozenset:
+    # Ids des produits presents dans une reponse (listes, pages, fiche, bootstrap)
+    found = set() if found is None else found
+    if isinstance(payload, dict):
+        if isinstance(payload.get("id"), str):
+            found.add(payload["id"])
+        for value in payload.values():
+            if isinstance(value, (dict, list)):
+                _payload_product_ids(value, found)
+    elif isinstance(payload, list):
+        for value in payload:
+            _payload_product_ids(value, found)
+    return frozenset(found)
+
+def _cached_body(key, build) -> tuple[bytes, str]:
+    cached = _catalog_cache.get(key)
+    if cached is not None:
+        return cached
+    ticket = _catalog_cache.ticket()
+    payload = build()
+    body = _json_bytes(payload)
+    etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+    _catalog_cache.put(key, ticket, body, etag, _payload_product_ids(payload))
+    return body, etag
+
+def _cached_response(request: Request, key, body: bytes, headers: dict) -> Response:
+    # Variante precompressee servie depuis le cache ; le middleware la laisse passer
+    encoding = _negotiate_encoding(request.headers.get("accept-encoding", "")) if len(body) >= COMPRESSION_MIN_BYTES else None
+    if encoding:
+        body = _catalog_cache.encoded(key, body, encoding)
+        headers["Content-Encoding"] = encoding
+        headers["ETag"] = "W/" + headers["ETag"]
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def _not_modified(request: Request, body: bytes, headers: dict) -> Response:
+    # Le 304 porte l'ETag du 200 qu'il valide : faible si ce 200 aurait ete compresse
+    if len(body) >= COMPRESSION_MIN_BYTES and _negotiate_encoding(request.headers.get("accept-encoding", "")):
+        headers["ETag"] = "W/" + headers["ETag"]
+    return Response(status_code=304, headers=headers)
+
+def _cached_json(request: Request, key, build):
+    # Hit + If-None-Match => 304 sans acces BDD ni corps
+    body, etag = _cached_body(key, build)
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if _etag_matches(request, etag):
+        return _not_modified(request, body, headers)
+    return _cached_response(request, key, body, headers)
+
+# --- 4e. STATS DASHBOARD (document maintenu incrementalement) ---
+STATS_DOC_ID = "dashboard"
+# Increments recus pendant une reconstruction, reappliques sur le document reconstruit
+STATS_PENDING_ID = "dashboard:pending"
+REVENUE_STATUSES = ("PayÃ©", "LivrÃ©", "PayÃ© (VÃ©rifiÃ©)")
+
+def _stats_key(status) -> str:
+    # Les statuts servent de cle de champ : pas de "." ni de "$"
+    return str(status or "Inconnu").replace(".", "_").replace("$", "_")
+
+def _stats_buckets(created_at) -> tuple[str, str]:
+    if not isinstance(created_at, datetime):
+        created_at = datetime.now()
+    return created_at.strftime("%Y-%m-%d"), created_at.strftime("%Y-%m")
+
+def _stats_add(inc: dict, path: str, value):
+    inc[path] = inc.get(path, 0) + value
+
+def _stats_add_revenue(inc: dict, created_at, amount: float):
+    day, month = _stats_buckets(created_at)
+    _stats_add(inc, "revenue", amount)
+    _stats_add(inc, f"daily.{day}.revenue", amount)
+    _stats_add(inc, f"monthly.{month}.revenue", amount)
+
+def _stats_inc(inc: dict):
+    if not inc:
+        return
+    try:
+        # Reconstruction en cours (rebuildingSince) : on journalise au lieu d'ecrire sur
+        # un document qui va etre remplace
+        result = db.stats.update_one({"_id": STATS_DOC_ID, "rebuildingSince": {"$exists": False}}, {"$inc": inc})
+        if not result.matched_count:
+            db.stats.update_one({"_id": STATS_PENDING_ID}, {"$inc": inc}, upsert=True)
+    except PyMongoError as e:
+        # Donnee derivee : une reconstruction la remet d'aplomb
+        logger.warning("Stats dashboard non mises a jour: %s", e)
+
+def _stats_order_created(order: dict):
+    day, month = _stats_buckets(order.get("createdAt"))
+    inc = {
+        "ordersCount": 1,
+        f"statusCounts.{_stats_key(order.get('status'))}": 1,
+        f"daily.{day}.orders": 1,
+        f"monthly.{month}.orders": 1,
+    }
+    if order.get("status") in REVENUE_STATUSES:
+        _stats_add_revenue(inc, order.get("createdAt"), float(order.get("totalAmount") or 0))
+    _stats_inc(inc)
+
+def _stats_status_changed(order: dict, new_status):
+    # `order` est l'etat AVANT la mise a jour (find_one_and_update)
+    old_status = order.get("status")
+    if old_status == new_status:
+        return
+    inc = {}
+    _stats_add(inc, f"statusCounts.{_stats_key(old_status)}", -1)
+    _stats_add(inc, f"statusCounts.{_stats_key(new_status)}", 1)
+    delta = int(new_status in REVENUE_STATUSES) - int(old_status in REVENUE_STATUSES)
+    if delta:
+        _stats_add_revenue(inc, order.get("createdAt"), delta * float(order.get("totalAmount") or 0))
+    _stats_inc({k: v for k, v in inc.items() if v})
+
+def _stats_flatten(doc: dict, prefix: str = "") -> dict:
+    # Document journalise (imbrique par $inc) -> chemins pointes pour un nouveau $inc
+    flat = {}
+    for key, value in doc.items():
+        if key == "_id":
+            continue
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_stats_flatten(value, f"{path}."))
+        elif isinstance(value, (int, float)) and value:
+            flat[path] = value
+    return flat
+
+def _stats_snapshot_session():
+    # Lecture "snapshot" (replica set) : l'agregation voit un etat fige juste apres la pose
+    # du drapeau ; en standalone, pas de snapshot possible
+    if _supports_transactions():
+        return client.start_session(snapshot=True)
+    return nullcontext()
+
+def rebuild_dashboard_stats() -> dict:
+    """Recalcule entierement le document de stats (backfill ponctuel).
+
+    Les increments concurrents ne sont pas perdus : pendant le calcul, _stats_inc les
+    journalise dans STATS_PENDING_ID et ils sont reappliques apres le remplacement.
+    Reste une fenetre de quelques millisecondes (commande ecrite juste avant la pose du
+    drapeau, compteur incremente juste apres) ; en standalone, sans lecture snapshot,
+    elle couvre toute l'agregation : y lancer la reconstruction hors trafic.
+    """
+    db.stats.delete_one({"_id": STATS_PENDING_ID})
+    db.stats.update_one({"_id": STATS_DOC_ID}, {"$set": {"rebuildingSince": datetime.now()}}, upsert=True)
+    try:
+        doc = _stats_aggregate()
+    except BaseException:
+        # Echec : on rend la main aux increments et on recolle le journal
+        db.stats.update_one({"_id": STATS_DOC_ID}, {"$unset": {"rebuildingSince": ""}})
+        _stats_apply_pending()
+        raise
+    # Remplacement sans drapeau : les nouveaux increments reviennent sur le document
+    db.stats.replace_one({"_id": STATS_DOC_ID}, doc, upsert=True)
+    _stats_apply_pending()
+    return db.stats.find_one({"_id": STATS_DOC_ID}) or doc
+
+def _stats_apply_pending():
+    pending = db.stats.find_one_and_delete({"_id": STATS_PENDING_ID})
+    inc = _stats_flatten(pending or {})
+    if inc:
+        db.stats.update_one({"_id": STATS_DOC_ID}, {"$inc": inc})
+
+def _stats_aggregate() -> dict:
+    revenue_expr = {
+        "$cond": [{"$in": ["$status", list(REVENUE_STATUSES)]}, {"$ifNull": ["$totalAmount", 0]}, 0]
+    }
+    pipeline = [
+        {"$group": {
+            "_id": {
+                "status": "$status",
+                "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$createdAt"}},
+            },
+            "orders": {"$sum": 1},
+            "revenue": {"$sum": revenue_expr},
+        }},
+    ]
+    doc = {"_id": STATS_DOC_ID, "ordersCount": 0, "revenue": 0, "statusCounts": {}, "daily": {}, "monthly": {}}
+    with _stats_snapshot_session() as session:
+        rows = list(db.orders.aggregate(pipeline, allowDiskUse=True, session=session))
+        doc["usersCount"] = db.users.count_documents({}, session=session)
+        doc["productsCount"] = db.products.count_documents({}, session=session)
+    for row in rows:
+        key = _stats_key(row["_id"].get("status"))
+        doc["ordersCount"] += row["orders"]
+        doc["revenue"] += row["revenue"]
+        doc["statusCounts"][key] = doc["statusCounts"].get(key, 0) + row["orders"]
+        day = row["_id"].get("day")
+        if not day:
+            continue
+        for bucket in (doc["daily"].setdefault(day, {}), doc["monthly"].setdefault(day[:7], {})):
+            bucket["orders"] = bucket.get("orders", 0) + row["orders"]
+            bucket["revenue"] = bucket.get("revenue", 0) + row["revenue"]
+    doc["backfilledAt"] = datetime.now()
+    return doc
+
+def _stats_series(buckets: dict, keys: list[str], key_name: str) -> list[dict]:
+    series = []
+    for key in keys:
+        bucket = buckets.get(key) or {}
+        series.append({key_name: key, "orders": bucket.get("orders", 0), "revenue": bucket.get("revenue", 0)})
+    return series
+
+def _last_months(count: int) -> list[str]:
+    today = datetime.now()
+    year, month = today.year, today.month
+    keys = []
+    for _ in range(count):
+        keys.append(f"{year:04d}-{month:02d}")
+        month -= 1
+        if month == 0:
+            year, month = year - 1, 12
+    return keys[::-1]
+
 # --- 5. DÃ‰PENDANCES DE SÃ‰CURITÃ‰ ---
 
 def create_access_token(data: dict):
@@ -309,55 +2012,481 @@ def create_access_token(data: dict):
 def _hash_reset_token(token: str) -> str:
     return hashlib.sha256(token.encode()).hexdigest()
 
-def _send_email(to_email: str, subject: str, html_body: str, text_body: str | None = None):
-    if not SMTP_HOST or not SMTP_USER or not SMTP_PASS:
-        raise HTTPException(500, "SMTP non configure")
-
+def _build_email_message(to_email: str, subject: str, html_body: str, text_body: str | None = None) -> EmailMessage:
     msg = EmailMessage()
     msg["From"] = SMTP_FROM
     msg["To"] = to_email
     msg["Subject"] = subject
     msg.set_content(text_body or "Veuillez utiliser un client email compatible HTML.")
     msg.add_alternative(html_body, subtype="html")
+    return msg
 
-    context = ssl.create_default_context()
-    with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=20) as server:
+class SmtpSession:
+    """Connexion SMTP persistante du worker, rouverte seulement si elle tombe."""
+
+    def __init__(self):
+        self._server = None
+        self._last_used = 0.0
+
+    def _connect(self):
+        server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT_SEC)
         server.ehlo()
-        server.starttls(context=context)
-        server.login(SMTP_USER, SMTP_PASS)
-        server.send_message(msg)
+        if SMTP_STARTTLS:
+            server.starttls(context=ssl.create_default_context())
+            server.ehlo()
+        if SMTP_USER and SMTP_PASS:
+            server.login(SMTP_USER, SMTP_PASS)
+        return server
+
+    def _alive(self) -> bool:
+        if time.monotonic() - self._last_used < SMTP_KEEPALIVE_SEC:
+            return True
+        try:
+            return self._server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def send(self, msg: EmailMessage):
+        if self._server is not None and not self._alive():
+            self.close()
+        with _outbound_span("smtp", "send"):
+            if self._server is None:
+                self._server = self._connect()
+            try:
+                self._server.send_message(msg)
+            except smtplib.SMTPServerDisconnected:
+                # Coupure cote serveur entre deux lots : une seule reconnexion
+                self.close()
+                self._server = self._connect()
+                self._server.send_message(msg)
+        self._last_used = time.monotonic()
+
+    def close(self):
+        server, self._server = self._server, None
+        if server is None:
+            return
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+class MailQueue:
+    """File d'envoi persistante : les routes inserent, un thread de fond envoie.
+
+    Chaque message est reserve (status "sending" + bail) juste avant son envoi et
+    son resultat ecrit aussitot : le bail ne couvre qu'un envoi, ce qui permet
+    plusieurs workers uvicorn et la reprise apres un crash. Les echecs
+    sont replanifies avec backoff exponentiel ; au-dela de EMAIL_MAX_ATTEMPTS
+    (ou sur refus definitif 5xx) le message reste en "dead" pour l'admin.
+    """
 
-def _rate_limit_allow(key: str) -> bool:
-    if RESET_RATE_LIMIT_MAX <= 0:
-        return True
-    now = time.time()
-    window = RESET_RATE_LIMIT_WINDOW_SEC
-    hits = _reset_rate_limit_store.get(key, [])
-    hits = [t for t in hits if now - t < window]
-    if len(hits) >= RESET_RATE_LIMIT_MAX:
-        _reset_rate_limit_store[key] = hits
-        return False
-    hits.append(now)
-    _reset_rate_limit_store[key] = hits
-    return True
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._session = SmtpSession()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def enqueue(self, to_email: str, subject: str, html_body: str, text_body: str | None = None,
+                kind: str | None = None, expires_at: datetime | None = None):
+        if not SMTP_HOST:
+            raise HTTPException(500, "SMTP non configure")
+        now = datetime.utcnow()
+        result = db.email_outbox.insert_one({
+            "to": to_email,
+            "subject": subject,
+            "html": html_body,
+            "text": text_body,
+            "kind": kind,
+            "status": "pending",
+            "attempts": 0,
+            "nextAttemptAt": now,
+            "expiresAt": expires_at,
+            "createdAt": now,
+        })
+        self._wake.set()
+        return result.inserted_id
+
+    def start(self):
+        if self._thread is not None:
+            return
+        if EMAIL_LEASE_SEC < EMAIL_LEASE_MIN_TIMEOUTS * SMTP_TIMEOUT_SEC:
+            # Bail plus court qu'un envoi lent : un autre worker reprendrait le message => doublon
+            raise RuntimeError(
+                f"EMAIL_LEASE_SEC ({EMAIL_LEASE_SEC}) doit valoir au moins "
+                f"{EMAIL_LEASE_MIN_TIMEOUTS} x SMTP_TIMEOUT_SEC ({SMTP_TIMEOUT_SEC})"
+            )
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="mail-queue", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                processed = self.process_batch()
+            except PyMongoError as e:
+                logger.warning("File email indisponible: %s", e)
+                processed = 0
+            except Exception:
+                # Superviseur : une erreur imprevue ne doit pas tuer le thread d'envoi
+                logger.exception("Erreur inattendue dans la file email")
+                processed = 0
+            if processed < EMAIL_BATCH_SIZE:
+                self._wake.wait(EMAIL_POLL_INTERVAL_SEC)
+                self._wake.clear()
+        self._session.close()
+
+    def _claim(self) -> dict | None:
+        # Bail pris message par message, juste avant l'envoi : il ne couvre qu'un seul envoi
+        now = datetime.utcnow()
+        lease = {"status": "sending", "lockedUntil": now + timedelta(seconds=EMAIL_LEASE_SEC), "lockedBy": self.worker_id}
+        return db.email_outbox.find_one_and_update(
+            {"$or": [
+                {"status": "pending", "nextAttemptAt": {"$lte": now}},
+                # Bail expire : le worker precedent est mort en cours d'envoi
+                {"status": "sending", "lockedUntil": {"$lte": now}},
+            ]},
+            {"$set": lease},
+            sort=[("nextAttemptAt", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
 
-def _rate_limit_allow_admin(key: str) -> bool:
-    if ADMIN_INVITE_RATE_LIMIT_MAX <= 0:
-        return True
-    now = time.time()
-    window = ADMIN_INVITE_RATE_LIMIT_WINDOW_SEC
-    hits = _reset_rate_limit_store.get(key, [])
-    hits = [t for t in hits if now - t < window]
-    if len(hits) >= ADMIN_INVITE_RATE_LIMIT_MAX:
-        _reset_rate_limit_store[key] = hits
+    def process_batch(self) -> int:
+        processed = 0
+        while processed < EMAIL_BATCH_SIZE and not self._stop.is_set():
+            doc = self._claim()
+            if doc is None:
+                break
+            processed += 1
+            update = self._process(doc)
+            # Resultat ecrit tout de suite, et seulement si le bail est toujours a nous
+            db.email_outbox.update_one({"_id": doc["_id"], "lockedBy": self.worker_id}, update)
+        return processed
+
+    def _process(self, doc: dict) -> dict:
+        now = datetime.utcnow()
+        release = {"lockedUntil": "", "lockedBy": ""}
+        if doc.get("expiresAt") and doc["expiresAt"] <= now:
+            # Lien deja expire : inutile de l'envoyer
+            return {"$set": {"status": "expired"}, "$unset": release}
+        try:
+            self._session.send(_build_email_message(doc["to"], doc["subject"], doc["html"], doc.get("text")))
+        except (smtplib.SMTPException, OSError) as e:
+            return self._failure(doc, e, release)
+        # Le corps contient des liens a usage unique : on ne le conserve pas
+        return {"$set": {"status": "sent", "sentAt": now}, "$unset": {**release, "html": "", "text": ""}}
+
+    def _failure(self, doc: dict, exc: Exception, release: dict) -> dict:
+        now = datetime.utcnow()
+        attempts = doc.get("attempts", 0) + 1
+        permanent = isinstance(exc, smtplib.SMTPRecipientsRefused) or (
+            isinstance(exc, smtplib.SMTPResponseException)
+            and not isinstance(exc, smtplib.SMTPAuthenticationError)
+            and exc.smtp_code >= 500
+        )
+        if not isinstance(exc, smtplib.SMTPRecipientsRefused):
+            # Etat de session incertain : prochaine tentative sur une connexion neuve
+            self._session.close()
+        fields = {"attempts": attempts, "lastError": f"{type(exc).__name__}: {exc}"[:500]}
+        if permanent or attempts >= EMAIL_MAX_ATTEMPTS:
+            logger.error("Email %s abandonne apres %s tentative(s): %s", doc["_id"], attempts, exc)
+            fields.update({"status": "dead", "deadAt": now})
+        else:
+            delay = min(EMAIL_RETRY_MAX_SEC, EMAIL_RETRY_BASE_SEC * 2 ** (attempts - 1))
+            fields.update({"status": "pending", "nextAttemptAt": now + timedelta(seconds=delay * random.uniform(0.8, 1.2))})
+        return {"$set": fields, "$unset": release}
+
+    def requeue(self, email_id: ObjectId) -> bool:
+        result = db.email_outbox.update_one(
+            {"_id": email_id, "status": "dead"},
+            {"$set": {"status": "pending", "attempts": 0, "nextAttemptAt": datetime.utcnow()}, "$unset": {"deadAt": ""}},
+        )
+        if result.modified_count:
+            self._wake.set()
+        return bool(result.modified_count)
+
+_mail_queue = MailQueue()
+
+# Fenetre glissante approchee : compteur de la fenetre fixe courante + compteur
+# de la precedente pondere par la part encore couverte. Deux entiers par cle.
+def _sliding_retry_after(previous: int, current: int, elapsed: float, window_sec: int, limit: int) -> float:
+    """0 si un appel de plus est autorise, sinon le delai (s) avant qu'il le soit."""
+    weight = 1 - elapsed / window_sec
+    if previous * weight + current < limit:
+        return 0.0
+    if current >= limit:
+        # Il faut attendre que la fenetre courante devienne la precedente et decroisse
+        return (window_sec - elapsed) + window_sec * (1 - limit / current)
+    # Refuse ici : le delai reste strictement positif malgre les arrondis flottants
+    return max(0.001, window_sec * (1 - (limit - current) / previous) - elapsed)
+
+class MemoryRateLimitBackend:
+    """Compteurs du process : (index de fenetre, courant, precedent, expiration) par cle.
+
+    Taille bornee (LRU) et cles purgees deux fenetres apres leur dernier appel.
+    """
+
+    def __init__(self, max_keys: int, clock=time.time):
+        self.max_keys = max_keys
+        self._clock = clock
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, limit: int, window_sec: int) -> float:
+        now = self._clock()
+        index = int(now // window_sec)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] < index - 1:
+                current, previous = 0, 0
+            elif entry[0] == index - 1:
+                current, previous = 0, entry[1]
+            else:
+                current, previous = entry[1], entry[2]
+            retry_after = _sliding_retry_after(previous, current, now - index * window_sec, window_sec, limit)
+            if not retry_after:
+                current += 1
+            self._entries[key] = (index, current, previous, (index + 2) * window_sec)
+            while self._entries:
+                oldest = next(iter(self._entries.values()))
+                if len(self._entries) <= self.max_keys and oldest[3] > now:
+                    break
+                self._entries.popitem(last=False)
+        return retry_after
+
+class MongoRateLimitBackend:
+    """Compteurs partages entre workers : un document par (cle, fenetre), purge par TTL."""
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+
+    def hit(self, key: str, limit: int, window_sec: int) -> float:
+        now = self._clock()
+        index = int(now // window_sec)
+        doc_id = f"{key}:{window_sec}:{index}"
+        try:
+            prev = db.rate_limits.find_one({"_id": f"{key}:{window_sec}:{index - 1}"}, {"count": 1})
+            doc = db.rate_limits.find_one_and_update(
+                {"_id": doc_id},
+                {
+                    "$inc": {"count": 1},
+                    "$setOnInsert": {"expiresAt": datetime.utcfromtimestamp((index + 2) * window_sec)},
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+            previous = prev["count"] if prev else 0
+            retry_after = _sliding_retry_after(previous, doc["count"] - 1, now - index * window_sec, window_sec, limit)
+            if retry_after:
+                # Refus : l'appel ne compte pas dans la fenetre
+                db.rate_limits.update_one({"_id": doc_id}, {"$inc": {"count": -1}})
+            return retry_after
+        except PyMongoError as e:
+            # Limiteur indisponible : on laisse passer plutot que bloquer les connexions
+            logger.warning("Rate limit indisponible: %s", e)
+            return 0.0
+
+_rate_limiter = MongoRateLimitBackend() if RATE_LIMIT_BACKEND == "mongo" else MemoryRateLimitBackend(RATE_LIMIT_MAX_KEYS)
+
+def _is_trusted_proxy(host: str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
         return False
-    hits.append(now)
-    _reset_rate_limit_store[key] = hits
-    return True
+    return any(address in network for network in TRUSTED_PROXIES)
+
+def _client_ip(request: Request) -> str:
+    peer = request.client.host if request.client else ""
+    if peer and _is_trusted_proxy(peer):
+        # Chaine lue de droite a gauche : la premiere adresse hors de nos proxys est le
+        # client ; les entrees plus a gauche sont fournies par lui et falsifiables
+        for hop in reversed(request.headers.get("x-forwarded-for", "").split(",")):
+            hop = hop.strip()
+            if hop and not _is_trusted_proxy(hop):
+                return hop
+    return peer or "unknown"
+
+def _enforce_rate_limit(key: str, limit: int, window_sec: int):
+    if limit <= 0:
+        return
+    retry_after = _rate_limiter.hit(key, limit, window_sec)
+    if retry_after:
+        raise HTTPException(
+            429,
+            "Trop de demandes. Reessayez plus tard.",
+            # A l'instant exact calcule, l'appel est encore refuse (seuil strict)
+            headers={"Retry-After": str(int(retry_after) + 1)},
+        )
 
-async def get_current_user(token: str = Depends(oauth2_scheme)):
+def rate_limit(scope: str, limit: int, window_sec: int):
+    """Dependance de route : limite par IP cliente, ex. dependencies=[Depends(rate_limit(...))]."""
+    def dependency(request: Request):
+        _enforce_rate_limit(f"{scope}:ip:{_client_ip(request)}", limit, window_sec)
+    return dependency
+
+class PrincipalCache:
+    """Utilisateurs authentifies recents, indexes par empreinte du token."""
+
+    def __init__(self, max_entries: int, ttl_sec: int):
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self._entries: OrderedDict = OrderedDict()
+        self._by_user: dict[str, set] = {}
+        # Generation de la derniere invalidation par utilisateur (bornee) ; un
+        # ticket plus ancien que le plancher est refuse faute d'historique
+        self._generation = 0
+        self._invalidated: OrderedDict = OrderedDict()
+        self._floor = 0
+        self._lock = threading.Lock()
+
+    def get(self, token_hash: str):
+        with self._lock:
+            entry = self._entries.get(token_hash)
+            if entry is None:
+                return None
+            expires_at, user = entry
+            if expires_at <= time.time():
+                self._drop(token_hash)
+                return None
+            self._entries.move_to_end(token_hash)
+            return dict(user)
+
+    def generation(self) -> int:
+        """Ticket a prendre avant de lire l'utilisateur en base, puis a passer a put."""
+        with self._lock:
+            return self._generation
+
+    def put(self, token_hash: str, user: dict, token_exp: Optional[float], generation: int):
+        if self.max_entries <= 0 or self.ttl_sec <= 0:
+            return
+        expires_at = time.time() + self.ttl_sec
+        if token_exp:
+            expires_at = min(expires_at, token_exp)
+        with self._lock:
+            # Invalidation survenue pendant la lecture : l'utilisateur lu est peut-etre perime
+            if generation < self._floor or self._invalidated.get(user["id"], 0) > generation:
+                return
+            self._drop(token_hash)
+            self._entries[token_hash] = (expires_at, user)
+            self._by_user.setdefault(user["id"], set()).add(token_hash)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id):
+        user_id = str(user_id)
+        with self._lock:
+            self._generation += 1
+            self._invalidated[user_id] = self._generation
+            self._invalidated.move_to_end(user_id)
+            while len(self._invalidated) > max(1, self.max_entries):
+                _, dropped = self._invalidated.popitem(last=False)
+                self._floor = dropped
+            for token_hash in self._by_user.pop(user_id, set()):
+                self._entries.pop(token_hash, None)
+
+    def _drop(self, token_hash: str):
+        entry = self._entries.pop(token_hash, None)
+        if entry is None:
+            return
+        hashes = self._by_user.get(entry[1]["id"])
+        if hashes is not None:
+            hashes.discard(token_hash)
+            if not hashes:
+                del self._by_user[entry[1]["id"]]
+
+_principal_cache = PrincipalCache(PRINCIPAL_CACHE_MAX_ENTRIES, PRINCIPAL_CACHE_TTL_SEC)
+
+class PasswordHasher:
+    """Pool de process dedie a bcrypt, avec file bornee (503 si saturee)."""
+
+    def __init__(self, workers: int, queue_max: int):
+        self.workers = max(1, workers)
+        self.capacity = self.workers + max(0, queue_max)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._rejected = 0
+        self._completed = 0
+        self._latencies = deque(maxlen=512)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn : les workers n'heritent ni des threads pymongo ni de l'etat du serveur
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    async def _run(self, fn, *args):
+        with self._lock:
+            if self._in_flight >= self.capacity:
+                self._rejected += 1
+                raise HTTPException(
+                    503,
+                    "Service momentanement surcharge. Reessayez.",
+                    headers={"Retry-After": str(PASSWORD_HASH_RETRY_AFTER_SEC)},
+                )
+            self._in_flight += 1
+        start = time.perf_counter()
+        try:
+            return await asyncio.wrap_future(self._get_executor().submit(fn, *args))
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._in_flight -= 1
+                self._completed += 1
+                self._latencies.append(elapsed)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._run(verify_password, password, hashed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            in_flight = self._in_flight
+            rejected, completed = self._rejected, self._completed
+        p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0.0
+        return {
+            "workers": self.workers,
+            "capacity": self.capacity,
+            "inFlight": in_flight,
+            "queueDepth": max(0, in_flight - self.workers),
+            "completed": completed,
+            "rejected": rejected,
+            "avgMs": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0,
+            "p95Ms": round(p95 * 1000, 2),
+            "maxMs": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        }
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+_password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE_MAX)
+
+# Dependances et routes BDD en "def" : FastAPI les execute dans le threadpool,
+# le driver pymongo (synchrone) ne bloque donc jamais la boucle d'evenements.
+def get_current_user(token: str = Depends(oauth2_scheme)):
     # Rigueur : Nettoyage du prÃ©fixe Bearer si envoyÃ© manuellement
     token = token.replace("Bearer ", "")
+    token_hash = _hash_reset_token(token)
+    cached = _principal_cache.get(token_hash)
+    if cached is not None:
+        return cached
+    generation = _principal_cache.generation()
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Session invalide",
@@ -366,18 +2495,20 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
-        if email is None:
+        # Meme cle de signature que les devis : on refuse tout jeton type
+        if email is None or payload.get("typ"):
             raise credentials_exception
     except JWTError:
         raise credentials_exception
     
-    user = db.users.find_one({"email": email})
+    user = db.users.find_one({"email": email}, {"password": 0})
     if user is None:
         raise credentials_exception
     user["id"] = str(user["_id"])
-    return user
+    _principal_cache.put(token_hash, user, payload.get("exp"), generation)
+    return dict(user)
 
-async def get_current_admin(current_user: dict = Depends(get_current_user)):
+def get_current_admin(current_user: dict = Depends(get_current_user)):
     if current_user.get("role") != "admin":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, 
@@ -401,9 +2532,11 @@ def _sanitize_user(u: dict):
 
 # --- 6. ROUTES AUTHENTIFICATION ---
 
-@app.post("/api/auth/register")
-def register(user: UserRegister):
-    if db.users.find_one({"email": user.email}):
+# Routes bcrypt en "async def" : le hachage attend le pool de process sans
+# occuper de thread, et les acces BDD passent par run_in_threadpool.
+@app.post("/api/auth/register", dependencies=[Depends(rate_limit("register", REGISTER_RATE_LIMIT_MAX, REGISTER_RATE_LIMIT_WINDOW_SEC))])
+async def register(user: UserRegister):
+    if await run_in_threadpool(db.users.find_one, {"email": user.email}):
         raise HTTPException(400, "Email deja enregistre")
     full_name = (user.name or "").strip()
     if not full_name:
@@ -416,7 +2549,7 @@ def register(user: UserRegister):
         "firstName": user.firstName,
         "lastName": user.lastName,
         "email": user.email,
-        "password": pwd_context.hash(user.password),
+        "password": await _password_hasher.hash(user.password),
         "role": "client",
         "createdAt": datetime.now()
     }
@@ -435,13 +2568,17 @@ def register(user: UserRegister):
     }
     user_doc["consentsUpdatedAt"] = datetime.now()
 
-    db.users.insert_one(user_doc)
+    try:
+        await run_in_threadpool(db.users.insert_one, user_doc)
+    except DuplicateKeyError:
+        raise HTTPException(400, "Email deja enregistre")
+    await run_in_threadpool(_stats_inc, {"usersCount": 1})
     return {"success": True}
 
-@app.post("/api/auth/login", response_model=Token)
-def login(user: UserLogin):
-    u = db.users.find_one({"email": user.email})
-    if not u or not pwd_context.verify(user.password, u["password"]):
+@app.post("/api/auth/login", response_model=Token, dependencies=[Depends(rate_limit("login", LOGIN_RATE_LIMIT_MAX, LOGIN_RATE_LIMIT_WINDOW_SEC))])
+async def login(user: UserLogin):
+    u = await run_in_threadpool(db.users.find_one, {"email": user.email})
+    if not u or not await _password_hasher.verify(user.password, u["password"]):
         raise HTTPException(400, "Email ou mot de passe incorrect")
     
     access_token = create_access_token(data={"sub": u["email"]})
@@ -454,9 +2591,9 @@ def login(user: UserLogin):
 @app.post("/api/auth/forgot-password")
 def forgot_password(data: ForgotPasswordRequest, request: Request):
     email = data.email.lower().strip()
-    client_ip = request.headers.get("x-forwarded-for", "").split(",")[0].strip() or request.client.host or "unknown"
-    if not _rate_limit_allow(f"reset_ip:{client_ip}") or not _rate_limit_allow(f"reset_email:{email}"):
-        raise HTTPException(429, "Trop de demandes. Reessayez plus tard.")
+    client_ip = _client_ip(request)
+    _enforce_rate_limit(f"reset_ip:{client_ip}", RESET_RATE_LIMIT_MAX, RESET_RATE_LIMIT_WINDOW_SEC)
+    _enforce_rate_limit(f"reset_email:{email}", RESET_RATE_LIMIT_MAX, RESET_RATE_LIMIT_WINDOW_SEC)
     user = db.users.find_one({"email": email})
     # Toujours repondre OK pour eviter l'enumeration
     if not user:
@@ -547,9 +2684,9 @@ def forgot_password(data: ForgotPasswordRequest, request: Request):
     text_body = f"Reinitialisez votre mot de passe : {reset_url} (expire dans {RESET_TOKEN_EXPIRE_MINUTES} min)"
 
     try:
-        _send_email(email, subject, html_body, text_body)
+        _mail_queue.enqueue(email, subject, html_body, text_body, kind="password_reset", expires_at=expires_at)
     except Exception:
-        # On nettoie le token si l'envoi echoue
+        # On nettoie le token si la mise en file echoue
         db.password_resets.delete_one({"tokenHash": token_hash})
         raise
 
@@ -559,7 +2696,7 @@ def forgot_password(data: ForgotPasswordRequest, request: Request):
     return response
 
 @app.post("/api/auth/reset-password")
-def reset_password(data: ResetPasswordRequest):
+async def reset_password(data: ResetPasswordRequest):
     token = (data.token or "").strip()
     if not token:
         raise HTTPException(400, "Token manquant")
@@ -567,7 +2704,7 @@ def reset_password(data: ResetPasswordRequest):
         raise HTTPException(400, "Mot de passe trop court")
 
     token_hash = _hash_reset_token(token)
-    record = db.password_resets.find_one({
+    record = await run_in_threadpool(db.password_resets.find_one, {
         "tokenHash": token_hash,
         "usedAt": None,
         "expiresAt": {"$gt": datetime.utcnow()},
@@ -575,22 +2712,27 @@ def reset_password(data: ResetPasswordRequest):
     if not record:
         raise HTTPException(400, "Token invalide ou expire")
 
+    password_hash = await _password_hasher.hash(data.password)
+    await run_in_threadpool(_apply_password_reset, record, password_hash)
+    return {"success": True}
+
+def _apply_password_reset(record: dict, password_hash: str):
     db.users.update_one(
         {"_id": record["userId"]},
-        {"$set": {"password": pwd_context.hash(data.password)}}
+        {"$set": {"password": password_hash}}
     )
+    _principal_cache.invalidate_user(record["userId"])
     db.password_resets.update_one(
         {"_id": record["_id"]},
         {"$set": {"usedAt": datetime.utcnow()}}
     )
-    return {"success": True}
 
 @app.post("/api/admin/invites")
 def create_admin_invite(data: AdminInviteRequest, request: Request, admin: dict = Depends(get_current_admin)):
     email = data.email.lower().strip()
-    client_ip = request.headers.get("x-forwarded-for", "").split(",")[0].strip() or request.client.host or "unknown"
-    if not _rate_limit_allow_admin(f"admin_invite_ip:{client_ip}") or not _rate_limit_allow_admin(f"admin_invite_email:{email}"):
-        raise HTTPException(429, "Trop de demandes. Reessayez plus tard.")
+    client_ip = _client_ip(request)
+    _enforce_rate_limit(f"admin_invite_ip:{client_ip}", ADMIN_INVITE_RATE_LIMIT_MAX, ADMIN_INVITE_RATE_LIMIT_WINDOW_SEC)
+    _enforce_rate_limit(f"admin_invite_email:{email}", ADMIN_INVITE_RATE_LIMIT_MAX, ADMIN_INVITE_RATE_LIMIT_WINDOW_SEC)
 
     user = db.users.find_one({"email": email})
     if not user:
@@ -684,7 +2826,7 @@ def create_admin_invite(data: AdminInviteRequest, request: Request, admin: dict
     text_body = f"Invitation admin TKB SHOP : {invite_url} (expire dans {ADMIN_INVITE_EXPIRE_MINUTES} min)"
 
     try:
-        _send_email(email, subject, html_body, text_body)
+        _mail_queue.enqueue(email, subject, html_body, text_body, kind="admin_invite", expires_at=expires_at)
     except Exception:
         db.admin_invites.delete_one({"tokenHash": token_hash})
         raise
@@ -707,6 +2849,7 @@ def accept_admin_invite(data: AdminInviteAccept):
         raise HTTPException(400, "Token invalide ou expire")
 
     db.users.update_one({"_id": invite["userId"]}, {"$set": {"role": "admin"}})
+    _principal_cache.invalidate_user(invite["userId"])
     db.admin_invites.update_one({"_id": invite["_id"]}, {"$set": {"usedAt": datetime.utcnow()}})
     return {"success": True}
 
@@ -739,41 +2882,138 @@ def update_me(data: UserUpdate, current_user: dict = Depends(get_current_user)):
 
     if update:
         db.users.update_one({"_id": current_user["_id"]}, {"$set": update})
+        _principal_cache.invalidate_user(current_user["_id"])
         current_user = db.users.find_one({"_id": current_user["_id"]})
 
     return _sanitize_user(current_user)
 
 # --- 7. ROUTES PRODUITS ---
 
-@app.get("/api/products")
-def get_products():
-    products = []
-    for p in db.products.find().sort("_id", -1):
-        if "createdAt" not in p and isinstance(p.get("_id"), ObjectId):
-            p["createdAt"] = p["_id"].generation_time
-        p["id"] = str(p["_id"])
-        del p["_id"]
-        products.append(p)
-    return products
+def _list_products(query: dict, sort_keys: list, limit: Optional[int], cursor: Optional[str], view: str = "full"):
+    if cursor:
+        after = _decode_cursor(cursor, sort_keys)
+        query = {"$and": [query, after]} if query else after
+    projection = PRODUCT_VIEWS[view]
+    serialize = _serialize_card if projection else _serialize_product
+    # Sans limit : liste complete (compatibilite admin / anciens clients)
+    if limit is None:
+        return [serialize(p) for p in read_db.products.find(query, projection).sort(sort_keys)]
+
+    page_size = min(limit, PRODUCTS_PAGE_MAX)
+    docs = list(read_db.products.find(query, projection).sort(sort_keys).limit(page_size + 1))
+    next_cursor = _encode_cursor(docs[page_size - 1], sort_keys) if len(docs) > page_size else None
+    return {
+        "items": [serialize(p) for p in docs[:page_size]],
+        "nextCursor": next_cursor,
+    }
 
-@app.get("/api/products/{id}")
-def get_product(id: str):
+def _search_products(q: str, limit: int, autocomplete: bool):
+    tokens = _query_tokens(q)
+    if not tokens:
+        return []
+    # Autocompletion : le dernier mot est un prefixe (borne d'index ^prefixe), pris
+    # tel que tape et sous son alias ("sac" doit aussi trouver "sacoche")
+    exact = tokens[:-1] if autocomplete else tokens
+    prefixes = sorted({_search_tokens(q)[-1], tokens[-1]}) if autocomplete else []
+    clauses = [{"searchIndex.t": t} for t in exact]
+    if len(prefixes) == 1:
+        clauses.append({"searchIndex.t": {"$regex": f"^{re.escape(prefixes[0])}"}})
+    elif prefixes:
+        clauses.append({"searchIndex.t": {"$in": [re.compile(f"^{re.escape(p)}") for p in prefixes]}})
+    query = clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+    fields = {"description": 0, "images": 0} if autocomplete else None
+    docs = list(read_db.products.find(query, fields).sort("_id", -1).limit(SEARCH_CANDIDATES_MAX))
+
+    def score(doc):
+        weights = {e["t"]: e["w"] for e in doc.get("searchIndex") or []}
+        total = sum(weights.get(t, 0) for t in exact)
+        if prefixes:
+            total += max(
+                weights.get(p) or max((w for t, w in weights.items() if t.startswith(p)), default=0) * 0.5
+                for p in prefixes
+            )
+        in_stock = int(doc.get("stock", 0) or 0) > 0
+        return total + (0.5 if in_stock else 0)
+
+    ranked = sorted(docs, key=score, reverse=True)[:limit]
+    if autocomplete:
+        return [
+            {
+                "id": str(d["_id"]),
+                "name": d.get("name"),
+                "image": d.get("image"),
+                "price": d.get("price"),
+                "category": d.get("subcategory") or d.get("category"),
+            }
+            for d in ranked
+        ]
+    return [_serialize_product(d) for d in ranked]
+
+def _load_product(id: str):
     if not ObjectId.is_valid(id):
         raise HTTPException(400, "Format d'ID invalide")
-    p = db.products.find_one({"_id": ObjectId(id)})
+    p = read_db.products.find_one({"_id": ObjectId(id)})
     if not p:
         raise HTTPException(404, "Produit introuvable")
-    if "createdAt" not in p and isinstance(p.get("_id"), ObjectId):
-        p["createdAt"] = p["_id"].generation_time
-    p["id"] = str(p["_id"])
-    del p["_id"]
-    return p
+    return _serialize_product(p)
+
+@app.get("/api/products")
+def get_products(
+    request: Request,
+    category: Optional[str] = None,
+    categoryGroup: Optional[str] = None,
+    subcategory: Optional[str] = None,
+    status_value: Optional[str] = Query(None, alias="status"),
+    minPrice: Optional[float] = None,
+    maxPrice: Optional[float] = None,
+    size: Optional[str] = None,
+    color: Optional[str] = None,
+    sort: str = "recent",
+    limit: Optional[int] = Query(None, ge=1),
+    cursor: Optional[str] = None,
+    view: str = "full",
+):
+    sort_keys = PRODUCT_SORTS.get(sort)
+    if sort_keys is None:
+        raise HTTPException(400, "Tri invalide")
+    if view not in PRODUCT_VIEWS:
+        raise HTTPException(400, "Vue invalide")
+    query = _build_products_query(
+        category, categoryGroup, subcategory, status_value, minPrice, maxPrice, size, color
+    )
+    key = ("products", tuple(sorted(request.query_params.multi_items())))
+    return _cached_json(request, key, lambda: _list_products(query, sort_keys, limit, cursor, view))
+
+# Declaree avant /api/products/{id} pour ne pas etre capturee comme un ID
+@app.get("/api/products/search")
+def search_products(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(20, ge=1, le=50),
+    autocomplete: bool = False,
+):
+    key = ("search", _normalize_text(q), limit, autocomplete)
+    return _cached_json(request, key, lambda: _search_products(q, limit, autocomplete))
+
+@app.get("/api/products/{id}")
+def get_product(id: str, request: Request):
+    return _cached_json(request, ("product", id), lambda: _load_product(id))
+
+@app.get("/api/products/{id}/similar")
+def get_similar_products(id: str, request: Request, limit: int = Query(8, ge=1, le=SIMILAR_STORED)):
+    return _cached_json(request, ("similar", id, limit), lambda: _load_similar(id, limit))
 
 @app.post("/api/products")
 def create_product(p: Product, admin: dict = Depends(get_current_admin)):
     product_data = p.dict(exclude={'id'})
     product_data.setdefault("createdAt", datetime.now())
+    product_data.update(_product_keys(product_data))
+    product_data["searchIndex"] = _search_entries(product_data)
     result = db.products.insert_one(product_data)
+    _stats_inc({"productsCount": 1})
+    _refresh_neighbours(result.inserted_id)
+    _catalog_cache.bump()
     return {"success": True, "id": str(result.inserted_id)}
 
 @app.put("/api/products/{id}")
@@ -781,59 +3021,145 @@ def update_product(id: str, p: Product, admin: dict = Depends(get_current_admin)
     if not ObjectId.is_valid(id):
         raise HTTPException(400, "Format d'ID invalide")
     product_data = p.dict(exclude={'id'})
+    product_data.update(_product_keys(product_data))
+    product_data["searchIndex"] = _search_entries(product_data)
     db.products.update_one({"_id": ObjectId(id)}, {"$set": product_data})
+    _bump_catalog_price_version()
+    _refresh_neighbours(ObjectId(id))
+    _catalog_cache.bump()
     return {"success": True}
 
 @app.delete("/api/products/{id}")
 def delete_product(id: str, admin: dict = Depends(get_current_admin)):
     if not ObjectId.is_valid(id):
         raise HTTPException(400, "Format d'ID invalide")
-    db.products.delete_one({"_id": ObjectId(id)})
+    if db.products.delete_one({"_id": ObjectId(id)}).deleted_count:
+        _stats_inc({"productsCount": -1})
+    _bump_catalog_price_version()
+    _remove_neighbours(ObjectId(id))
+    _catalog_cache.bump()
     return {"success": True}
 
 # --- 8. ROUTES COMMANDES & PAIEMENTS ---
 
 @app.get("/api/orders/my-orders")
-async def get_my_orders(user: dict = Depends(get_current_user)):
+def get_my_orders(user: dict = Depends(get_current_user)):
     orders = []
     for o in db.orders.find({"userId": user["id"]}).sort("createdAt", -1):
         o["id"] = str(o["_id"])
         del o["_id"]
         orders.append(o)
-    return orders
+    return FastJSONResponse(orders)
+
+def _admin_orders_match(
+    status_value: Optional[str],
+    paymentMethod: Optional[str],
+    email: Optional[str],
+    dateFrom: Optional[datetime],
+    dateTo: Optional[datetime],
+) -> dict:
+    match = {}
+    if status_value:
+        match["status"] = status_value
+    if paymentMethod:
+        match["paymentMethod"] = paymentMethod
+    if dateFrom or dateTo:
+        created = {}
+        if dateFrom:
+            created["$gte"] = dateFrom
+        if dateTo:
+            created["$lte"] = dateTo
+        match["createdAt"] = created
+    if email:
+        # Anciennes commandes sans userEmail : on passe par l'id client (lecture indexee)
+        email = email.lower().strip()
+        user = db.users.find_one({"email": email}, {"_id": 1})
+        by_email = [{"userEmail": email}]
+        if user:
+            by_email.append({"userId": str(user["_id"])})
+        match["$or"] = by_email
+    return match
 
 @app.get("/api/admin/orders")
-def get_admin_orders(admin: dict = Depends(get_current_admin)):
+def get_admin_orders(
+    status_value: Optional[str] = Query(None, alias="status"),
+    paymentMethod: Optional[str] = None,
+    email: Optional[str] = None,
+    dateFrom: Optional[datetime] = None,
+    dateTo: Optional[datetime] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    cursor: Optional[str] = None,
+    admin: dict = Depends(get_current_admin),
+):
+    match = _admin_orders_match(status_value, paymentMethod, email, dateFrom, dateTo)
+    if cursor:
+        after = _decode_cursor(cursor, ADMIN_ORDERS_SORT)
+        match = {"$and": [match, after]} if match else after
+
+    pipeline = [{"$match": match}, {"$sort": dict(ADMIN_ORDERS_SORT)}]
+    page_size = min(limit, ADMIN_ORDERS_PAGE_MAX) if limit else None
+    if page_size:
+        pipeline.append({"$limit": page_size + 1})
+    # Jointure apres $limit : un seul $lookup indexe par ligne de la page
+    pipeline += [
+        {"$addFields": {"userOid": {"$convert": {"input": "$userId", "to": "objectId", "onError": None, "onNull": None}}}},
+        {"$lookup": {"from": "users", "localField": "userOid", "foreignField": "_id", "as": "user"}},
+        {"$addFields": {"user": {"$arrayElemAt": ["$user", 0]}}},
+        {"$project": {
+            "createdAt": 1,
+            "status": 1,
+            "paymentMethod": 1,
+            "paymentId": 1,
+            "shippingAddress": 1,
+            "phone": 1,
+            "userId": 1,
+            "totalAmount": 1,
+            "stockShortage": 1,
+            "userName": {"$ifNull": ["$userName", "$user.name"]},
+            "userEmail": {"$ifNull": ["$userEmail", "$user.email"]},
+            "productName": {"$arrayElemAt": ["$items.name", 0]},
+            "itemsCount": {"$size": {"$ifNull": ["$items", []]}},
+            "totalPrice": {"$ifNull": ["$totalPrice", "$totalAmount"]},
+        }},
+    ]
+
     orders = []
-    users_cache = {}
-    for o in db.orders.find().sort("createdAt", -1):
+    for o in read_db.orders.aggregate(pipeline):
         o["id"] = str(o["_id"])
-        del o["_id"]
-        user_id = o.get("userId")
-        if user_id:
-            if user_id not in users_cache:
-                if ObjectId.is_valid(user_id):
-                    users_cache[user_id] = db.users.find_one({"_id": ObjectId(user_id)})
-                else:
-                    users_cache[user_id] = None
-            u = users_cache.get(user_id)
-            if u:
-                o.setdefault("userName", u.get("name"))
-                o.setdefault("userEmail", u.get("email"))
-        if o.get("items"):
-            o.setdefault("productName", o["items"][0].get("name"))
-        o.setdefault("totalPrice", o.get("totalAmount"))
         orders.append(o)
-    return orders
+    if not page_size:
+        for o in orders:
+            del o["_id"]
+        return FastJSONResponse(orders)
+
+    next_cursor = _encode_cursor(orders[page_size - 1], ADMIN_ORDERS_SORT) if len(orders) > page_size else None
+    items = orders[:page_size]
+    for o in items:
+        del o["_id"]
+    return FastJSONResponse({"items": items, "nextCursor": next_cursor})
 
 @app.post("/api/orders")
-def create_order(o: Order, user: dict = Depends(get_current_user)):
+def create_order(
+    o: Order,
+    user: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
+    # Nouvel essai apres timeout : meme cle => meme commande, sans re-tarifer ni rappeler PayPal
+    payload = o.dict(exclude={"createdAt", "quoteToken"})
+    return _idempotency.run("orders", user["id"], idempotency_key, payload, lambda: _create_order(o, user))
+
+def _create_order(o: Order, user: dict):
     item_list = _coerce_items(o.items)
-    products_map = _get_products_map(item_list)
-    _check_stock(item_list, products_map)
-    normalized_items, total = _build_priced_items(item_list, products_map)
+    quote = _redeem_quote(o.quoteToken, user["id"], item_list) if o.quoteToken else None
+    if quote:
+        # Devis valide : pas de relecture produits ; le stock reste verifie a la reservation
+        normalized_items, total = quote
+    else:
+        products_map = _get_products_map(item_list)
+        _check_stock(item_list, products_map)
+        normalized_items, total = _build_priced_items(item_list, products_map)
 
-    d = o.dict()
+    d = o.dict(exclude={"quoteToken"})
     d["items"] = normalized_items
     d["totalAmount"] = total
     d["userId"] = user["id"]
@@ -848,22 +3174,28 @@ def create_order(o: Order, user: dict = Depends(get_current_user)):
             raise HTTPException(400, "paymentId manquant")
         _paypal_verify_order(payment_id, total)
         d["status"] = "PayÃ©"
-        _decrement_stock(normalized_items, strict=True)
+        _reserve_stock(normalized_items)
     else:
         d["status"] = "En attente"
 
     result = db.orders.insert_one(d)
+    _stats_order_created(d)
     # Retourner "id" permet au frontend de faire res.data.id
     return {"success": True, "id": str(result.inserted_id), "totalAmount": total}
 
-@app.post("/api/orders/quote")
+@app.post("/api/orders/quote", dependencies=[Depends(rate_limit("quote", QUOTE_RATE_LIMIT_MAX, QUOTE_RATE_LIMIT_WINDOW_SEC))])
 def quote_order(data: dict, user: dict = Depends(get_current_user)):
     items = data.get("items", []) if isinstance(data, dict) else []
     item_list = _coerce_items(items)
     products_map = _get_products_map(item_list)
     _check_stock(item_list, products_map)
     normalized_items, total = _build_priced_items(item_list, products_map)
-    return {"totalAmount": total, "items": normalized_items}
+    return {
+        "totalAmount": total,
+        "items": normalized_items,
+        "quoteToken": _issue_quote(user["id"], item_list, normalized_items, total),
+        "expiresIn": QUOTE_TOKEN_TTL_SEC,
+    }
 
 @app.put("/api/orders/{id}/status")
 def update_order_status(id: str, data: dict, admin: dict = Depends(get_current_admin)):
@@ -872,11 +3204,57 @@ def update_order_status(id: str, data: dict, admin: dict = Depends(get_current_a
     status_value = data.get("status") if isinstance(data, dict) else None
     if not status_value:
         raise HTTPException(400, "Statut manquant")
-    db.orders.update_one({"_id": ObjectId(id)}, {"$set": {"status": status_value}})
+    previous = db.orders.find_one_and_update(
+        {"_id": ObjectId(id)},
+        {"$set": {"status": status_value}},
+        projection={"status": 1, "totalAmount": 1, "createdAt": 1},
+    )
+    if previous:
+        _stats_status_changed(previous, status_value)
     return {"success": True}
 
+def _stripe_line_items(items: list) -> list:
+    line_items = []
+    for item in items:
+        unit_amount = int(round(float(item.get('price', 0)) * STRIPE_AMOUNT_MULTIPLIER))
+        line_items.append({
+            'price_data': {
+                'currency': STRIPE_CURRENCY,
+                'product_data': {
+                    'name': item.get('name'),
+                    'images': [item.get('image')] if item.get('image') else [],
+                },
+                # Stripe = unites minimales (ex: centimes si EUR)
+                'unit_amount': unit_amount,
+            },
+            'quantity': item.get('quantity', 1),
+        })
+    return line_items
+
+def _stripe_fingerprint(line_items: list) -> str:
+    canonical = json.dumps(line_items, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()[:24]
+
+def _reusable_checkout(order: dict, fingerprint: str):
+    checkout = order.get("stripeCheckout") or {}
+    if checkout.get("fingerprint") != fingerprint or not checkout.get("sessionId"):
+        return None
+    # Marge : la session ne doit pas expirer pendant la redirection du client
+    if (checkout.get("expiresAt") or 0) <= time.time() + STRIPE_SESSION_REUSE_MARGIN_SEC:
+        return None
+    return checkout
+
 @app.post("/api/payments/create-stripe-session")
-async def create_stripe_session(data: dict, user: dict = Depends(get_current_user)):
+def create_stripe_session(
+    data: dict,
+    user: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
+    return _idempotency.run(
+        "stripe-session", user["id"], idempotency_key, data, lambda: _create_stripe_session(data, user)
+    )
+
+def _create_stripe_session(data: dict, user: dict):
     # VÃ©rification de la clÃ© API avant de continuer
     if not stripe.api_key:
         raise HTTPException(status_code=500, detail="ClÃ© API Stripe non configurÃ©e au serveur")
@@ -891,36 +3269,46 @@ async def create_stripe_session(data: dict, user: dict = Depends(get_current_use
             raise HTTPException(status_code=404, detail="Commande introuvable")
         if order.get("userId") != user.get("id"):
             raise HTTPException(status_code=403, detail="Commande non autorisee")
+        if order.get("status") == "PayÃ©":
+            raise HTTPException(status_code=400, detail="Commande deja payee")
 
         items = order.get("items") or []
         if not items:
             raise HTTPException(status_code=400, detail="Commande vide")
 
-        line_items = []
-        for item in items:
-            unit_amount = int(round(float(item.get('price', 0)) * STRIPE_AMOUNT_MULTIPLIER))
-            line_items.append({
-                'price_data': {
-                    'currency': STRIPE_CURRENCY,
-                    'product_data': {
-                        'name': item.get('name'),
-                        'images': [item.get('image')] if item.get('image') else [],
-                    },
-                    # Stripe = unites minimales (ex: centimes si EUR)
-                    'unit_amount': unit_amount,
-                },
-                'quantity': item.get('quantity', 1),
-            })
-
-        session = stripe.checkout.Session.create(
-            payment_method_types=['card'],
-            line_items=line_items,
-            mode='payment',
-            success_url=f"{os.getenv('CLIENT_URL', 'http://localhost:5173')}/payment-success?session_id={{CHECKOUT_SESSION_ID}}",
-            cancel_url=f"{os.getenv('CLIENT_URL', 'http://localhost:5173')}/cart",
-            metadata={"orderId": order_id}
+        line_items = _stripe_line_items(items)
+        fingerprint = _stripe_fingerprint(line_items)
+        # Rechargement / nouvel essai : la session encore ouverte est reprise sans appel Stripe
+        checkout = _reusable_checkout(order, fingerprint)
+        if checkout:
+            return {"id": checkout["sessionId"], "url": checkout.get("url")}
+
+        # Meme cle pour deux clics simultanes => Stripe renvoie la meme session ;
+        # le compteur en donne une nouvelle une fois la precedente expiree.
+        attempt = int((order.get("stripeCheckout") or {}).get("attempt") or 0) + 1
+        with _outbound_span("stripe", "checkout_session_create"):
+            session = stripe.checkout.Session.create(
+                payment_method_types=['card'],
+                line_items=line_items,
+                mode='payment',
+                success_url=f"{os.getenv('CLIENT_URL', 'http://localhost:5173')}/payment-success?session_id={{CHECKOUT_SESSION_ID}}",
+                cancel_url=f"{os.getenv('CLIENT_URL', 'http://localhost:5173')}/cart",
+                metadata={"orderId": order_id},
+                idempotency_key=f"checkout-{order_id}-{fingerprint}-{attempt}",
+            )
+        db.orders.update_one(
+            {"_id": order["_id"]},
+            {"$set": {"stripeCheckout": {
+                "sessionId": session.id,
+                "url": session.url,
+                "expiresAt": session.expires_at,
+                "fingerprint": fingerprint,
+                "attempt": attempt,
+            }}},
         )
-        return {"id": session.id}
+        return {"id": session.id, "url": session.url}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -942,46 +3330,267 @@ async def stripe_webhook(request: Request):
     except stripe.error.SignatureVerificationError:
         raise HTTPException(status_code=400, detail="Signature Stripe invalide")
 
+    # Accuse de reception des que l'evenement est persiste ; le traitement se fait
+    # en tache de fond. Si l'ecriture echoue, le 500 fait relivrer Stripe.
+    # to_dict : les StripeObject recents ne supportent plus .get()
+    event = event.to_dict()
+    try:
+        recorded = await run_in_threadpool(_webhook_inbox.record, event)
+    except PyMongoError as e:
+        logger.error("Evenement Stripe %s non enregistre: %s", event.get("id"), e)
+        raise HTTPException(status_code=500, detail="Evenement non enregistre")
+    return {"received": True, "duplicate": not recorded}
+
+def _apply_stripe_event(event):
     if event["type"] == "checkout.session.completed":
         session = event["data"]["object"]
         order_id = session.get("metadata", {}).get("orderId")
         if order_id and ObjectId.is_valid(order_id):
-            order = db.orders.find_one({"_id": ObjectId(order_id)})
-            if order and order.get("status") != "PayÃ©":
-                payment_id = session.get("payment_intent") or session.get("id")
-                db.orders.update_one(
-                    {"_id": ObjectId(order_id)},
-                    {"$set": {"status": "PayÃ©", "paymentId": payment_id}}
-                )
+            payment_id = session.get("payment_intent") or session.get("id")
+            # Filtre sur le statut : un evenement rejoue ne compte pas deux fois
+            reservation_id = ObjectId()
+            order = db.orders.find_one_and_update(
+                {"_id": ObjectId(order_id), "status": {"$ne": "PayÃ©"}},
+                {"$set": {
+                    "status": "PayÃ©",
+                    "paymentId": payment_id,
+                    "stockPending": True,
+                    "stockReservationId": reservation_id,
+                }},
+            )
+            if order:
+                _stats_status_changed(order, "PayÃ©")
+            else:
+                # Nouvel essai de la boite webhooks apres un echec entre paiement et reservation
+                order = db.orders.find_one({"_id": ObjectId(order_id), "stockPending": True})
+                reservation_id = (order or {}).get("stockReservationId") or reservation_id
+            if order:
+                items = order.get("items", [])
+                done = {"$unset": {"stockPending": "", "stockReservationId": ""}}
                 try:
-                    _decrement_stock(order.get("items", []), strict=False)
-                except Exception:
-                    pass
+                    # Les marqueurs de reservation_id disent si le crash a eu lieu apres la reservation
+                    if not _stock_reserved(items, reservation_id):
+                        _reserve_stock(items, reservation_id)
+                except HTTPException:
+                    # Paiement deja encaisse : on signale la rupture a l'admin
+                    logger.warning("Stock insuffisant pour la commande payee %s", order_id)
+                    done["$set"] = {"stockShortage": True}
+                db.orders.update_one({"_id": ObjectId(order_id)}, done)
+                _settle_stock_reservation(items, reservation_id)
+    elif event["type"] == "checkout.session.expired":
+        session = event["data"]["object"]
+        order_id = session.get("metadata", {}).get("orderId")
+        if order_id and ObjectId.is_valid(order_id):
+            # Session fermee : le prochain clic en cree une nouvelle (attempt conserve)
+            db.orders.update_one(
+                {"_id": ObjectId(order_id), "stripeCheckout.sessionId": session.get("id")},
+                {"$unset": {"stripeCheckout.sessionId": "", "stripeCheckout.url": "", "stripeCheckout.expiresAt": ""}},
+            )
+
 
-    return {"received": True}
+class WebhookInbox:
+    """Evenements Stripe verifies, persistes avant l'accuse de reception.
+
+    La route n'ecrit qu'un document (_id = id d'evenement Stripe : une
+    relivraison coute un insert en doublon) ; un thread de fond reserve les
+    evenements par lot, les applique et les marque en un seul bulk_write.
+    Les echecs sont rejoues avec backoff, puis laisses en "dead" pour l'admin.
+    """
+
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def record(self, event: dict) -> bool:
+        """False si l'evenement etait deja dans la boite (relivraison Stripe)."""
+        now = datetime.utcnow()
+        try:
+            db.stripe_events.insert_one({
+                "_id": event["id"],
+                "type": event["type"],
+                "event": event,
+                "status": "pending",
+                "attempts": 0,
+                "nextAttemptAt": now,
+                "receivedAt": now,
+            })
+        except DuplicateKeyError:
+            return False
+        self._wake.set()
+        return True
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="stripe-webhooks", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                processed = self.process_batch()
+            except PyMongoError as e:
+                logger.warning("Boite webhooks Stripe indisponible: %s", e)
+                processed = 0
+            except Exception:
+                # Superviseur : une erreur imprevue ne doit pas tuer le thread
+                logger.exception("Erreur inattendue dans la boite webhooks Stripe")
+                processed = 0
+            if processed < WEBHOOK_BATCH_SIZE:
+                self._wake.wait(WEBHOOK_POLL_INTERVAL_SEC)
+                self._wake.clear()
+
+    def _claim(self) -> list[dict]:
+        # Trois allers-retours quelle que soit la taille du lot : ids candidats,
+        # bail pose en update_many (filtre rejoue : pas de double reservation), relecture
+        now = datetime.utcnow()
+        claimable = {"$or": [
+            {"status": "pending", "nextAttemptAt": {"$lte": now}},
+            # Bail expire : le worker precedent est mort en cours de traitement
+            {"status": "processing", "lockedUntil": {"$lte": now}},
+        ]}
+        ids = [d["_id"] for d in db.stripe_events.find(claimable, {"_id": 1}).sort("nextAttemptAt", 1).limit(WEBHOOK_BATCH_SIZE)]
+        if not ids:
+            return []
+        batch_id = f"{self.worker_id}:{ObjectId()}"
+        db.stripe_events.update_many(
+            {"$and": [{"_id": {"$in": ids}}, claimable]},
+            {"$set": {"status": "processing", "lockedUntil": now + timedelta(seconds=WEBHOOK_LEASE_SEC), "lockedBy": batch_id}},
+        )
+        return list(db.stripe_events.find({"lockedBy": batch_id}).sort("nextAttemptAt", 1))
+
+    def process_batch(self) -> int:
+        batch = self._claim()
+        ops = []
+        release = {"lockedUntil": "", "lockedBy": ""}
+        for doc in batch:
+            try:
+                # Application idempotente (filtre sur le statut de la commande)
+                _apply_stripe_event(doc["event"])
+            except Exception as e:
+                ops.append(self._failure(doc, e, release))
+            else:
+                ops.append(UpdateOne(
+                    {"_id": doc["_id"]},
+                    {"$set": {"status": "done", "processedAt": datetime.utcnow()}, "$unset": release},
+                ))
+        if ops:
+            db.stripe_events.bulk_write(ops, ordered=False)
+        return len(batch)
+
+    def _failure(self, doc: dict, exc: Exception, release: dict) -> UpdateOne:
+        now = datetime.utcnow()
+        attempts = doc.get("attempts", 0) + 1
+        fields = {"attempts": attempts, "lastError": f"{type(exc).__name__}: {exc}"[:500]}
+        if attempts >= WEBHOOK_MAX_ATTEMPTS:
+            logger.error("Evenement Stripe %s abandonne apres %s tentative(s): %s", doc["_id"], attempts, exc)
+            fields.update({"status": "dead", "deadAt": now})
+        else:
+            delay = min(WEBHOOK_RETRY_MAX_SEC, WEBHOOK_RETRY_BASE_SEC * 2 ** (attempts - 1))
+            fields.update({"status": "pending", "nextAttemptAt": now + timedelta(seconds=delay * random.uniform(0.8, 1.2))})
+        return UpdateOne({"_id": doc["_id"]}, {"$set": fields, "$unset": release})
+
+    def requeue(self, event_id: str) -> bool:
+        result = db.stripe_events.update_one(
+            {"_id": event_id, "status": "dead"},
+            {"$set": {"status": "pending", "attempts": 0, "nextAttemptAt": datetime.utcnow()}, "$unset": {"deadAt": ""}},
+        )
+        if result.modified_count:
+            self._wake.set()
+        return bool(result.modified_count)
+
+_webhook_inbox = WebhookInbox()
 
 
 # --- 9. PARAMÃˆTRES & STATS ADMIN ---
 
-@app.get("/api/settings")
-def get_settings(): 
+def _load_settings():
     s = db.settings.find_one({"_id": "global_settings"})
     return {"bannerText": s.get("bannerText") if s else "Bienvenue chez TKB SHOP"}
 
+@app.get("/api/settings")
+def get_settings(request: Request):
+    return _cached_json(request, ("settings",), _load_settings)
+
 @app.post("/api/settings")
 def update_settings(s: SiteSettings, admin: dict = Depends(get_current_admin)): 
     db.settings.update_one({"_id": "global_settings"}, {"$set": {"bannerText": s.bannerText}}, upsert=True)
+    # Les reglages font partie de la reponse /api/bootstrap en cache
+    _catalog_cache.bump()
     return {"success": True}
 
-@app.post("/api/newsletter")
+def _category_tree():
+    return [
+        {
+            "label": group["label"],
+            "slug": _group_slug(group["label"]),
+            "subcategories": [{"label": sub, "slug": _slugify(sub)} for sub in group["subcategories"]],
+        }
+        for group in CATEGORY_GROUPS
+    ]
+
+def _bootstrap_public():
+    # "user" en tete : la reponse anonyme est le corps en cache tel quel
+    return {
+        "user": None,
+        "settings": _load_settings(),
+        "categories": _category_tree(),
+        "products": _list_products({}, PRODUCT_SORTS["recent"], BOOTSTRAP_PRODUCTS_LIMIT, None, "card"),
+    }
+
+def _optional_user(request: Request):
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        return get_current_user(token)
+    except HTTPException:
+        return None
+
+@app.get("/api/bootstrap")
+def get_bootstrap(request: Request):
+    # Partie publique servie depuis le cache catalogue (precompressee pour les
+    # anonymes) ; l'utilisateur (cache des principals) remplace "user":null
+    # sans re-serialiser la page produits.
+    key = ("bootstrap", BOOTSTRAP_PRODUCTS_LIMIT)
+    body, etag = _cached_body(key, _bootstrap_public)
+    user = _optional_user(request)
+    headers = {"Cache-Control": "no-cache", "Vary": "Authorization, Accept-Encoding"}
+    if user is not None:
+        body = b'{"user":' + _json_bytes(_sanitize_user(user)) + b"," + body[len(b'{"user":null,'):]
+        etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        headers["Cache-Control"] = "private, no-cache"
+    headers["ETag"] = etag
+    if _etag_matches(request, etag):
+        return _not_modified(request, body, headers)
+    if user is not None:
+        # Corps propre a l'utilisateur : compresse a la volee par le middleware
+        return Response(content=body, media_type="application/json", headers=headers)
+    return _cached_response(request, key, body, headers)
+
+@app.post("/api/newsletter", dependencies=[Depends(rate_limit("newsletter", NEWSLETTER_RATE_LIMIT_MAX, NEWSLETTER_RATE_LIMIT_WINDOW_SEC))])
 def subscribe_newsletter(data: NewsletterSignup):
     email = data.email.lower().strip()
     if db.newsletter.find_one({"email": email}):
         return {"success": True, "already": True}
-    db.newsletter.insert_one({
-        "email": email,
-        "createdAt": datetime.now()
-    })
+    try:
+        db.newsletter.insert_one({
+            "email": email,
+            "createdAt": datetime.now()
+        })
+    except DuplicateKeyError:
+        # Double soumission simultanee : l'index unique tranche
+        return {"success": True, "already": True}
     return {"success": True}
 
 @app.get("/api/admin/newsletter")
@@ -994,18 +3603,91 @@ def list_newsletter(admin: dict = Depends(get_current_admin)):
     return items
 
 @app.get("/api/admin/stats")
-def get_stats(admin: dict = Depends(get_current_admin)):
-    total_revenue = db.orders.aggregate([
-        {"$match": {"status": {"$in": ["PayÃ©", "LivrÃ©", "PayÃ© (VÃ©rifiÃ©)"]}}},
-        {"$group": {"_id": None, "total": {"$sum": "$totalAmount"}}}
-    ])
-    rev_list = list(total_revenue)
+def get_stats(
+    days: int = Query(30, ge=1, le=366),
+    months: int = Query(12, ge=1, le=120),
+    admin: dict = Depends(get_current_admin),
+):
+    doc = db.stats.find_one({"_id": STATS_DOC_ID})
+    if not doc or not doc.get("backfilledAt"):
+        doc = rebuild_dashboard_stats()
+    today = datetime.now().date()
+    day_keys = [(today - timedelta(days=i)).isoformat() for i in range(days - 1, -1, -1)]
     return {
-        "revenue": rev_list[0]["total"] if rev_list else 0,
-        "usersCount": db.users.count_documents({}),
-        "productsCount": db.products.count_documents({}),
-        "ordersCount": db.orders.count_documents({})
+        "revenue": doc.get("revenue", 0),
+        "statusCounts": {k: v for k, v in (doc.get("statusCounts") or {}).items() if v > 0},
+        "usersCount": doc.get("usersCount", 0),
+        "productsCount": doc.get("productsCount", 0),
+        "ordersCount": doc.get("ordersCount", 0),
+        "daily": _stats_series(doc.get("daily") or {}, day_keys, "date"),
+        "monthly": _stats_series(doc.get("monthly") or {}, _last_months(months), "month"),
+    }
+
+@app.post("/api/admin/stats/rebuild")
+def rebuild_stats(admin: dict = Depends(get_current_admin)):
+    doc = rebuild_dashboard_stats()
+    return {"success": True, "ordersCount": doc["ordersCount"], "backfilledAt": doc["backfilledAt"]}
+
+@app.get("/api/admin/indexes/check")
+def get_index_check(admin: dict = Depends(get_current_admin)):
+    report = check_index_usage()
+    return {"ok": all(row["ok"] for row in report), "queries": report}
+
+@app.get("/metrics")
+def get_metrics(request: Request):
+    # Ferme par defaut : sans METRICS_TOKEN la route n'existe pas pour l'exterieur
+    if not METRICS_TOKEN:
+        raise HTTPException(404, "Not Found")
+    # Le scraper doit presenter "Authorization: Bearer <token>"
+    if not secrets.compare_digest(request.headers.get("authorization", ""), f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(401, "Token metriques invalide")
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/api/admin/metrics/mongo-pool")
+def get_mongo_pool_metrics(admin: dict = Depends(get_current_admin)):
+    return _pool_stats.snapshot()
+
+@app.get("/api/admin/metrics/password-hashing")
+def get_password_hashing_metrics(admin: dict = Depends(get_current_admin)):
+    return _password_hasher.stats()
+
+@app.get("/api/admin/email-queue")
+def get_email_queue(admin: dict = Depends(get_current_admin)):
+    counts = {
+        row["_id"]: row["count"]
+        for row in db.email_outbox.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}])
     }
+    dead = []
+    for doc in db.email_outbox.find({"status": "dead"}, {"html": 0, "text": 0}).sort("deadAt", -1).limit(50):
+        doc["id"] = str(doc.pop("_id"))
+        dead.append(doc)
+    return {"counts": counts, "dead": dead}
+
+@app.post("/api/admin/email-queue/{id}/retry")
+def retry_email(id: str, admin: dict = Depends(get_current_admin)):
+    if not ObjectId.is_valid(id):
+        raise HTTPException(400, "Format d'ID invalide")
+    if not _mail_queue.requeue(ObjectId(id)):
+        raise HTTPException(404, "Email introuvable ou non abandonne")
+    return {"success": True}
+
+@app.get("/api/admin/stripe-events")
+def get_stripe_events(admin: dict = Depends(get_current_admin)):
+    counts = {
+        row["_id"]: row["count"]
+        for row in db.stripe_events.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}])
+    }
+    dead = []
+    for doc in db.stripe_events.find({"status": "dead"}, {"event": 0}).sort("deadAt", -1).limit(50):
+        doc["id"] = doc.pop("_id")
+        dead.append(doc)
+    return {"counts": counts, "dead": dead}
+
+@app.post("/api/admin/stripe-events/{id}/retry")
+def retry_stripe_event(id: str, admin: dict = Depends(get_current_admin)):
+    if not _webhook_inbox.requeue(id):
+        raise HTTPException(404, "Evenement introuvable ou non abandonne")
+    return {"success": True}
 
 @app.get("/api/admin/users")
 def get_users(admin: dict = Depends(get_current_admin)):
@@ -1021,6 +3703,104 @@ def get_users(admin: dict = Depends(get_current_admin)):
 def delete_user(id: str, admin: dict = Depends(get_current_admin)): 
     if not ObjectId.is_valid(id):
         raise HTTPException(400, "Format d'ID invalide")
-    db.users.delete_one({"_id": ObjectId(id)})
+    if db.users.delete_one({"_id": ObjectId(id)}).deleted_count:
+        _stats_inc({"usersCount": -1})
+    _principal_cache.invalidate_user(id)
     return {"success": True}
 
+
+# --- 10. EXPORTS ADMIN (streaming CSV / NDJSON) ---
+
+# Champs exportables par collection (jamais de mot de passe ni de token)
+EXPORT_FIELDS = {
+    "orders": [
+        "id", "createdAt", "status", "paymentMethod", "paymentId", "totalAmount",
+        "userId", "userName", "userEmail", "phone", "shippingAddress", "items",
+    ],
+    "users": ["id", "createdAt", "name", "firstName", "lastName", "email", "role", "phone", "country", "countryDial"],
+    "newsletter": ["id", "createdAt", "email"],
+}
+
+EXPORT_CURSOR_FIELD = "cursor"
+
+def _export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    return value
+
+def _export_row(doc: dict, fields: list) -> dict:
+    return {f: _export_value(doc.get("_id") if f == "id" else doc.get(f)) for f in fields}
+
+def _export_stream(cursor, fields: list, fmt: str):
+    # Un chunk par lot de curseur : memoire constante quelle que soit la taille.
+    # Chaque ligne porte son curseur de reprise (dernier champ / derniere colonne) :
+    # apres une coupure, le client relance l'export avec celui de sa derniere ligne
+    batch = []
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow([*fields, EXPORT_CURSOR_FIELD])
+        batch.append(buffer.getvalue())
+    for doc in cursor:
+        row = _export_row(doc, fields)
+        row[EXPORT_CURSOR_FIELD] = _encode_cursor(doc, EXPORT_SORT)
+        if fmt == "csv":
+            buffer = io.StringIO()
+            csv.writer(buffer).writerow(
+                json.dumps(v, default=str, ensure_ascii=False) if isinstance(v, (list, dict)) else v
+                for v in row.values()
+            )
+            batch.append(buffer.getvalue())
+        else:
+            batch.append(json.dumps(row, default=str, ensure_ascii=False) + "\n")
+        if len(batch) >= EXPORT_BATCH_SIZE:
+            yield "".join(batch)
+            batch = []
+    if batch:
+        yield "".join(batch)
+
+@app.get("/api/admin/export/{collection}")
+def export_collection(
+    collection: str,
+    format: str = "csv",
+    fields: Optional[str] = None,
+    dateFrom: Optional[datetime] = None,
+    dateTo: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    admin: dict = Depends(get_current_admin),
+):
+    # cursor : reprise apres une ligne deja recue, valeur de sa colonne "cursor"
+    allowed = EXPORT_FIELDS.get(collection)
+    if allowed is None:
+        raise HTTPException(404, "Export inconnu")
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(400, "Format invalide")
+    selected = [f.strip() for f in fields.split(",") if f.strip()] if fields else allowed
+    if not selected or any(f not in allowed for f in selected):
+        raise HTTPException(400, "Champs invalides")
+
+    query = {}
+    if dateFrom or dateTo:
+        created = {}
+        if dateFrom:
+            created["$gte"] = dateFrom
+        if dateTo:
+            created["$lte"] = dateTo
+        query["createdAt"] = created
+    if cursor:
+        after = _decode_cursor(cursor, EXPORT_SORT)
+        query = {"$and": [query, after]} if query else after
+    # createdAt toujours lu : il entre dans le curseur de reprise de chaque ligne
+    projection = {**{f: 1 for f in selected if f != "id"}, "createdAt": 1}
+    # Filtre et tri servis par l'index (createdAt, _id) : pas de tri en memoire
+    docs = read_db[collection].find(query, projection).sort(EXPORT_SORT).batch_size(EXPORT_BATCH_SIZE)
+
+    media_type = "text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson"
+    filename = f"{collection}-{datetime.utcnow():%Y%m%d-%H%M%S}.{format}"
+    return StreamingResponse(
+        _export_stream(docs, selected, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
@@ -0,0 +1,16 @@
+"""Fonctions bcrypt executees dans les process du pool de hachage.
+
+Module volontairement minimal : chaque worker l'importe seul, sans charger
+FastAPI ni ouvrir de connexion MongoDB.
+"""
+from passlib.context import CryptContext
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def verify_password(password: str, hashed: str) -> bool:
+    return pwd_context.verify(password, hashed)
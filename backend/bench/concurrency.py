@@ -0,0 +1,172 @@
+"""Benchmark de concurrence : trafic mixte catalogue + authentifie.
+
+Compare l'ancienne dependance `async def get_current_user` (appel pymongo
+synchrone dans la boucle d'evenements) a la version actuelle executee dans
+le threadpool. Necessite un MongoDB local ; une base dediee est utilisee
+(son nom doit contenir "bench" : le seed vide la collection products).
+
+    cd backend
+    python bench/concurrency.py --requests 4000 --concurrency 64
+
+Sans MongoDB, --mongomock-latency-ms remplace la base par mongomock et ajoute
+une latence simulee a chaque find_one (ordre de grandeur seulement) :
+
+    python bench/concurrency.py --requests 600 --concurrency 32 --mongomock-latency-ms 3
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    k = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[k]
+
+
+def _summary(samples):
+    return {
+        "count": len(samples),
+        "p50_ms": round(_percentile(samples, 50) * 1000, 2),
+        "p95_ms": round(_percentile(samples, 95) * 1000, 2),
+        "p99_ms": round(_percentile(samples, 99) * 1000, 2),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 2) if samples else 0.0,
+    }
+
+
+def _seed(main):
+    db = main.db
+    if "bench" not in db.name:
+        raise SystemExit(f"Base '{db.name}' refusee : le seed vide products, utiliser une base *bench*")
+    db.products.delete_many({})
+    db.users.delete_many({"email": "bench@tkb.local"})
+    ids = []
+    for i in range(200):
+        doc = {
+            "name": f"Produit {i}",
+            "category": "Sacs",
+            "price": 1000 + i,
+            "stock": 10,
+            "status": "Active",
+        }
+        doc.update(main._product_keys(doc))
+        ids.append(str(db.products.insert_one(doc).inserted_id))
+    db.users.insert_one({"email": "bench@tkb.local", "name": "Bench", "role": "admin", "password": "x"})
+    return ids, main.create_access_token({"sub": "bench@tkb.local"})
+
+
+async def _run(main, ids, token, total, concurrency):
+    import httpx
+
+    transport = httpx.ASGITransport(app=main.app)
+    timings = {"catalog": [], "auth": []}
+    queue = asyncio.Queue()
+    for i in range(total):
+        queue.put_nowait(i)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        async def worker():
+            while True:
+                try:
+                    i = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                if i % 2:
+                    kind, url, headers = "auth", "/api/users/me", {"Authorization": f"Bearer {token}"}
+                else:
+                    kind, url, headers = "catalog", f"/api/products/{ids[i % len(ids)]}", {}
+                start = time.perf_counter()
+                resp = await http.get(url, headers=headers)
+                timings[kind].append(time.perf_counter() - start)
+                if resp.status_code != 200:
+                    raise RuntimeError(f"{url} -> {resp.status_code}")
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    result = {kind: _summary(samples) for kind, samples in timings.items()}
+    result["all"] = _summary(timings["catalog"] + timings["auth"])
+    result["throughput_rps"] = round(total / elapsed, 1)
+    return result
+
+
+def _legacy_dependency(main):
+    # Reproduction de l'ancienne dependance : pymongo synchrone dans un async def
+    async def get_current_user_blocking(token: str = main.Depends(main.oauth2_scheme)):
+        payload = main.jwt.decode(token.replace("Bearer ", ""), main.SECRET_KEY, algorithms=[main.ALGORITHM])
+        user = main.db.users.find_one({"email": payload.get("sub")})
+        if user is None:
+            raise main.HTTPException(401, "Session invalide")
+        user["id"] = str(user["_id"])
+        return user
+
+    return get_current_user_blocking
+
+
+def _use_mongomock(main, latency_ms: float):
+    import mongomock
+    from mongomock.collection import Collection
+
+    find_one = Collection.find_one
+
+    def slow_find_one(self, *args, **kwargs):
+        # Aller-retour reseau simule : bloque le thread appelant comme pymongo
+        time.sleep(latency_ms / 1000)
+        return find_one(self, *args, **kwargs)
+
+    Collection.find_one = slow_find_one
+    main.client = mongomock.MongoClient()
+    main.db = main.client[os.environ["MONGO_DB_NAME"]]
+    main.read_db = main.db
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--db", default="tkb_bench")
+    parser.add_argument("--mongomock-latency-ms", type=float, help="mongomock + latence simulee par find_one")
+    parser.add_argument("--output", help="Fichier JSON de sortie")
+    args = parser.parse_args()
+
+    os.environ["MONGO_DB_NAME"] = args.db
+    # Cache des principaux desactive : "after" doit lire l'utilisateur en base
+    # a chaque requete, comme "before", pour ne mesurer que le threadpool
+    os.environ["PRINCIPAL_CACHE_TTL_SEC"] = "0"
+    from app import main
+
+    # ASGITransport ne declenche pas le lifespan : connexion explicite
+    if args.mongomock_latency_ms is not None:
+        _use_mongomock(main, args.mongomock_latency_ms)
+    else:
+        main.connect_mongo()
+    ids, token = _seed(main)
+    results = {}
+    main.app.dependency_overrides[main.get_current_user] = _legacy_dependency(main)
+    results["before"] = asyncio.run(_run(main, ids, token, args.requests, args.concurrency))
+    main.app.dependency_overrides.clear()
+    results["after"] = asyncio.run(_run(main, ids, token, args.requests, args.concurrency))
+    results["params"] = {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "mongomock_latency_ms": args.mongomock_latency_ms,
+    }
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text, encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main_cli()
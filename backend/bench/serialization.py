@@ -0,0 +1,162 @@
+"""Benchmark de serialisation du catalogue : cout par tranche de 1k produits.
+
+Compare l'ancien chemin (documents complets, jsonable_encoder + json.dumps)
+au chemin actuel (vue "card" + orjson), ainsi que les deux etapes isolees.
+Aucune base n'est necessaire : les documents sont generes en memoire avec la
+forme de ceux de MongoDB (ObjectId, datetime, description longue, images).
+
+Les sorties des deux encodeurs ne sont pas identiques octet pour octet (format
+des flottants, NaN encode null par orjson quand json.dumps refuse) ; --check
+verifie qu'elles decodent vers les memes valeurs, sur les documents generes ou,
+avec --db, sur le catalogue reel (lecture seule).
+
+    cd backend
+    python bench/serialization.py --products 1000 --rounds 50
+"""
+import argparse
+import copy
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+def _documents(main, count: int, seed_value: int) -> list:
+    from bson import ObjectId
+
+    rng = random.Random(seed_value)
+    words = "sac cuir bandouliere doublure coton fermeture zip poche interieure finition doree".split()
+    docs = []
+    for i in range(count):
+        price = rng.randrange(1500, 45000, 50)
+        doc = {
+            "_id": ObjectId(),
+            "name": f"Produit {i}",
+            "category": "Sacs",
+            "categoryGroup": "Sacs",
+            "subcategory": None,
+            "price": float(price),
+            "oldPrice": float(price + 2000) if i % 5 == 0 else None,
+            "stock": rng.randint(0, 40),
+            "image": f"https://cdn.example.com/p/{i}.jpg",
+            "images": [f"https://cdn.example.com/p/{i}-{k}.jpg" for k in range(8)],
+            "description": " ".join(rng.choice(words) for _ in range(120)),
+            "status": "Active",
+            "colors": ["Noir", "Beige"],
+            "sizes": [],
+            "createdAt": datetime(2024, 1, 1) + timedelta(minutes=i),
+        }
+        doc.update(main._product_keys(doc))
+        doc["searchIndex"] = main._search_entries(doc)
+        docs.append(doc)
+    return docs
+
+
+def _card_documents(main, docs: list) -> list:
+    # Ce que renvoie Mongo pour la projection "card"
+    projection = main.PRODUCT_VIEWS["card"]
+    cards = []
+    for doc in docs:
+        card = {"_id": doc["_id"]}
+        for field, spec in projection.items():
+            if field not in doc:
+                continue
+            card[field] = doc[field][:spec["$slice"]] if isinstance(spec, dict) else doc[field]
+        cards.append(card)
+    return cards
+
+
+def _legacy_bytes(payload) -> bytes:
+    # Ancien _json_bytes : meme encodage que JSONResponse de FastAPI
+    from fastapi.encoders import jsonable_encoder
+
+    return json.dumps(
+        jsonable_encoder(payload), ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def _measure(docs: list, serialize, encode, rounds: int) -> dict:
+    timings = []
+    size = 0
+    for _ in range(rounds):
+        # Copie hors chrono : _serialize_* modifie les documents en place
+        batch = copy.deepcopy(docs)
+        start = time.perf_counter()
+        body = encode({"items": [serialize(d) for d in batch], "nextCursor": None})
+        timings.append(time.perf_counter() - start)
+        size = len(body)
+    per_1k = 1000 / len(docs)
+    return {
+        "median_ms_per_1k": round(statistics.median(timings) * 1000 * per_1k, 3),
+        "min_ms_per_1k": round(min(timings) * 1000 * per_1k, 3),
+        "bytes_per_1k": int(size * per_1k),
+    }
+
+
+def _check(main, docs: list) -> dict:
+    # Meme contenu une fois decode ; tout ecart (prix non fini, type inconnu) est liste
+    mismatches = []
+    for doc in docs:
+        try:
+            legacy = json.loads(_legacy_bytes(main._serialize_product(copy.deepcopy(doc))))
+        except ValueError as e:
+            mismatches.append({"id": str(doc.get("_id")), "error": str(e)})
+            continue
+        current = json.loads(main._json_bytes(main._serialize_product(copy.deepcopy(doc))))
+        if legacy != current:
+            mismatches.append({"id": str(doc.get("_id")), "error": "contenu different"})
+    return {"checked": len(docs), "mismatches": mismatches[:20], "mismatchCount": len(mismatches)}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--check", action="store_true", help="Compare les sorties decodees des deux encodeurs")
+    parser.add_argument("--db", help="Avec --check : base MongoDB dont le catalogue est verifie")
+    parser.add_argument("--output", help="Fichier JSON de sortie")
+    args = parser.parse_args()
+
+    if args.db:
+        os.environ["MONGO_DB_NAME"] = args.db
+    from app import main
+
+    if args.check:
+        if args.db:
+            main.connect_mongo()
+            docs = list(main.read_db.products.find({}))
+        else:
+            docs = _documents(main, args.products, args.seed)
+        report = _check(main, docs)
+        print(json.dumps(report, indent=2))
+        sys.exit(1 if report["mismatchCount"] else 0)
+
+    docs = _documents(main, args.products, args.seed)
+    cards = _card_documents(main, docs)
+    cases = {
+        "before_full_jsonable": (docs, main._serialize_product, _legacy_bytes),
+        "full_orjson": (docs, main._serialize_product, main._json_bytes),
+        "card_jsonable": (cards, main._serialize_card, _legacy_bytes),
+        "after_card_orjson": (cards, main._serialize_card, main._json_bytes),
+    }
+    results = {name: _measure(d, serialize, encode, args.rounds) for name, (d, serialize, encode) in cases.items()}
+    before = results["before_full_jsonable"]["median_ms_per_1k"]
+    after = results["after_card_orjson"]["median_ms_per_1k"]
+    results["speedup"] = round(before / after, 1) if after else None
+    results["params"] = {"products": args.products, "rounds": args.rounds}
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text, encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,494 @@
+"""Suite de benchmark de l'API : jeu de donnees realiste + latences par route.
+
+Remplit une base MongoDB dediee (nom contenant "bench", sauf --allow-any-db ;
+par defaut 50k produits repartis sur les CATEGORY_GROUPS du front, 200k
+clients, 2M commandes), puis mesure debit et
+p50/p95/p99 de chaque scenario contre l'application reelle, en process
+(httpx.ASGITransport, lifespan compris) et/ou derriere uvicorn. Le resultat
+JSON sert de reference pour les comparaisons entre versions.
+
+    cd backend
+    python bench/suite.py --scale 0.01 --output bench-small.json
+    python bench/suite.py --mode uvicorn --workers 4 --output bench-rc.json \\
+        --baseline bench-main.json --max-regression 0.15
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BACKEND_DIR))
+
+from concurrency import _summary  # noqa: E402
+
+# Miroir de CATEGORY_GROUPS (frontend/src/utils/product.js)
+CATEGORY_GROUPS = {
+    "Sacs": [],
+    "Chaussures": ["Femme", "Homme", "Bebe"],
+    "Accessoires": ["Colliers", "Bagues", "Bracelets"],
+    "Vetements": ["Robes", "Abayas", "Voiles & Hijabs"],
+}
+COLORS = ["Noir", "Blanc", "Beige", "Rouge", "Bleu", "Vert", "Or", "Argent"]
+SIZES = {
+    "Chaussures": ["36", "37", "38", "39", "40", "41", "42"],
+    "Vetements": ["S", "M", "L", "XL"],
+}
+PAYMENT_METHODS = ["Stripe", "PayPal"]
+BENCH_PASSWORD = "bench-password"
+BENCH_ADMIN_EMAIL = "admin@bench.example.com"
+SEED_BATCH = 10_000
+
+DEFAULT_PRODUCTS = 50_000
+DEFAULT_USERS = 200_000
+DEFAULT_ORDERS = 2_000_000
+DEFAULT_ORDERS_UNTIL = datetime(2025, 1, 1)
+
+SCENARIOS = [
+    "get_products",
+    "get_product",
+    "login",
+    "quote_order",
+    "create_order",
+    "get_my_orders",
+    "get_admin_orders",
+    "get_stats",
+]
+
+
+def _bench_env(db_name: str, concurrency: int) -> dict:
+    # Limiteurs releves : le bench mesure les routes, pas le 429 ; file de hachage
+    # dimensionnee a la concurrence pour que le login mesure bcrypt, pas le 503
+    env = {
+        "MONGO_DB_NAME": db_name,
+        "PASSWORD_HASH_WORKERS": str(os.cpu_count() or 1),
+        "PASSWORD_HASH_QUEUE_MAX": str(concurrency),
+        "EMAIL_WORKER_ENABLED": "false",
+        "LOGIN_RATE_LIMIT_MAX": "1000000000",
+        "QUOTE_RATE_LIMIT_MAX": "1000000000",
+        "REGISTER_RATE_LIMIT_MAX": "1000000000",
+        "RATE_LIMIT_BACKEND": "memory",
+    }
+    os.environ.update(env)
+    return env
+
+
+# --- Jeu de donnees ---
+def _product_doc(main, rng: random.Random, i: int) -> dict:
+    group = rng.choice(list(CATEGORY_GROUPS))
+    subcategory = rng.choice(CATEGORY_GROUPS[group]) if CATEGORY_GROUPS[group] else None
+    price = rng.randrange(1500, 45000, 50)
+    doc = {
+        "name": f"{subcategory or group} {rng.choice(COLORS)} {i}",
+        "category": group,
+        "categoryGroup": group,
+        "subcategory": subcategory,
+        "price": price,
+        "oldPrice": price + rng.randrange(500, 5000, 50) if rng.random() < 0.2 else None,
+        # Stock large : create_order ne doit pas echouer en cours de mesure
+        "stock": 1_000_000,
+        "image": f"https://cdn.bench.local/p/{i}.jpg",
+        "images": [f"https://cdn.bench.local/p/{i}-{k}.jpg" for k in range(3)],
+        "description": f"Article {i} de la categorie {group}.",
+        "status": "Active" if rng.random() < 0.95 else "Inactive",
+        "colors": rng.sample(COLORS, rng.randint(1, 3)),
+        "sizes": list(SIZES.get(group, [])),
+        "createdAt": datetime(2024, 1, 1) + timedelta(minutes=i),
+    }
+    doc.update(main._product_keys(doc))
+    doc["searchIndex"] = main._search_entries(doc)
+    return doc
+
+
+def _insert_batches(collection, docs, total: int, label: str):
+    batch = []
+    inserted = 0
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) >= SEED_BATCH:
+            collection.insert_many(batch, ordered=False)
+            inserted += len(batch)
+            batch = []
+            print(f"  {label}: {inserted}/{total}", file=sys.stderr, end="\r")
+    if batch:
+        collection.insert_many(batch, ordered=False)
+        inserted += len(batch)
+    print(f"  {label}: {inserted}/{total}", file=sys.stderr)
+
+
+def seed(main, products: int, users: int, orders: int, seed_value: int, force: bool,
+         orders_until: datetime = DEFAULT_ORDERS_UNTIL, allow_any_db: bool = False) -> dict:
+    """Remplit la base ; ignore si un seed identique est deja en place."""
+    db = main.db
+    if "bench" not in db.name and not allow_any_db:
+        raise SystemExit(f"Base '{db.name}' refusee : le seed vide plusieurs collections, "
+                         "utiliser une base *bench* ou --allow-any-db")
+    params = {"products": products, "users": users, "orders": orders, "seed": seed_value,
+              "ordersUntil": orders_until.isoformat()}
+    marker = db.bench_meta.find_one({"_id": "seed"})
+    if marker and not force and marker.get("params") == params:
+        return marker
+    rng = random.Random(seed_value)
+    for name in ("products", "product_neighbours", "users", "orders", "stats", "counters"):
+        db[name].delete_many({})
+    main._ensure_indexes()
+
+    _insert_batches(db.products, (_product_doc(main, rng, i) for i in range(products)), products, "produits")
+    product_rows = list(db.products.find({}, {"name": 1, "price": 1, "image": 1, "sizes": 1}))
+
+    # Un seul hash bcrypt pour tous les comptes : le seed ne mesure pas bcrypt
+    password_hash = main.hash_password(BENCH_PASSWORD)
+    base_date = datetime(2023, 1, 1)
+
+    def user_docs():
+        yield {"name": "Bench Admin", "email": BENCH_ADMIN_EMAIL, "password": password_hash,
+               "role": "admin", "createdAt": base_date}
+        for i in range(users):
+            yield {
+                "name": f"Client {i}",
+                "firstName": "Client",
+                "lastName": str(i),
+                "email": f"client{i}@bench.example.com",
+                "password": password_hash,
+                "role": "client",
+                "createdAt": base_date + timedelta(minutes=i),
+            }
+
+    _insert_batches(db.users, user_docs(), users + 1, "clients")
+    user_rows = list(db.users.find({"role": "client"}, {"name": 1, "email": 1}))
+
+    statuses = ["En attente"] + list(main.REVENUE_STATUSES)
+    # Borne fixe (parametre du seed) : meme jeu de commandes d'un jour a l'autre
+    span_sec = int((orders_until - base_date).total_seconds())
+
+    def order_docs():
+        for _ in range(orders):
+            user = rng.choice(user_rows)
+            items = []
+            for product in rng.sample(product_rows, rng.randint(1, 3)):
+                items.append({
+                    "product": str(product["_id"]),
+                    "name": product["name"],
+                    "quantity": rng.randint(1, 3),
+                    "price": product["price"],
+                    "image": product.get("image", ""),
+                    "size": rng.choice(product.get("sizes") or ["Unique"]),
+                })
+            yield {
+                "items": items,
+                "totalAmount": float(sum(it["price"] * it["quantity"] for it in items)),
+                "paymentMethod": rng.choice(PAYMENT_METHODS),
+                "shippingAddress": f"{rng.randint(1, 200)} rue du Bench, Dakar",
+                "phone": f"+22177{rng.randint(1000000, 9999999)}",
+                "status": rng.choices(statuses, weights=[3] + [5] * (len(statuses) - 1))[0],
+                "userId": str(user["_id"]),
+                "userName": user["name"],
+                "userEmail": user["email"],
+                "createdAt": base_date + timedelta(seconds=rng.randrange(span_sec)),
+            }
+
+    _insert_batches(db.orders, order_docs(), orders, "commandes")
+    main.rebuild_dashboard_stats()
+    marker = {"_id": "seed", "params": params, "seededAt": datetime.now()}
+    db.bench_meta.replace_one({"_id": "seed"}, marker, upsert=True)
+    return marker
+
+
+# --- Scenarios ---
+class Fixtures:
+    """Ids, jetons et paniers tires une fois avant la mesure."""
+
+    def __init__(self, main, seed_value: int, sample: int = 500):
+        db = main.db
+        self.rng = random.Random(seed_value + 1)
+        self.products = list(db.products.aggregate([
+            {"$match": {"status": "Active"}},
+            {"$sample": {"size": sample}},
+            {"$project": {"name": 1, "price": 1, "image": 1, "sizes": 1}},
+        ]))
+        users = list(db.users.aggregate([
+            {"$match": {"role": "client"}},
+            {"$sample": {"size": sample}},
+            {"$project": {"email": 1}},
+        ]))
+        self.emails = [u["email"] for u in users]
+        self.user_tokens = [main.create_access_token({"sub": u["email"]}) for u in users]
+        self.admin_token = main.create_access_token({"sub": BENCH_ADMIN_EMAIL})
+        self.groups = list(CATEGORY_GROUPS)
+        self.sorts = list(main.PRODUCT_SORTS)
+
+    def user_headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.rng.choice(self.user_tokens)}"}
+
+    def admin_headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.admin_token}"}
+
+    def cart(self) -> list:
+        items = []
+        for product in self.rng.sample(self.products, self.rng.randint(1, 3)):
+            items.append({
+                "product": str(product["_id"]),
+                "name": product["name"],
+                "quantity": 1,
+                "price": product["price"],
+                "image": product.get("image", ""),
+                "size": self.rng.choice(product.get("sizes") or ["Unique"]),
+            })
+        return items
+
+    def request(self, scenario: str) -> tuple:
+        """(methode, url, kwargs httpx) pour un appel du scenario."""
+        if scenario == "get_products":
+            params = {"categoryGroup": self.rng.choice(self.groups), "sort": self.rng.choice(self.sorts), "limit": 24}
+            return "GET", "/api/products", {"params": params}
+        if scenario == "get_product":
+            return "GET", f"/api/products/{self.rng.choice(self.products)['_id']}", {}
+        if scenario == "login":
+            body = {"email": self.rng.choice(self.emails), "password": BENCH_PASSWORD}
+            return "POST", "/api/auth/login", {"json": body}
+        if scenario == "quote_order":
+            return "POST", "/api/orders/quote", {"json": {"items": self.cart()}, "headers": self.user_headers()}
+        if scenario == "create_order":
+            items = self.cart()
+            body = {
+                "items": items,
+                "totalAmount": sum(it["price"] * it["quantity"] for it in items),
+                "paymentMethod": "Stripe",
+                "shippingAddress": "1 rue du Bench, Dakar",
+                "phone": "+221770000000",
+            }
+            return "POST", "/api/orders", {"json": body, "headers": self.user_headers()}
+        if scenario == "get_my_orders":
+            return "GET", "/api/orders/my-orders", {"headers": self.user_headers()}
+        if scenario == "get_admin_orders":
+            params = {"limit": 50}
+            if self.rng.random() < 0.5:
+                params["status"] = "En attente"
+            return "GET", "/api/admin/orders", {"params": params, "headers": self.admin_headers()}
+        if scenario == "get_stats":
+            return "GET", "/api/admin/stats", {"headers": self.admin_headers()}
+        raise ValueError(f"Scenario inconnu: {scenario}")
+
+
+async def _drive(http, fixtures: Fixtures, scenario: str, total: int, concurrency: int, warmup: int) -> dict:
+    for _ in range(warmup):
+        method, url, kwargs = fixtures.request(scenario)
+        await http.request(method, url, **kwargs)
+
+    samples = []
+    errors = {}
+    remaining = total
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            method, url, kwargs = fixtures.request(scenario)
+            start = time.perf_counter()
+            resp = await http.request(method, url, **kwargs)
+            samples.append(time.perf_counter() - start)
+            if not 200 <= resp.status_code < 300:
+                errors[resp.status_code] = errors.get(resp.status_code, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    result = _summary(samples)
+    result["throughput_rps"] = round(len(samples) / elapsed, 1) if elapsed else 0.0
+    result["errors"] = {str(code): count for code, count in sorted(errors.items())}
+    # Des reponses non 2xx faussent les latences (rejets rapides) : scenario invalide
+    result["failed"] = bool(errors)
+    return result
+
+
+async def _run_scenarios(http, fixtures: Fixtures, scenarios: list, args) -> dict:
+    results = {}
+    for scenario in scenarios:
+        # Le login passe par bcrypt : volume reduit pour garder une duree raisonnable
+        total = max(1, args.requests // 10) if scenario == "login" else args.requests
+        results[scenario] = await _drive(http, fixtures, scenario, total, args.concurrency, args.warmup)
+        print(f"  {scenario}: {results[scenario]}", file=sys.stderr)
+    return results
+
+
+async def run_inprocess(main, fixtures: Fixtures, scenarios: list, args) -> dict:
+    import httpx
+
+    # ASGITransport ne declenche pas le lifespan : on l'execute autour de la mesure
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as http:
+            return await _run_scenarios(http, fixtures, scenarios, args)
+
+
+async def _wait_ready(http, proc, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"uvicorn s'est arrete (code {proc.returncode})")
+        try:
+            if (await http.get("/api/products", params={"limit": 1})).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("uvicorn ne repond pas")
+
+
+def run_uvicorn(fixtures: Fixtures, scenarios: list, args, env: dict) -> dict:
+    import httpx
+
+    cmd = [
+        sys.executable, "-m", "uvicorn", "app.main:app",
+        "--host", "127.0.0.1", "--port", str(args.port),
+        "--workers", str(args.workers), "--log-level", "warning", "--no-access-log",
+    ]
+    proc = subprocess.Popen(cmd, cwd=BACKEND_DIR, env={**os.environ, **env})
+
+    async def go():
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", limits=limits, timeout=60) as http:
+            await _wait_ready(http, proc)
+            return await _run_scenarios(http, fixtures, scenarios, args)
+
+    try:
+        return asyncio.run(go())
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+# --- Rapport ---
+def _git_revision() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                             capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or "unknown"
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+
+
+def compare(current: dict, baseline: dict, max_regression: float) -> list:
+    """Regressions de p95 ou de debit au-dela du seuil, par mode et scenario."""
+    regressions = []
+    for mode, scenarios in current["results"].items():
+        for scenario, stats in scenarios.items():
+            ref = baseline.get("results", {}).get(mode, {}).get(scenario)
+            if not ref:
+                continue
+            p95_delta = (stats["p95_ms"] - ref["p95_ms"]) / ref["p95_ms"] if ref["p95_ms"] else 0.0
+            rps_delta = (ref["throughput_rps"] - stats["throughput_rps"]) / ref["throughput_rps"] if ref["throughput_rps"] else 0.0
+            line = (f"{mode:10} {scenario:18} p95 {ref['p95_ms']:>9.2f} -> {stats['p95_ms']:>9.2f} ms ({p95_delta:+.0%})"
+                    f"  rps {ref['throughput_rps']:>8.1f} -> {stats['throughput_rps']:>8.1f}")
+            print(line)
+            if p95_delta > max_regression or rps_delta > max_regression:
+                regressions.append(f"{mode}/{scenario}")
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default="tkb_bench_suite")
+    parser.add_argument("--scale", type=float, default=1.0, help="Facteur applique au volume par defaut")
+    parser.add_argument("--products", type=int)
+    parser.add_argument("--users", type=int)
+    parser.add_argument("--orders", type=int)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reseed", action="store_true", help="Force le re-remplissage de la base")
+    parser.add_argument("--orders-until", type=datetime.fromisoformat, default=DEFAULT_ORDERS_UNTIL,
+                        help="Date de la commande la plus recente du jeu (AAAA-MM-JJ)")
+    parser.add_argument("--allow-any-db", action="store_true",
+                        help="Autorise le seed sur une base dont le nom ne contient pas 'bench'")
+    parser.add_argument("--mode", choices=["inprocess", "uvicorn", "both"], default="inprocess")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=2000, help="Requetes mesurees par scenario")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=1, help="Workers uvicorn")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", help="Fichier JSON de sortie")
+    parser.add_argument("--baseline", help="Resultat JSON de reference a comparer")
+    parser.add_argument("--max-regression", type=float, default=0.15)
+    args = parser.parse_args()
+
+    scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"scenarios inconnus: {', '.join(sorted(unknown))}")
+    volumes = {
+        "products": args.products or max(1, int(DEFAULT_PRODUCTS * args.scale)),
+        "users": args.users or max(1, int(DEFAULT_USERS * args.scale)),
+        "orders": args.orders or max(1, int(DEFAULT_ORDERS * args.scale)),
+    }
+
+    env = _bench_env(args.db, args.concurrency)
+    from app import main
+
+    main.connect_mongo()
+    started = time.perf_counter()
+    seed(main, volumes["products"], volumes["users"], volumes["orders"], args.seed, args.reseed,
+         orders_until=args.orders_until, allow_any_db=args.allow_any_db)
+    seed_sec = round(time.perf_counter() - started, 1)
+    fixtures = Fixtures(main, args.seed)
+
+    results = {}
+    if args.mode in ("inprocess", "both"):
+        print("in-process", file=sys.stderr)
+        results["inprocess"] = asyncio.run(run_inprocess(main, fixtures, scenarios, args))
+        # Le lifespan a ferme le client : on le rouvre pour la suite
+        main.connect_mongo()
+    if args.mode in ("uvicorn", "both"):
+        print(f"uvicorn ({args.workers} worker(s))", file=sys.stderr)
+        results["uvicorn"] = run_uvicorn(fixtures, scenarios, args, env)
+    main.close_mongo()
+
+    report = {
+        "meta": {
+            "revision": _git_revision(),
+            "createdAt": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "dataset": volumes,
+            "seedSec": seed_sec,
+            "params": {
+                "seed": args.seed,
+                "requests": args.requests,
+                "concurrency": args.concurrency,
+                "warmup": args.warmup,
+                "workers": args.workers,
+            },
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text, encoding="utf-8")
+
+    failed = [f"{mode}/{scenario}" for mode, stats in results.items()
+              for scenario, result in stats.items() if result["failed"]]
+    if failed:
+        print(f"Scenarios en erreur (reponses non 2xx): {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        regressions = compare(report, baseline, args.max_regression)
+        if regressions:
+            print(f"Regressions (> {args.max_regression:.0%}): {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
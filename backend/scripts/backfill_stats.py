@@ -0,0 +1,32 @@
+"""Backfill ponctuel du document de stats du dashboard.
+
+A lancer une fois apres deploiement (ou apres une correction manuelle des
+commandes) ; les ecritures suivantes le maintiennent incrementalement.
+
+    cd backend
+    python scripts/backfill_stats.py
+"""
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+def main_cli():
+    from app import main
+
+    main.connect_mongo()
+    doc = main.rebuild_dashboard_stats()
+    print(json.dumps({
+        "ordersCount": doc["ordersCount"],
+        "revenue": doc["revenue"],
+        "usersCount": doc["usersCount"],
+        "productsCount": doc["productsCount"],
+        "days": len(doc["daily"]),
+        "months": len(doc["monthly"]),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,30 @@
+"""Applique le registre d'index puis verifie par explain() les requetes chaudes.
+
+Code de sortie 1 si une requete de HOT_QUERIES passe par un COLLSCAN, un tri
+bloquant (SORT) ou examine bien plus de cles/documents qu'elle n'en renvoie
+(INDEX_CHECK_MAX_EXAMINED_RATIO). A lancer sur une base avec des volumes
+representatifs : sur des collections vides, tous les plans sont "ok".
+
+    cd backend
+    python scripts/check_indexes.py
+"""
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+def main_cli():
+    from app import main
+
+    main.connect_mongo()
+    main._ensure_indexes()
+    report = main.check_index_usage()
+    print(json.dumps(report, indent=2))
+    if not all(row["ok"] for row in report):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,73 @@
+"""Fixtures communes : app.main branche sur une base mongomock neuve par test.
+
+    cd backend
+    pip install pytest mongomock
+    python -m pytest -q
+"""
+import sys
+from pathlib import Path
+
+import mongomock
+import pytest
+from mongomock.collection import BulkOperationBuilder
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app import main as app_main  # noqa: E402
+
+
+def _accept_sort(method):
+    # pymongo >= 4.11 transmet `sort` a UpdateOne/ReplaceOne ; mongomock ne le connait pas
+    def wrapper(self, *args, sort=None, **kwargs):
+        return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+BulkOperationBuilder.add_update = _accept_sort(BulkOperationBuilder.add_update)
+BulkOperationBuilder.add_replace = _accept_sort(BulkOperationBuilder.add_replace)
+
+
+@pytest.fixture
+def main(monkeypatch):
+    client = mongomock.MongoClient()
+    database = client.get_database("tkb_test")
+    monkeypatch.setattr(app_main, "client", client)
+    monkeypatch.setattr(app_main, "db", database)
+    monkeypatch.setattr(app_main, "read_db", database)
+    # mongomock = standalone : chemin de reservation sans transaction
+    monkeypatch.setattr(app_main, "_transactions_supported", False)
+    monkeypatch.setattr(app_main, "_catalog_cache", app_main.CatalogCache(
+        app_main.CATALOG_CACHE_MAX_ENTRIES, app_main.CATALOG_CACHE_MAX_BYTES, app_main.CATALOG_CACHE_TTL_SEC,
+    ))
+    monkeypatch.setattr(app_main, "_principal_cache", app_main.PrincipalCache(
+        app_main.PRINCIPAL_CACHE_MAX_ENTRIES, app_main.PRINCIPAL_CACHE_TTL_SEC,
+    ))
+    return app_main
+
+
+@pytest.fixture
+def api(main):
+    from fastapi.testclient import TestClient
+
+    # Sans bloc `with` : le lifespan (vraie connexion Mongo, workers) n'est pas lance
+    return TestClient(main.app)
+
+
+@pytest.fixture
+def admin_headers(main):
+    main.db.users.insert_one({"email": "admin@example.com", "name": "Admin", "role": "admin"})
+    token = main.create_access_token({"sub": "admin@example.com"})
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def make_product(main):
+    def make(name: str = "Produit", price: float = 1000, stock: int = 10, **extra):
+        doc = {"name": name, "category": "Sacs", "price": price, "stock": stock, "status": "Active", **extra}
+        doc.update(main._product_keys(doc))
+        doc["searchIndex"] = main._search_entries(doc)
+        doc["_id"] = main.db.products.insert_one(doc).inserted_id
+        return doc
+
+    return make
@@ -0,0 +1,78 @@
+def test_if_none_match_returns_304_without_body(api, make_product):
+    make_product()
+    first = api.get("/api/products")
+    etag = first.headers["ETag"]
+    again = api.get("/api/products", headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.content == b""
+    assert again.headers["ETag"] == etag
+
+
+def test_admin_write_changes_etag(api, main, make_product, admin_headers):
+    product = make_product(name="Sac", price=1000)
+    etag = api.get("/api/products").headers["ETag"]
+
+    body = {"name": "Sac", "category": "Sacs", "price": 2000, "stock": 10}
+    assert api.put(f"/api/products/{product['_id']}", json=body, headers=admin_headers).status_code == 200
+
+    resp = api.get("/api/products", headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert resp.headers["ETag"] != etag
+    assert resp.json()[0]["price"] == 2000
+
+
+def test_stale_entry_is_not_served_after_bump(api, main, make_product):
+    # Une reponse calculee avant l'ecriture ne doit pas survivre au bump
+    make_product(name="A")
+    assert len(api.get("/api/products").json()) == 1
+    make_product(name="B")
+    main._catalog_cache.bump()
+    assert len(api.get("/api/products").json()) == 2
+
+
+
+def test_reservation_only_drops_entries_with_reserved_products(api, main, make_product):
+    reserved = make_product(name="A", stock=5)
+    other = make_product(name="B", stock=5)
+    api.get(f"/api/products/{reserved['_id']}")
+    other_etag = api.get(f"/api/products/{other['_id']}").headers["ETag"]
+    api.get("/api/products")
+
+    main._reserve_stock([{"product": str(reserved["_id"]), "quantity": 2}])
+
+    keys = set(main._catalog_cache._entries)
+    assert ("product", str(other["_id"])) in keys
+    assert ("product", str(reserved["_id"])) not in keys
+    assert not any(key[0] == "products" for key in keys)
+    assert api.get(f"/api/products/{reserved['_id']}").json()["stock"] == 3
+    assert api.get(f"/api/products/{other['_id']}", headers={"If-None-Match": other_etag}).status_code == 304
+
+
+def test_response_built_before_reservation_is_not_cached(main):
+    cache = main._catalog_cache
+    ticket = cache.ticket()
+    # Reservation pendant le calcul de la reponse : son stock est peut-etre deja faux
+    cache.invalidate_products(["p1"])
+    cache.put("k", ticket, b"[]", '"e"', frozenset({"p1"}))
+    assert cache.get("k") is None
+    cache.put("k", ticket, b"[]", '"e"', frozenset({"p2"}))
+    assert cache.get("k") == (b"[]", '"e"')
+
+
+def test_304_for_compressed_variant_keeps_weak_etag(api, main, make_product):
+    for i in range(20):
+        make_product(name=f"Sac {i}", description="x" * 100)
+    gzip_headers = {"Accept-Encoding": "gzip"}
+    first = api.get("/api/products", headers=gzip_headers)
+    assert first.headers["Content-Encoding"] == "gzip"
+    weak = first.headers["ETag"]
+    assert weak.startswith("W/")
+
+    again = api.get("/api/products", headers={**gzip_headers, "If-None-Match": weak})
+    assert again.status_code == 304
+    assert again.headers["ETag"] == weak
+
+    # Client sans compression : representation identite, ETag fort
+    identity = api.get("/api/products", headers={"Accept-Encoding": "identity", "If-None-Match": weak})
+    assert identity.status_code == 304
+    assert identity.headers["ETag"] == weak.removeprefix("W/")
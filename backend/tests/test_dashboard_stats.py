@@ -0,0 +1,56 @@
+from datetime import datetime
+
+import pytest
+
+
+@pytest.fixture
+def orders(main):
+    main.db.orders.insert_many([
+        {"status": "En attente", "createdAt": datetime(2024, 1, 2), "totalAmount": 100} for _ in range(3)
+    ])
+
+
+def _live(main):
+    return main.db.stats.find_one({"_id": main.STATS_DOC_ID})
+
+
+def test_rebuild_counts_existing_orders(main, orders):
+    doc = main.rebuild_dashboard_stats()
+    assert doc["ordersCount"] == 3
+    assert doc["statusCounts"] == {"En attente": 3}
+    assert doc["daily"]["2024-01-02"]["orders"] == 3
+    assert "rebuildingSince" not in doc
+
+
+def test_increment_during_rebuild_is_kept(main, orders, monkeypatch):
+    aggregate = main._stats_aggregate
+
+    def slow_aggregate():
+        doc = aggregate()
+        # Commande creee pendant le calcul, apres la lecture des commandes
+        main._stats_order_created({"status": "En attente", "createdAt": datetime(2024, 1, 3), "totalAmount": 50})
+        return doc
+
+    monkeypatch.setattr(main, "_stats_aggregate", slow_aggregate)
+    main.rebuild_dashboard_stats()
+    live = _live(main)
+    assert live["ordersCount"] == 4
+    assert live["daily"]["2024-01-03"]["orders"] == 1
+    assert main.db.stats.find_one({"_id": main.STATS_PENDING_ID}) is None
+
+
+def test_failed_rebuild_releases_increments(main, orders, monkeypatch):
+    main.rebuild_dashboard_stats()
+
+    def broken():
+        main._stats_order_created({"status": "En attente", "createdAt": datetime(2024, 1, 3), "totalAmount": 50})
+        raise RuntimeError("agregation interrompue")
+
+    monkeypatch.setattr(main, "_stats_aggregate", broken)
+    with pytest.raises(RuntimeError):
+        main.rebuild_dashboard_stats()
+    live = _live(main)
+    assert "rebuildingSince" not in live
+    assert live["ordersCount"] == 4
+    main._stats_order_created({"status": "En attente", "createdAt": datetime(2024, 1, 3), "totalAmount": 50})
+    assert _live(main)["ordersCount"] == 5
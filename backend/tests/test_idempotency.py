@@ -0,0 +1,83 @@
+import hashlib
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException, Response
+
+
+@pytest.fixture
+def user_headers(main):
+    main.db.users.insert_one({"email": "client@example.com", "name": "Client", "role": "user"})
+    return {"Authorization": f"Bearer {main.create_access_token({'sub': 'client@example.com'})}"}
+
+
+@pytest.fixture
+def store(main):
+    return main.IdempotencyStore(ttl_sec=3600, lease_sec=60)
+
+
+def _order(product, quantity=1):
+    return {
+        "items": [{"product": str(product["_id"]), "name": "Sac", "quantity": quantity, "price": 1, "image": ""}],
+        "totalAmount": 1,
+        "paymentMethod": "Stripe",
+        "shippingAddress": "1 rue du Test, Dakar",
+        "phone": "770000000",
+    }
+
+
+def test_same_key_replays_the_first_order(api, main, make_product, user_headers):
+    body = _order(make_product(price=1500))
+    headers = {**user_headers, "Idempotency-Key": "checkout-1"}
+    first = api.post("/api/orders", json=body, headers=headers)
+    again = api.post("/api/orders", json=body, headers=headers)
+    assert first.status_code == again.status_code == 200
+    assert again.json() == first.json()
+    assert again.headers["Idempotent-Replayed"] == "true"
+    assert main.db.orders.count_documents({}) == 1
+
+
+def test_same_key_other_payload_is_422(api, make_product, user_headers):
+    product = make_product()
+    headers = {**user_headers, "Idempotency-Key": "checkout-2"}
+    assert api.post("/api/orders", json=_order(product), headers=headers).status_code == 200
+    assert api.post("/api/orders", json=_order(product, quantity=2), headers=headers).status_code == 422
+
+
+def test_failed_request_releases_the_key(api, main, make_product, user_headers):
+    product = make_product(stock=0)
+    headers = {**user_headers, "Idempotency-Key": "checkout-3"}
+    assert api.post("/api/orders", json=_order(product), headers=headers).status_code == 409
+    main.db.products.update_one({"_id": product["_id"]}, {"$set": {"stock": 5}})
+    assert api.post("/api/orders", json=_order(product), headers=headers).status_code == 200
+
+
+def test_in_flight_duplicate_gets_409_immediately(store):
+    def first():
+        # Doublon arrive pendant que le premier appel travaille encore
+        with pytest.raises(HTTPException) as exc:
+            store.run("orders", "u1", "k", {"a": 1}, lambda: pytest.fail("le doublon ne doit pas s'executer"))
+        assert exc.value.status_code == 409
+        assert exc.value.headers == {"Retry-After": "1"}
+        return {"ok": True}
+
+    assert store.run("orders", "u1", "k", {"a": 1}, first) == {"ok": True}
+
+
+def test_expired_lease_is_taken_over(main, store):
+    request_hash = hashlib.sha256(main._json_bytes({"a": 1})).hexdigest()
+    main.db.idempotency_keys.insert_one({
+        "_id": "orders:u1:k",
+        "state": "pending",
+        "requestHash": request_hash,
+        "leaseUntil": datetime.utcnow() - timedelta(seconds=1),
+    })
+    assert store.run("orders", "u1", "k", {"a": 1}, lambda: {"ok": True}) == {"ok": True}
+    assert main.db.idempotency_keys.find_one({"_id": "orders:u1:k"})["state"] == "done"
+
+
+def test_replay_keeps_status_code(store):
+    created = Response(b'{"id":"x"}', status_code=201, media_type="application/json")
+    assert store.run("orders", "u1", "k", {"a": 1}, lambda: created).status_code == 201
+    replay = store.run("orders", "u1", "k", {"a": 1}, lambda: pytest.fail("rejeu attendu"))
+    assert (replay.status_code, replay.body) == (201, b'{"id":"x"}')
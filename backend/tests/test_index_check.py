@@ -0,0 +1,40 @@
+def _explain(stages, returned, keys, docs):
+    plan = {}
+    for stage in reversed(stages):
+        plan = {"stage": stage, **({"inputStage": plan} if plan else {})}
+    return {
+        "queryPlanner": {"winningPlan": plan},
+        "executionStats": {"nReturned": returned, "totalKeysExamined": keys, "totalDocsExamined": docs},
+    }
+
+
+def test_selective_index_scan_is_ok(main):
+    report = main._assess_plan(_explain(["LIMIT", "FETCH", "IXSCAN"], 50, 50, 50), sorted_query=True)
+    assert report["ok"] and report["problems"] == []
+
+
+def test_collscan_fails(main):
+    report = main._assess_plan(_explain(["LIMIT", "COLLSCAN"], 5, 0, 5), sorted_query=False)
+    assert report["problems"] == ["collscan"]
+
+
+def test_blocking_sort_fails_on_sorted_query(main):
+    report = main._assess_plan(_explain(["SORT", "FETCH", "IXSCAN"], 50, 60, 60), sorted_query=True)
+    assert report["problems"] == ["blocking_sort"]
+
+
+def test_index_scan_reading_far_more_than_returned_fails(main):
+    # IXSCAN sur le mauvais prefixe : toute la collection examinee pour 50 lignes
+    report = main._assess_plan(_explain(["LIMIT", "FETCH", "IXSCAN"], 50, 20000, 20000), sorted_query=True)
+    assert report["problems"] == ["unselective"]
+    assert report["totalDocsExamined"] == 20000
+
+
+def test_small_collections_are_not_flagged(main):
+    report = main._assess_plan(_explain(["FETCH", "IXSCAN"], 1, 150, 150), sorted_query=False)
+    assert report["ok"]
+
+
+def test_export_hot_query_uses_export_sort(main):
+    hot = {name: sort for name, _, _, sort in main.HOT_QUERIES}
+    assert hot["orders.export"] == main.EXPORT_SORT
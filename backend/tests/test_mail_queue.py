@@ -0,0 +1,114 @@
+import smtplib
+from datetime import datetime, timedelta
+
+import pytest
+
+
+class FakeSession:
+    """Remplace la connexion SMTP : enregistre les envois, echoue sur demande."""
+
+    def __init__(self, fail_for=()):
+        self.sent = []
+        self.fail_for = set(fail_for)
+
+    def send(self, message):
+        if message["To"] in self.fail_for:
+            raise smtplib.SMTPServerDisconnected("connexion perdue")
+        self.sent.append(message["To"])
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def queue(main, monkeypatch):
+    monkeypatch.setattr(main, "SMTP_HOST", "smtp.example.com")
+    mail_queue = main.MailQueue()
+    mail_queue._session = FakeSession()
+    return mail_queue
+
+
+def _status(main, email_id):
+    return main.db.email_outbox.find_one({"_id": email_id})
+
+
+def test_batch_sends_and_drops_body(main, queue):
+    ids = [queue.enqueue(f"user{i}@example.com", "Sujet", "<p>lien</p>") for i in range(3)]
+    assert queue.process_batch() == 3
+    assert queue._session.sent == [f"user{i}@example.com" for i in range(3)]
+    for email_id in ids:
+        doc = _status(main, email_id)
+        assert doc["status"] == "sent" and "html" not in doc and "lockedBy" not in doc
+
+
+def test_claim_takes_one_message_with_its_own_lease(main, queue):
+    queue.enqueue("a@example.com", "Sujet", "<p>a</p>")
+    queue.enqueue("b@example.com", "Sujet", "<p>b</p>")
+    claimed = queue._claim()
+    assert claimed["status"] == "sending" and claimed["lockedBy"] == queue.worker_id
+    # Le second message reste disponible pour un autre worker
+    assert main.db.email_outbox.count_documents({"status": "pending"}) == 1
+
+
+def test_live_lease_is_not_claimed_twice(main, queue):
+    queue.enqueue("a@example.com", "Sujet", "<p>a</p>")
+    assert queue._claim() is not None
+    other = main.MailQueue()
+    assert other._claim() is None
+
+
+def test_expired_lease_is_reclaimed(main, queue):
+    email_id = queue.enqueue("a@example.com", "Sujet", "<p>a</p>")
+    main.db.email_outbox.update_one({"_id": email_id}, {"$set": {
+        "status": "sending", "lockedBy": "mort:1", "lockedUntil": datetime.utcnow() - timedelta(seconds=1),
+    }})
+    assert queue.process_batch() == 1
+    assert _status(main, email_id)["status"] == "sent"
+
+
+def test_result_is_not_written_after_lease_loss(main, queue):
+    email_id = queue.enqueue("a@example.com", "Sujet", "<p>a</p>")
+
+    class SlowSession(FakeSession):
+        def send(self, message):
+            # Bail expire pendant l'envoi : un autre worker a repris le message
+            main.db.email_outbox.update_one({"_id": email_id}, {"$set": {"lockedBy": "autre:2"}})
+            super().send(message)
+
+    queue._session = SlowSession()
+    queue.process_batch()
+    assert _status(main, email_id)["lockedBy"] == "autre:2"
+    assert _status(main, email_id)["status"] == "sending"
+
+
+def test_transient_failure_is_rescheduled(main, queue):
+    email_id = queue.enqueue("down@example.com", "Sujet", "<p>a</p>")
+    queue._session = FakeSession(fail_for={"down@example.com"})
+    queue.process_batch()
+    doc = _status(main, email_id)
+    assert doc["status"] == "pending" and doc["attempts"] == 1
+    assert doc["nextAttemptAt"] > datetime.utcnow()
+
+
+def test_start_refuses_lease_shorter_than_a_send(main, queue, monkeypatch):
+    monkeypatch.setattr(main, "EMAIL_LEASE_SEC", main.SMTP_TIMEOUT_SEC)
+    with pytest.raises(RuntimeError):
+        queue.start()
+
+
+def test_worker_survives_unexpected_error(main, queue, monkeypatch, caplog):
+    monkeypatch.setattr(main, "EMAIL_POLL_INTERVAL_SEC", 0)
+    calls = []
+
+    def flaky_batch():
+        calls.append(1)
+        if len(calls) == 1:
+            raise ValueError("gabarit casse")
+        queue._stop.set()
+        return 0
+
+    monkeypatch.setattr(queue, "process_batch", flaky_batch)
+    queue._run()
+    # Le second tour a eu lieu : l'exception n'a pas arrete la boucle
+    assert len(calls) == 2
+    assert "Erreur inattendue dans la file email" in caplog.text
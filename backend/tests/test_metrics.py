@@ -0,0 +1,49 @@
+import re
+from types import SimpleNamespace
+
+
+def test_metrics_hidden_without_token(api, main, monkeypatch):
+    monkeypatch.setattr(main, "METRICS_TOKEN", None)
+    assert api.get("/metrics").status_code == 404
+
+
+def test_metrics_require_bearer_token(api, main, monkeypatch):
+    monkeypatch.setattr(main, "METRICS_TOKEN", "scrape-secret")
+    assert api.get("/metrics").status_code == 401
+    assert api.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    resp = api.get("/metrics", headers={"Authorization": "Bearer scrape-secret"})
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/plain")
+
+
+def _count(text: str, series: str) -> int:
+    match = re.search(rf"^{re.escape(series)} (\d+)$", text, re.MULTILINE)
+    return int(match.group(1)) if match else 0
+
+
+def _scrape(api, main, monkeypatch) -> str:
+    monkeypatch.setattr(main, "METRICS_TOKEN", "scrape-secret")
+    return api.get("/metrics", headers={"Authorization": "Bearer scrape-secret"}).text
+
+
+def test_request_is_recorded_under_route_template(api, main, make_product, monkeypatch):
+    series = 'tkb_http_request_duration_seconds_count{method="GET",route="/api/products/{id}",status="200"}'
+    before = _count(_scrape(api, main, monkeypatch), series)
+    product = make_product()
+    assert api.get(f"/api/products/{product['_id']}").status_code == 200
+    text = _scrape(api, main, monkeypatch)
+    # Modele de route, pas l'id : cardinalite bornee
+    assert _count(text, series) == before + 1
+    assert str(product["_id"]) not in text
+
+
+def test_mongo_command_is_recorded(api, main, monkeypatch):
+    # mongomock n'emet pas d'evenements : on rejoue ceux que pymongo envoie au listener
+    series = 'tkb_mongo_command_duration_seconds_count{command="find",collection="products",outcome="ok"}'
+    before = _count(_scrape(api, main, monkeypatch), series)
+    started = SimpleNamespace(command_name="find", command={"find": "products"}, connection_id=("db", 27017), request_id=7)
+    main._command_metrics.started(started)
+    main._command_metrics.succeeded(SimpleNamespace(
+        command_name="find", connection_id=("db", 27017), request_id=7, duration_micros=2500,
+    ))
+    assert _count(_scrape(api, main, monkeypatch), series) == before + 1
@@ -0,0 +1,43 @@
+def _user(main, role="client"):
+    user_id = main.db.users.insert_one({"email": "a@example.com", "name": "A", "role": role}).inserted_id
+    return str(user_id), main.create_access_token({"sub": "a@example.com"})
+
+
+def test_principal_is_cached_then_invalidated(main):
+    user_id, token = _user(main)
+    assert main.get_current_user(token)["role"] == "client"
+    main.db.users.update_one({"email": "a@example.com"}, {"$set": {"role": "admin"}})
+    # Cache encore chaud : pas de relecture
+    assert main.get_current_user(token)["role"] == "client"
+    main._principal_cache.invalidate_user(user_id)
+    assert main.get_current_user(token)["role"] == "admin"
+
+
+def test_invalidation_during_read_is_not_recached(main, monkeypatch):
+    user_id, token = _user(main, role="admin")
+    users = main.db.users
+    find_one = users.find_one
+
+    def racing_find_one(*args, **kwargs):
+        user = find_one(*args, **kwargs)
+        # Retrogradation concurrente entre la lecture et le put
+        users.update_one({"email": "a@example.com"}, {"$set": {"role": "client"}})
+        main._principal_cache.invalidate_user(user_id)
+        return user
+
+    monkeypatch.setattr(users, "find_one", racing_find_one)
+    assert main.get_current_user(token)["role"] == "admin"
+    monkeypatch.setattr(users, "find_one", find_one)
+    assert main.get_current_user(token)["role"] == "client"
+
+
+def test_ticket_older_than_pruned_history_is_refused(main):
+    cache = main.PrincipalCache(max_entries=2, ttl_sec=60)
+    ticket = cache.generation()
+    for user_id in ("u1", "u2", "u3"):
+        cache.invalidate_user(user_id)
+    # L'invalidation de u1 est sortie de l'historique : le ticket n'est plus verifiable
+    cache.put("h", {"id": "u1"}, None, ticket)
+    assert cache.get("h") is None
+    cache.put("h", {"id": "u1"}, None, cache.generation())
+    assert cache.get("h") == {"id": "u1"}
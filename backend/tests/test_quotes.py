@@ -0,0 +1,95 @@
+import pytest
+
+
+def _headers(main, email):
+    main.db.users.insert_one({"email": email, "name": email.split("@")[0], "role": "client"})
+    return {"Authorization": f"Bearer {main.create_access_token({'sub': email})}"}
+
+
+@pytest.fixture
+def buyer(main):
+    return _headers(main, "buyer@example.com")
+
+
+@pytest.fixture
+def cart(make_product):
+    product = make_product("Sac", price=1000)
+    return [{"product": str(product["_id"]), "name": "Sac", "quantity": 2, "price": 1000, "image": "", "size": "Unique"}]
+
+
+@pytest.fixture
+def product_reads(main, monkeypatch):
+    """Nombre d'appels a _get_products_map (re-tarification depuis la base)."""
+    calls = []
+    get_products_map = main._get_products_map
+
+    def counting(item_list):
+        calls.append(item_list)
+        return get_products_map(item_list)
+
+    monkeypatch.setattr(main, "_get_products_map", counting)
+    return calls
+
+
+def _quote(api, headers, items):
+    resp = api.post("/api/orders/quote", json={"items": items}, headers=headers)
+    assert resp.status_code == 200
+    return resp.json()["quoteToken"]
+
+
+def _order(api, headers, items, token):
+    body = {
+        "items": items, "totalAmount": 0, "paymentMethod": "Stripe",
+        "shippingAddress": "1 rue du Test", "phone": "+221770000000", "quoteToken": token,
+    }
+    resp = api.post("/api/orders", json=body, headers=headers)
+    assert resp.status_code == 200
+    return resp.json()
+
+
+def test_valid_quote_skips_product_reads(api, buyer, cart, product_reads):
+    token = _quote(api, buyer, cart)
+    product_reads.clear()
+    assert _order(api, buyer, cart, token)["totalAmount"] == 2000
+    assert product_reads == []
+
+
+def test_quote_of_another_user_is_repriced(api, main, buyer, cart, product_reads):
+    token = _quote(api, buyer, cart)
+    product_reads.clear()
+    other = _headers(main, "other@example.com")
+    assert _order(api, other, cart, token)["totalAmount"] == 2000
+    assert len(product_reads) == 1
+
+
+def test_changed_cart_is_repriced(api, buyer, cart, product_reads):
+    token = _quote(api, buyer, cart)
+    product_reads.clear()
+    bigger = [{**cart[0], "quantity": 3}]
+    # Le total du devis (2000) n'est pas reutilise pour un autre panier
+    assert _order(api, buyer, bigger, token)["totalAmount"] == 3000
+    assert len(product_reads) == 1
+
+
+def test_price_change_after_quote_is_repriced(api, main, buyer, cart, product_reads):
+    token = _quote(api, buyer, cart)
+    main.db.products.update_one({}, {"$set": {"price": 1500}})
+    main._bump_catalog_price_version()
+    product_reads.clear()
+    assert _order(api, buyer, cart, token)["totalAmount"] == 3000
+    assert len(product_reads) == 1
+
+
+def test_expired_quote_is_repriced(api, main, buyer, cart, product_reads, monkeypatch):
+    monkeypatch.setattr(main, "QUOTE_TOKEN_TTL_SEC", -1)
+    token = _quote(api, buyer, cart)
+    product_reads.clear()
+    assert _order(api, buyer, cart, token)["totalAmount"] == 2000
+    assert len(product_reads) == 1
+
+
+def test_quote_token_is_not_a_session(api, buyer, cart):
+    token = _quote(api, buyer, cart)
+    # Meme cle de signature que les sessions : le type "quote" doit etre refuse
+    resp = api.get("/api/users/me", headers={"Authorization": f"Bearer {token}"})
+    assert resp.status_code == 401
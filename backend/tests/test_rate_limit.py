@@ -0,0 +1,136 @@
+import pytest
+from fastapi import HTTPException
+from pymongo.errors import ServerSelectionTimeoutError
+from starlette.requests import Request
+
+# Puissances de deux : poids et delais exacts en flottants
+WINDOW = 64
+LIMIT = 4
+# Debut d'une fenetre fixe : index 100
+T0 = 100 * WINDOW
+
+
+class Clock:
+    def __init__(self, now: float):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock(T0)
+
+
+@pytest.fixture(params=["memory", "mongo"])
+def limiter(request, main, clock, monkeypatch):
+    if request.param == "memory":
+        backend = main.MemoryRateLimitBackend(100, clock=clock)
+    else:
+        backend = main.MongoRateLimitBackend(clock=clock)
+    monkeypatch.setattr(main, "_rate_limiter", backend)
+    return backend
+
+
+def _allowed(limiter, count: int, key: str = "k") -> int:
+    return sum(1 for _ in range(count) if not limiter.hit(key, LIMIT, WINDOW))
+
+
+def _retry_after(main) -> str:
+    with pytest.raises(HTTPException) as exc:
+        main._enforce_rate_limit("k", LIMIT, WINDOW)
+    assert exc.value.status_code == 429
+    return exc.value.headers["Retry-After"]
+
+
+def test_previous_window_is_weighted_by_remaining_overlap(limiter, clock):
+    assert _allowed(limiter, LIMIT + 5) == LIMIT
+    # Un huitieme de la fenetre suivante ecoule : 4 * 0.875 = 3.5 encore comptes
+    clock.now = T0 + WINDOW + 8
+    assert _allowed(limiter, 5) == 1
+    # A mi-fenetre : 4 * 0.5 + 1 = 3, un appel de plus
+    clock.now = T0 + WINDOW + 32
+    assert _allowed(limiter, 5) == 1
+    # Fenetre precedente entierement sortie
+    clock.now = T0 + 3 * WINDOW
+    assert _allowed(limiter, LIMIT + 1) == LIMIT
+
+
+def test_retry_after_when_current_window_is_full(main, limiter, clock):
+    _allowed(limiter, LIMIT)
+    clock.now = T0 + 10
+    # Fin de fenetre dans 54 s ; a cet instant la precedente pese encore 100 %
+    retry = _retry_after(main)
+    assert retry == "55"
+    clock.now += int(retry)
+    main._enforce_rate_limit("k", LIMIT, WINDOW)
+
+
+def test_retry_after_waits_for_previous_window_to_decay(main, limiter, clock):
+    _allowed(limiter, LIMIT)
+    clock.now = T0 + WINDOW + 8
+    assert _allowed(limiter, 1) == 1
+    # 4 * (1 - e/64) + 1 < 4 des que e > 16, soit plus de 8 s plus tard
+    retry = _retry_after(main)
+    assert retry == "9"
+    # Au seuil exact (e = 16) l'appel est encore refuse
+    clock.now += 8
+    assert limiter.hit("k", LIMIT, WINDOW)
+    clock.now += 1
+    main._enforce_rate_limit("k", LIMIT, WINDOW)
+
+
+def test_memory_backend_evicts_least_recently_used_key(main, clock):
+    limiter = main.MemoryRateLimitBackend(2, clock=clock)
+    assert not limiter.hit("a", 1, WINDOW)
+    assert limiter.hit("a", 1, WINDOW)
+    assert not limiter.hit("b", 1, WINDOW)
+    assert not limiter.hit("c", 1, WINDOW)
+    # "a" (le plus ancien) a ete evince : son compteur repart de zero
+    assert list(limiter._entries) == ["b", "c"]
+    assert not limiter.hit("a", 1, WINDOW)
+    assert list(limiter._entries) == ["c", "a"]
+
+
+def test_memory_backend_purges_expired_keys(main, clock):
+    limiter = main.MemoryRateLimitBackend(100, clock=clock)
+    limiter.hit("a", 1, WINDOW)
+    clock.now = T0 + 2 * WINDOW
+    limiter.hit("b", 1, WINDOW)
+    assert list(limiter._entries) == ["b"]
+
+
+def test_mongo_backend_fails_open(main, clock, monkeypatch):
+    def unavailable(*args, **kwargs):
+        raise ServerSelectionTimeoutError("mongo injoignable")
+
+    monkeypatch.setattr(main.db.rate_limits, "find_one", unavailable)
+    limiter = main.MongoRateLimitBackend(clock=clock)
+    assert all(limiter.hit("k", 1, WINDOW) == 0.0 for _ in range(5))
+
+
+def test_mongo_backend_does_not_count_refused_calls(main, clock):
+    limiter = main.MongoRateLimitBackend(clock=clock)
+    _allowed(limiter, LIMIT + 5)
+    assert main.db.rate_limits.find_one({"_id": f"k:{WINDOW}:100"})["count"] == LIMIT
+
+
+def _request(peer: str, forwarded: str | None = None) -> Request:
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+    return Request({"type": "http", "headers": headers, "client": (peer, 1234)})
+
+
+def test_forwarded_for_ignored_from_untrusted_peer(main, monkeypatch):
+    monkeypatch.setattr(main, "TRUSTED_PROXIES", [])
+    assert main._client_ip(_request("203.0.113.7", "1.2.3.4")) == "203.0.113.7"
+
+
+def test_forwarded_for_read_from_trusted_proxy(main, monkeypatch):
+    import ipaddress
+
+    monkeypatch.setattr(main, "TRUSTED_PROXIES", [ipaddress.ip_network("10.0.0.0/8")])
+    # Entree de gauche forgee par le client : on retient la derniere avant nos proxys
+    request = _request("10.0.0.2", "6.6.6.6, 198.51.100.4, 10.0.0.1")
+    assert main._client_ip(request) == "198.51.100.4"
+    assert main._client_ip(_request("10.0.0.2")) == "10.0.0.2"
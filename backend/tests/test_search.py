@@ -0,0 +1,23 @@
+def _names(api, q, autocomplete):
+    resp = api.get("/api/products/search", params={"q": q, "autocomplete": autocomplete})
+    assert resp.status_code == 200
+    return sorted(p["name"] for p in resp.json())
+
+
+def test_autocomplete_keeps_typed_prefix_next_to_alias(api, make_product):
+    make_product(name="Cabas cuir", category="Sacs")
+    make_product(name="Sacoche homme", category="Accessoires")
+    make_product(name="Bague or", category="Accessoires")
+    # "sac" -> alias "sacs" (groupe) ET prefixe brut "sac" (sacoche)
+    assert _names(api, "sac", True) == ["Cabas cuir", "Sacoche homme"]
+
+
+def test_autocomplete_prefix_uses_alias_for_typos(api, make_product):
+    make_product(name="Escarpins", category="Chaussures")
+    assert _names(api, "chassure", True) == ["Escarpins"]
+
+
+def test_full_search_uses_alias_only(api, make_product):
+    make_product(name="Cabas cuir", category="Sacs")
+    make_product(name="Sacoche homme", category="Accessoires")
+    assert _names(api, "sac", False) == ["Cabas cuir"]
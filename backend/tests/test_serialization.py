@@ -0,0 +1,31 @@
+import json
+import math
+
+from bson import ObjectId
+
+
+def test_json_bytes_matches_legacy_encoding_after_decode(main, make_product):
+    product = main._serialize_product(main.db.products.find_one({"_id": make_product(price=1234.5)["_id"]}))
+    from fastapi.encoders import jsonable_encoder
+
+    legacy = json.loads(json.dumps(jsonable_encoder(product), allow_nan=False))
+    assert json.loads(main._json_bytes(product)) == legacy
+
+
+def test_json_bytes_encodes_object_ids(main):
+    oid = ObjectId()
+    assert json.loads(main._json_bytes({"id": oid})) == {"id": str(oid)}
+
+
+def test_orjson_writes_nan_as_null(main):
+    # Raison de la validation des prix : NaN passerait silencieusement en null
+    assert json.loads(main._json_bytes({"price": math.nan})) == {"price": None}
+
+
+def test_non_finite_price_is_rejected(api, admin_headers):
+    resp = api.post(
+        "/api/products",
+        content=b'{"name": "Sac", "category": "Sacs", "price": NaN}',
+        headers={**admin_headers, "Content-Type": "application/json"},
+    )
+    assert resp.status_code == 422
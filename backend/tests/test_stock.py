@@ -0,0 +1,78 @@
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+
+def _line(product, quantity):
+    return {"product": str(product["_id"]), "quantity": quantity}
+
+
+def _product(main, product):
+    return main.db.products.find_one({"_id": product["_id"]})
+
+
+def test_reservation_decrements_every_line(main, make_product):
+    a, b = make_product(stock=5), make_product(stock=3)
+    main._reserve_stock([_line(a, 2), _line(b, 3), _line(a, 1)])
+    assert _product(main, a)["stock"] == 2
+    assert _product(main, b)["stock"] == 0
+    # Reservation terminee : aucun marqueur ne reste
+    assert not _product(main, a).get("stockReservations")
+
+
+def test_shortage_rolls_back_reserved_lines(main, make_product):
+    a, b = make_product(stock=5), make_product(stock=1)
+    with pytest.raises(HTTPException) as exc:
+        main._reserve_stock([_line(a, 2), _line(b, 2)])
+    assert exc.value.status_code == 409
+    assert _product(main, a)["stock"] == 5
+    assert _product(main, b)["stock"] == 1
+    assert not _product(main, a).get("stockReservations")
+
+
+def test_rollback_finds_marker_on_busy_product(main, make_product, monkeypatch):
+    # 80 reservations en cours poussent leurs marqueurs entre notre decrement et l'annulation :
+    # la notre est retrouvee (pas de plafond de marqueurs), les leurs restent intactes
+    a, b = make_product(stock=500), make_product(stock=0)
+    others = [ObjectId() for _ in range(80)]
+    collection_type = type(main.db.products)
+    bulk_write = collection_type.bulk_write
+    calls = []
+
+    def busy_bulk_write(self, ops, *args, **kwargs):
+        result = bulk_write(self, ops, *args, **kwargs)
+        if not calls:
+            self.update_one({"_id": a["_id"]}, {"$push": {"stockReservations": {"$each": others}}})
+        calls.append(ops)
+        return result
+
+    monkeypatch.setattr(collection_type, "bulk_write", busy_bulk_write)
+    with pytest.raises(HTTPException):
+        main._reserve_stock([_line(a, 4), _line(b, 1)])
+    doc = _product(main, a)
+    assert doc["stock"] == 500
+    assert doc["stockReservations"] == others
+
+
+def test_kept_markers_make_replay_detectable(main, make_product):
+    a = make_product(stock=5)
+    items = [_line(a, 2)]
+    reservation_id = ObjectId()
+    assert not main._stock_reserved(items, reservation_id)
+    main._reserve_stock(items, reservation_id)
+    assert main._stock_reserved(items, reservation_id)
+    main._settle_stock_reservation(items, reservation_id)
+    assert _product(main, a)["stock"] == 3
+    assert not _product(main, a).get("stockReservations")
+
+
+def test_partial_reservation_is_undone_before_retry(main, make_product):
+    a, b = make_product(stock=5), make_product(stock=5)
+    items = [_line(a, 2), _line(b, 1)]
+    reservation_id = ObjectId()
+    # Crash au milieu du bulk_write : seule la premiere ligne est passee
+    main.db.products.update_one({"_id": a["_id"]}, {"$inc": {"stock": -2}, "$push": {"stockReservations": reservation_id}})
+    assert not main._stock_reserved(items, reservation_id)
+    assert _product(main, a)["stock"] == 5
+    main._reserve_stock(items, reservation_id)
+    assert (_product(main, a)["stock"], _product(main, b)["stock"]) == (3, 4)
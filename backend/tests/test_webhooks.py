@@ -0,0 +1,111 @@
+import hashlib
+import hmac
+import json
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+SECRET = "whsec_test"
+
+
+@pytest.fixture
+def paid_event(main, make_product):
+    product = make_product(stock=5)
+    order_id = main.db.orders.insert_one({
+        "status": "En attente",
+        "items": [{"product": str(product["_id"]), "quantity": 2}],
+        "totalAmount": 2000,
+        "createdAt": datetime(2024, 1, 1),
+    }).inserted_id
+    event = {
+        "id": "evt_paid",
+        "object": "event",
+        "type": "checkout.session.completed",
+        "data": {"object": {"id": "cs_1", "payment_intent": "pi_1", "metadata": {"orderId": str(order_id)}}},
+    }
+    return event, order_id, product["_id"]
+
+
+def _signed(payload: bytes) -> str:
+    timestamp = int(time.time())
+    signature = hmac.new(SECRET.encode(), f"{timestamp}.".encode() + payload, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+def test_redelivery_is_recorded_once(api, main, paid_event, monkeypatch):
+    monkeypatch.setenv("STRIPE_WEBHOOK_SECRET", SECRET)
+    payload = json.dumps(paid_event[0]).encode()
+    headers = {"Stripe-Signature": _signed(payload), "Content-Type": "application/json"}
+    first = api.post("/api/payments/stripe-webhook", content=payload, headers=headers)
+    again = api.post("/api/payments/stripe-webhook", content=payload, headers=headers)
+    assert first.json() == {"received": True, "duplicate": False}
+    assert again.json() == {"received": True, "duplicate": True}
+    assert main.db.stripe_events.count_documents({}) == 1
+
+
+def test_bad_signature_is_rejected(api, main, paid_event, monkeypatch):
+    monkeypatch.setenv("STRIPE_WEBHOOK_SECRET", SECRET)
+    payload = json.dumps(paid_event[0]).encode()
+    resp = api.post("/api/payments/stripe-webhook", content=payload, headers={"Stripe-Signature": "t=1,v1=00"})
+    assert resp.status_code == 400
+    assert main.db.stripe_events.count_documents({}) == 0
+
+
+def test_batch_applies_event_once(main, paid_event):
+    event, order_id, product_id = paid_event
+    inbox = main.WebhookInbox()
+    assert inbox.record(event)
+    assert inbox.process_batch() == 1
+    assert main.db.stripe_events.find_one({"_id": event["id"]})["status"] == "done"
+    order = main.db.orders.find_one({"_id": order_id})
+    assert order["status"] == "PayÃ©" and "stockPending" not in order
+    assert main.db.products.find_one({"_id": product_id})["stock"] == 3
+    # Evenement deja traite : rien a reprendre
+    assert inbox.process_batch() == 0
+
+
+def test_failure_is_retried_with_backoff(main, paid_event, monkeypatch):
+    event, order_id, product_id = paid_event
+    inbox = main.WebhookInbox()
+    inbox.record(event)
+    orders = type(main.db.orders)
+    update_one = orders.update_one
+    failures = []
+
+    def crash_after_reservation(self, filter, update, *args, **kwargs):
+        # Panne entre la reservation du stock et l'effacement de stockPending
+        if self.name == "orders" and "stockPending" in update.get("$unset", {}) and not failures:
+            failures.append(update)
+            raise RuntimeError("panne simulee")
+        return update_one(self, filter, update, *args, **kwargs)
+
+    monkeypatch.setattr(orders, "update_one", crash_after_reservation)
+    inbox.process_batch()
+    stored = main.db.stripe_events.find_one({"_id": event["id"]})
+    assert stored["status"] == "pending" and stored["attempts"] == 1
+    assert stored["nextAttemptAt"] > datetime.utcnow()
+
+    main.db.stripe_events.update_one({"_id": event["id"]}, {"$set": {"nextAttemptAt": datetime.utcnow() - timedelta(seconds=1)}})
+    assert inbox.process_batch() == 1
+    assert main.db.stripe_events.find_one({"_id": event["id"]})["status"] == "done"
+    # Nouvel essai : la reservation deja faite n'est pas rejouee
+    assert main.db.products.find_one({"_id": product_id})["stock"] == 3
+    assert not main.db.products.find_one({"_id": product_id}).get("stockReservations")
+    assert "stockPending" not in main.db.orders.find_one({"_id": order_id})
+
+
+def test_exhausted_attempts_go_dead_and_requeue(main, paid_event, monkeypatch):
+    event = paid_event[0]
+    inbox = main.WebhookInbox()
+    inbox.record(event)
+
+    def broken(event):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(main, "_apply_stripe_event", broken)
+    main.db.stripe_events.update_one({"_id": event["id"]}, {"$set": {"attempts": main.WEBHOOK_MAX_ATTEMPTS - 1}})
+    inbox.process_batch()
+    assert main.db.stripe_events.find_one({"_id": event["id"]})["status"] == "dead"
+    assert inbox.requeue(event["id"])
+    assert main.db.stripe_events.find_one({"_id": event["id"]})["status"] == "pending"
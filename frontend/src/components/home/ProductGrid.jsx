@@ -3,12 +3,13 @@ import { ChevronLeft, ChevronRight, ShoppingBag, Heart } from 'lucide-react';
 import { Link } from 'react-router-dom';
 import { useCart } from '../../context/CartContext';
 import api from '../../api'; // Instance Expert
-import { getGroupLabel, isNewProduct, isPromo, getDiscountPercent } from '../../utils/product';
+import { CATEGORY_GROUPS, isNewProduct, isPromo, getDiscountPercent } from '../../utils/product';
 import { toast } from 'react-hot-toast';
 import { useFavorites } from '../../context/FavoritesContext';
 
 export default function ProductGrid() {
     const [products, setProducts] = useState([]);
+    const [nextCursor, setNextCursor] = useState(null);
     const [loading, setLoading] = useState(true);
     const [activeCategory, setActiveCategory] = useState('Tout');
     const [activeSubcategory, setActiveSubcategory] = useState('Tout');
@@ -17,18 +18,46 @@ export default function ProductGrid() {
     const { toggleFavorite, isFavorite } = useFavorites();
     const productsPerPage = 16;
 
+    // Groupe et sous-categorie filtres cote serveur, pages chargees par curseur
+    const buildParams = () => {
+        const params = { sort: 'recent', limit: productsPerPage * 3, view: 'card' };
+        if (activeCategory !== 'Tout') params.categoryGroup = activeCategory;
+        if (activeSubcategory !== 'Tout') params.subcategory = activeSubcategory;
+        return params;
+    };
+
     useEffect(() => {
-        api.get('/api/products')
-            .then(res => setProducts(res.data))
-            .catch(() => toast.error("Erreur de chargement des produits"))
-            .finally(() => setLoading(false));
-    }, []);
+        let cancelled = false;
+        api.get('/api/products', { params: buildParams() })
+            .then(res => {
+                if (cancelled) return;
+                setProducts(res.data.items || []);
+                setNextCursor(res.data.nextCursor || null);
+                setCurrentPage(1);
+            })
+            .catch(() => !cancelled && toast.error("Erreur de chargement des produits"))
+            .finally(() => !cancelled && setLoading(false));
+        return () => { cancelled = true; };
+    }, [activeCategory, activeSubcategory]);
+
+    const availableSubcategories = CATEGORY_GROUPS.find(g => g.label === activeCategory)?.subcategories || [];
+    const hasMore = Boolean(nextCursor);
+    const totalPages = Math.ceil(products.length / productsPerPage) + (hasMore ? 1 : 0);
+    const currentItems = products.slice((currentPage - 1) * productsPerPage, currentPage * productsPerPage);
 
-    const groupFiltered = products.filter(p => activeCategory === 'Tout' ? true : getGroupLabel(p) === activeCategory);
-    const availableSubcategories = Array.from(new Set(groupFiltered.map(p => p.subcategory).filter(Boolean)));
-    const filtered = groupFiltered.filter(p => activeSubcategory === 'Tout' ? true : p.subcategory === activeSubcategory);
-    const totalPages = Math.ceil(filtered.length / productsPerPage);
-    const currentItems = filtered.slice((currentPage - 1) * productsPerPage, currentPage * productsPerPage);
+    const goToNextPage = async () => {
+        if (hasMore && products.length < (currentPage + 1) * productsPerPage) {
+            try {
+                const res = await api.get('/api/products', { params: { ...buildParams(), cursor: nextCursor } });
+                setProducts(prev => [...prev, ...(res.data.items || [])]);
+                setNextCursor(res.data.nextCursor || null);
+            } catch {
+                toast.error("Erreur de chargement des produits");
+                return;
+            }
+        }
+        setCurrentPage(c => c + 1);
+    };
 
     if (loading) return <div className="h-96 flex items-center justify-center animate-pulse text-pink-400 font-serif">TKB COLLECTION...</div>;
 
@@ -114,7 +143,7 @@ export default function ProductGrid() {
                     <div className="mt-20 flex justify-center items-center gap-4">
                         <button disabled={currentPage === 1} onClick={() => setCurrentPage(c => c - 1)} className="p-3 border rounded-full disabled:opacity-20"><ChevronLeft /></button>
                         <span className="text-sm font-bold italic text-slate-400">Page {currentPage} / {totalPages}</span>
-                        <button disabled={currentPage === totalPages} onClick={() => setCurrentPage(c => c + 1)} className="p-3 border rounded-full disabled:opacity-20"><ChevronRight /></button>
+                        <button disabled={currentPage === totalPages} onClick={goToNextPage} className="p-3 border rounded-full disabled:opacity-20"><ChevronRight /></button>
                     </div>
                 )}
             </div>
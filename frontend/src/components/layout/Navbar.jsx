@@ -14,9 +14,9 @@ import {
     MapPin
 } from 'lucide-react';
 import { useCart } from '../../context/CartContext';
-import api from '../../api'; // Instance Axios Expert
 import { useFavorites } from '../../context/FavoritesContext';
-import { clearAuth, getStoredUser } from '../../utils/authStorage';
+import { clearAuth, getStoredUser, updateStoredUser } from '../../utils/authStorage';
+import { loadBootstrap } from '../../utils/bootstrap';
 
 const Navbar = () => {
     const [isScrolled, setIsScrolled] = useState(false);
@@ -44,9 +44,15 @@ const Navbar = () => {
         };
         document.addEventListener('mousedown', handleClickOutside);
 
-        // RECUPERATION DU MESSAGE DYNAMIQUE (Backend Python)
-        api.get('/api/settings')
-            .then(res => setBannerText(res.data.bannerText || "BIENVENUE CHEZ TKB SHOP"))
+        // RECUPERATION DU MESSAGE DYNAMIQUE + PROFIL (requete bootstrap partagee)
+        loadBootstrap()
+            .then(data => {
+                setBannerText(data.settings?.bannerText || "BIENVENUE CHEZ TKB SHOP");
+                if (data.user) {
+                    updateStoredUser(data.user);
+                    setUser(data.user);
+                }
+            })
             .catch(() => setBannerText("LIVRAISON OFFERTE DES 50.000 FCFA"));
 
         return () => {
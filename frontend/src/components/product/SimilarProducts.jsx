@@ -1,28 +1,24 @@
 import React, { useState, useEffect } from 'react';
 import { Link } from 'react-router-dom';
 import api from '../../api';
-import { getGroupLabel, isNewProduct, isPromo, getDiscountPercent } from '../../utils/product';
+import { isNewProduct, isPromo, getDiscountPercent } from '../../utils/product';
 import { Swiper, SwiperSlide } from 'swiper/react';
 import { Autoplay } from 'swiper/modules';
 import 'swiper/css';
 import { Sparkles, Heart } from 'lucide-react';
 import { useFavorites } from '../../context/FavoritesContext';
 
-const SimilarProducts = ({ currentProductId, currentGroup }) => {
+const SimilarProducts = ({ currentProductId }) => {
     const [similar, setSimilar] = useState([]);
     const { toggleFavorite, isFavorite } = useFavorites();
 
     useEffect(() => {
-        if (!currentGroup) return;
-        api.get('/api/products')
-            .then(res => {
-                const filtered = res.data
-                    .filter(p => getGroupLabel(p) === currentGroup && p.id !== currentProductId)
-                    .slice(0, 8);
-                setSimilar(filtered);
-            })
+        if (!currentProductId) return;
+        // Voisins precalcules cote serveur (categorie, prix, couleurs, tailles, stock)
+        api.get(`/api/products/${currentProductId}/similar`, { params: { limit: 8 } })
+            .then(res => setSimilar(res.data))
             .catch(err => console.error("Erreur similar products", err));
-    }, [currentProductId, currentGroup]);
+    }, [currentProductId]);
 
     if (similar.length === 0) return null;
 
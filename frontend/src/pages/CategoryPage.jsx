@@ -1,7 +1,7 @@
 ﻿import React, { useState, useEffect } from 'react';
 import { useParams, Link } from 'react-router-dom';
 import api from '../api';
-import { slugify, normalizeCategorySlug, getGroupLabel, getGroupLabelFromSlug, getSubcategoryLabelFromSlug, isNewProduct, isPromo, getDiscountPercent } from '../utils/product';
+import { CATEGORY_GROUPS, slugify, normalizeCategorySlug, getGroupLabelFromSlug, getSubcategoryLabelFromSlug, isNewProduct, isPromo, getDiscountPercent } from '../utils/product';
 import { Loader2, Sparkles, Heart, ArrowUpDown } from 'lucide-react';
 import { Swiper, SwiperSlide } from 'swiper/react';
 import { Navigation } from 'swiper/modules';
@@ -19,91 +19,84 @@ const CategoryPage = () => {
     const [priceMin, setPriceMin] = useState('');
     const [priceMax, setPriceMax] = useState('');
     const [currentPage, setCurrentPage] = useState(1);
+    const [nextCursor, setNextCursor] = useState(null);
     const perPage = 16;
     const categoryLabel = getGroupLabelFromSlug(category || '');
     const subcategoryLabel = subcategory ? getSubcategoryLabelFromSlug(subcategory) : '';
     const { toggleFavorite, isFavorite } = useFavorites();
 
     useEffect(() => {
-        const fetchAndFilter = async () => {
-            setLoading(true);
-            try {
-                // Rigueur Axios : on utilise api.get
-                const res = await api.get('/api/products');
-
-                // Les donnees sont directement dans res.data avec Axios
-                const allProducts = res.data;
-
-                // Logique de filtrage
-                const categoryKey = normalizeCategorySlug(slugify(category || ''));
-
-                const targetSubSlug = slugify(subcategoryLabel || subcategory || '');
-                const filtered = allProducts.filter(p => {
-                    const groupSlug = normalizeCategorySlug(slugify(getGroupLabel(p)));
-                    const matchesCat = groupSlug === categoryKey;
+        setActiveSubcategory(subcategoryLabel || 'Tout');
+        setCurrentPage(1);
+    }, [subcategoryLabel, category]);
 
-                    if (targetSubSlug) {
-                        const productSubSlug = slugify(p.subcategory || '');
-                        if (productSubSlug === targetSubSlug) return true;
-                    }
+    const categoryKey = normalizeCategorySlug(slugify(category || ''));
+    const groupSubcategories = CATEGORY_GROUPS.find(g => g.label === categoryLabel)?.subcategories || [];
+    const availableSubcategories = subcategoryLabel && !groupSubcategories.includes(subcategoryLabel)
+        ? [...groupSubcategories, subcategoryLabel]
+        : groupSubcategories;
 
-                    return matchesCat;
-                });
+    // Filtres, tri et pagination cote serveur (curseur), comme la page d'accueil
+    const buildParams = () => {
+        const params = { sort: sortBy, limit: perPage * 3, view: 'card' };
+        if (activeSubcategory === 'Tout') {
+            params.categoryGroup = categoryKey;
+        } else {
+            // Sous-categorie seule, tous groupes confondus : comme avant, un produit
+            // range dans un autre groupe mais avec cette sous-categorie reste affiche
+            params.subcategory = activeSubcategory;
+        }
+        const minPrice = priceMin === '' ? NaN : Number(priceMin);
+        const maxPrice = priceMax === '' ? NaN : Number(priceMax);
+        if (Number.isFinite(minPrice)) params.minPrice = minPrice;
+        if (Number.isFinite(maxPrice)) params.maxPrice = maxPrice;
+        return params;
+    };
 
-                setProducts(filtered.reverse());
+    useEffect(() => {
+        let cancelled = false;
+        const fetchAndFilter = async () => {
+            setLoading(true);
+            try {
+                const res = await api.get('/api/products', { params: buildParams() });
+                if (cancelled) return;
+                setProducts(res.data.items || []);
+                setNextCursor(res.data.nextCursor || null);
+                setCurrentPage(1);
             } catch (err) {
+                if (cancelled) return;
                 console.error("Erreur filtrage", err);
                 toast.error("Erreur lors du chargement de la categorie");
             } finally {
-                setLoading(false);
+                if (!cancelled) setLoading(false);
             }
         };
-        fetchAndFilter();
-    }, [category, subcategory, subcategoryLabel]);
-
-    useEffect(() => {
-        setActiveSubcategory(subcategoryLabel || 'Tout');
-        setCurrentPage(1);
-    }, [subcategoryLabel, category]);
-
-    useEffect(() => {
-        setCurrentPage(1);
-    }, [activeSubcategory, sortBy, priceMin, priceMax]);
-
-    const availableSubcategories = Array.from(new Set(products.map(p => p.subcategory).filter(Boolean)));
-    const activeSubSlug = slugify(activeSubcategory || '');
-    const filteredBySubcategory = activeSubcategory === 'Tout'
-        ? products
-        : products.filter(p => slugify(p.subcategory || '') === activeSubSlug);
+        // Petit delai pour ne pas requeter a chaque frappe dans les champs prix
+        const timer = setTimeout(fetchAndFilter, 200);
+        return () => {
+            cancelled = true;
+            clearTimeout(timer);
+        };
+    }, [categoryKey, activeSubcategory, sortBy, priceMin, priceMax]);
 
-    const minPrice = priceMin === '' ? null : Number(priceMin);
-    const maxPrice = priceMax === '' ? null : Number(priceMax);
-    const filteredByPrice = filteredBySubcategory.filter(p => {
-        const price = Number(p.price);
-        if (!Number.isFinite(price)) {
-            return !(Number.isFinite(minPrice) || Number.isFinite(maxPrice));
-        }
-        if (minPrice !== null && Number.isFinite(minPrice) && price < minPrice) return false;
-        if (maxPrice !== null && Number.isFinite(maxPrice) && price > maxPrice) return false;
-        return true;
-    });
+    const hasMore = Boolean(nextCursor);
+    const totalPages = Math.ceil(products.length / perPage) + (hasMore ? 1 : 0);
+    const pageItems = products.slice((currentPage - 1) * perPage, currentPage * perPage);
 
-    const sortedProducts = [...filteredByPrice].sort((a, b) => {
-        switch (sortBy) {
-            case 'price-asc':
-                return (Number(a.price) || Infinity) - (Number(b.price) || Infinity);
-            case 'price-desc':
-                return (Number(b.price) || -Infinity) - (Number(a.price) || -Infinity);
-            case 'name-asc':
-                return (a.name || '').localeCompare(b.name || '');
-            case 'recent':
-            default:
-                return new Date(b.createdAt || 0) - new Date(a.createdAt || 0);
+    const goToNextPage = async () => {
+        // Pages suivantes chargees a la demande (curseur)
+        if (hasMore && products.length < (currentPage + 1) * perPage) {
+            try {
+                const res = await api.get('/api/products', { params: { ...buildParams(), cursor: nextCursor } });
+                setProducts(prev => [...prev, ...(res.data.items || [])]);
+                setNextCursor(res.data.nextCursor || null);
+            } catch (error) {
+                console.error("Erreur produits:", error);
+                return;
+            }
         }
-    });
-
-    const totalPages = Math.ceil(sortedProducts.length / perPage);
-    const pageItems = sortedProducts.slice((currentPage - 1) * perPage, currentPage * perPage);
+        setCurrentPage(c => c + 1);
+    };
 
     const resetFilters = () => {
         setActiveSubcategory('Tout');
@@ -177,7 +170,7 @@ const CategoryPage = () => {
 
                 {!loading && (
                     <div className="flex flex-col lg:flex-row lg:items-center justify-between gap-4 mb-12">
-                        <p className="text-sm text-slate-500">{sortedProducts.length} produit(s)</p>
+                        <p className="text-sm text-slate-500">{products.length}{hasMore ? '+' : ''} produit(s)</p>
                         <div className="flex flex-wrap items-center gap-3">
                             <select
                                 value={activeSubcategory}
@@ -234,7 +227,7 @@ const CategoryPage = () => {
 
                 {loading ? (
                     <div className="flex justify-center py-20"><Loader2 className="animate-spin text-pink-600" /></div>
-                ) : sortedProducts.length === 0 ? (
+                ) : products.length === 0 ? (
                     <div className="text-center py-20">
                         <p className="font-serif italic text-slate-400 text-xl">Aucune piece disponible dans cette selection pour le moment.</p>
                         <Link to="/" className="mt-8 inline-block border-b border-slate-900 pb-1 text-xs font-bold uppercase tracking-widest">Retour aux nouveautes</Link>
@@ -322,7 +315,7 @@ const CategoryPage = () => {
                             <div className="mt-16 flex justify-center items-center gap-4">
                                 <button disabled={currentPage === 1} onClick={() => setCurrentPage(c => c - 1)} className="p-3 border rounded-full disabled:opacity-20">Precedent</button>
                                 <span className="text-sm font-bold italic text-slate-400">Page {currentPage} / {totalPages}</span>
-                                <button disabled={currentPage === totalPages} onClick={() => setCurrentPage(c => c + 1)} className="p-3 border rounded-full disabled:opacity-20">Suivant</button>
+                                <button disabled={currentPage === totalPages} onClick={goToNextPage} className="p-3 border rounded-full disabled:opacity-20">Suivant</button>
                             </div>
                         )}
                     </>
@@ -1,4 +1,4 @@
-import React, { useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { useCart } from '../context/CartContext';
 import api from '../api';
@@ -11,12 +11,19 @@ const stripePromise = loadStripe(import.meta.env.VITE_STRIPE_PUBLIC_KEY);
 const PAYPAL_CURRENCY = import.meta.env.VITE_PAYPAL_CURRENCY || "EUR";
 const PAYPAL_FX_RATE = Number(import.meta.env.VITE_PAYPAL_FX_RATE || 655);
 
+const newIdempotencyKey = () =>
+    (window.crypto?.randomUUID?.() || `${Date.now()}-${Math.random().toString(36).slice(2)}`);
+
 const Checkout = () => {
     const { cart, cartTotal, clearCart } = useCart();
     const navigate = useNavigate();
     const [loading, setLoading] = useState(false);
     const [address, setAddress] = useState({ fullName: '', street: '', city: '', phone: '' });
     const [serverTotal, setServerTotal] = useState(null);
+    // Devis signé : /api/orders le réutilise au lieu de recalculer les prix
+    const [quoteToken, setQuoteToken] = useState(null);
+    // Cle Idempotency-Key de la tentative en cours : un renvoi apres timeout ne cree pas de doublon
+    const checkoutKey = useRef(newIdempotencyKey());
     const isAddressValid = address.fullName && address.street && address.city && address.phone;
     const fetchQuote = async () => {
         try {
@@ -28,6 +35,7 @@ const Checkout = () => {
                 }))
             });
             const total = res?.data?.totalAmount;
+            setQuoteToken(res?.data?.quoteToken || null);
             if (typeof total === 'number') {
                 setServerTotal(total);
                 return total;
@@ -40,6 +48,12 @@ const Checkout = () => {
         return null;
     };
 
+    useEffect(() => {
+        checkoutKey.current = newIdempotencyKey();
+        if (cart.length) fetchQuote();
+        // eslint-disable-next-line react-hooks/exhaustive-deps
+    }, [cart]);
+
 
     const handleStripePayment = async () => {
         if (!isAddressValid) {
@@ -61,19 +75,29 @@ const Checkout = () => {
                 totalAmount: parseFloat(serverTotal ?? cartTotal),
                 paymentMethod: 'Stripe',
                 shippingAddress: `${address.fullName}, ${address.street}, ${address.city}`,
-                phone: address.phone
+                phone: address.phone,
+                quoteToken
             };
 
-            const orderRes = await api.post('/api/orders', orderPayload);
+            const key = checkoutKey.current;
+            const orderRes = await api.post('/api/orders', orderPayload, {
+                headers: { 'Idempotency-Key': key }
+            });
             const orderId = orderRes.data.id;
 
             // 2. CRÉATION SESSION STRIPE
-            const stripeRes = await api.post('/api/payments/create-stripe-session', { orderId });
+            const stripeRes = await api.post('/api/payments/create-stripe-session', { orderId }, {
+                headers: { 'Idempotency-Key': `${key}-stripe` }
+            });
 
             const stripe = await stripePromise;
             await stripe.redirectToCheckout({ sessionId: stripeRes.data.id });
 
         } catch (err) {
+            // Reponse du serveur (refus, stock...) : la prochaine tentative est une nouvelle requete.
+            // Sans reponse (timeout, reseau) ou premier envoi encore en cours (409 + Retry-After),
+            // on garde la cle pour que le renvoi soit dedoublonne.
+            if (err.response && !err.response.headers?.['retry-after']) checkoutKey.current = newIdempotencyKey();
             console.error("Erreur détaillée:", err.response?.data || err.message);
             toast.error("Erreur d'initialisation du paiement Stripe");
         } finally {
@@ -145,14 +169,19 @@ const Checkout = () => {
                                 }}
                                 onApprove={async (data, actions) => {
                                     const order = await actions.order.capture();
+                                    const paymentId = order?.id || data.orderID;
                                     await api.post('/api/orders', {
-                                        items: cart.map(i => ({ product: i.id, name: i.name, quantity: i.quantity, price: i.price, image: i.image })),
+                                        items: cart.map(i => ({ product: String(i.id), name: i.name, quantity: i.quantity, price: i.price, image: i.image, size: i.selectedSize || "Unique" })),
                                         totalAmount: serverTotal ?? cartTotal,
                                         paymentMethod: 'PayPal',
-                                        paymentId: order?.id || data.orderID,
+                                        paymentId,
                                         status: 'Payé',
                                         shippingAddress: `${address.fullName}, ${address.street}, ${address.city}`,
-                                        phone: address.phone
+                                        phone: address.phone,
+                                        quoteToken
+                                    }, {
+                                        // Un paiement PayPal = une commande, meme si l'appel est renvoye
+                                        headers: { 'Idempotency-Key': `paypal-${paymentId}` }
                                     });
                                     clearCart();
                                     navigate('/payment-success');
@@ -1,6 +1,7 @@
 ﻿import React, { useState, useEffect } from 'react';
 import { Link } from 'react-router-dom';
 import api from '../api'; // Import instance Axios corrige
+import { loadBootstrap } from '../utils/bootstrap';
 import { isNewProduct, isPromo, getDiscountPercent } from '../utils/product';
 import Hero from '../components/home/Hero';
 import { Loader2, Sparkles, Heart } from 'lucide-react';
@@ -14,16 +15,19 @@ const Home = () => {
     const [products, setProducts] = useState([]);
     const [loading, setLoading] = useState(true);
     const [searchTerm, setSearchTerm] = useState('');
+    const [searchResults, setSearchResults] = useState(null);
     const { toggleFavorite, isFavorite } = useFavorites();
     const [currentPage, setCurrentPage] = useState(1);
+    const [nextCursor, setNextCursor] = useState(null);
     const perPage = 16;
 
     useEffect(() => {
         const fetchProducts = async () => {
             try {
-                const res = await api.get('/api/products');
-                // Avec Axios, les donnees sont dans res.data
-                setProducts(res.data.reverse());
+                // 1re page (plus recents) livree par /api/bootstrap
+                const data = await loadBootstrap();
+                setProducts(data.products?.items || []);
+                setNextCursor(data.products?.nextCursor || null);
             } catch (error) {
                 console.error("Erreur produits:", error);
             } finally {
@@ -33,16 +37,48 @@ const Home = () => {
         fetchProducts();
     }, []);
 
-    const filteredProducts = products.filter(p =>
-        p.name.toLowerCase().includes(searchTerm.toLowerCase())
-    );
-    const totalPages = Math.ceil(filteredProducts.length / perPage);
+    useEffect(() => {
+        const term = searchTerm.trim();
+        if (!term) {
+            setSearchResults(null);
+            return undefined;
+        }
+        // Recherche serveur (index inverse, insensible aux accents)
+        const timer = setTimeout(async () => {
+            try {
+                const res = await api.get('/api/products/search', { params: { q: term, limit: 50 } });
+                setSearchResults(res.data);
+            } catch (error) {
+                console.error("Erreur recherche:", error);
+            }
+        }, 200);
+        return () => clearTimeout(timer);
+    }, [searchTerm]);
+
+    const filteredProducts = searchResults ?? products;
+    const hasMore = searchResults === null && Boolean(nextCursor);
+    const totalPages = Math.ceil(filteredProducts.length / perPage) + (hasMore ? 1 : 0);
     const pageItems = filteredProducts.slice((currentPage - 1) * perPage, currentPage * perPage);
 
     useEffect(() => {
         setCurrentPage(1);
     }, [searchTerm]);
 
+    const goToNextPage = async () => {
+        // Pages suivantes chargees a la demande (curseur)
+        if (hasMore && products.length < (currentPage + 1) * perPage) {
+            try {
+                const res = await api.get('/api/products', { params: { sort: 'recent', limit: perPage * 3, cursor: nextCursor, view: 'card' } });
+                setProducts(prev => [...prev, ...(res.data.items || [])]);
+                setNextCursor(res.data.nextCursor || null);
+            } catch (error) {
+                console.error("Erreur produits:", error);
+                return;
+            }
+        }
+        setCurrentPage(c => c + 1);
+    };
+
     return (
                 <div className="bg-white min-h-screen">
             <style
@@ -185,7 +221,7 @@ const Home = () => {
                         <div className="mt-16 flex justify-center items-center gap-4">
                             <button disabled={currentPage === 1} onClick={() => setCurrentPage(c => c - 1)} className="p-3 border rounded-full disabled:opacity-20">Precedent</button>
                             <span className="text-sm font-bold italic text-slate-400">Page {currentPage} / {totalPages}</span>
-                            <button disabled={currentPage === totalPages} onClick={() => setCurrentPage(c => c + 1)} className="p-3 border rounded-full disabled:opacity-20">Suivant</button>
+                            <button disabled={currentPage === totalPages} onClick={goToNextPage} className="p-3 border rounded-full disabled:opacity-20">Suivant</button>
                         </div>
                     )}
                     </>
@@ -141,7 +141,7 @@ const ProductDetails = () => {
                         </div>
                     </div>
                 </div>
-                <SimilarProducts currentProductId={product.id} currentGroup={groupLabel} />
+                <SimilarProducts currentProductId={product.id} />
             </div>
             <style dangerouslySetInnerHTML={{ __html: `.swiper-button-next, .swiper-button-prev { color: black !important; background: white; width: 30px; height: 30px; border-radius: 50%; scale: 0.6; box-shadow: 0 2px 10px rgba(0,0,0,0.1); } .swiper-slide-thumb-active { border-color: #db2777 !important; opacity: 1 !important; }` }} />
         </div>
@@ -6,12 +6,30 @@ import api from '../../api';
 const AdminOrders = () => {
   const [orders, setOrders] = useState([]);
   const [searchTerm, setSearchTerm] = useState('');
+  const [statusFilter, setStatusFilter] = useState('');
+  const [filters, setFilters] = useState({ email: '', status: '' });
   const [loading, setLoading] = useState(true);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const pageSize = 50;
+  const statuses = ['En attente', 'Payé', 'Payé (Vérifié)', 'Livré', 'Annulé'];
 
+  // Filtres envoyes au serveur (email exact, statut) : la recherche couvre toutes les commandes,
+  // pas seulement les pages deja chargees
+  const queryParams = () => {
+    const params = { limit: pageSize };
+    if (filters.email) params.email = filters.email;
+    if (filters.status) params.status = filters.status;
+    return params;
+  };
+
+  // Pagination serveur (keyset sur createdAt), deja triee du plus recent au plus ancien
   const fetchOrders = async () => {
+    setLoading(true);
     try {
-      const res = await api.get('/api/admin/orders');
-      setOrders(res.data.sort((a, b) => new Date(b.createdAt) - new Date(a.createdAt)));
+      const res = await api.get('/api/admin/orders', { params: queryParams() });
+      setOrders(res.data.items);
+      setNextCursor(res.data.nextCursor);
     } catch (error) {
       console.error(error);
       toast.error("Erreur de chargement");
@@ -20,7 +38,33 @@ const AdminOrders = () => {
     }
   };
 
-  useEffect(() => { fetchOrders(); }, []);
+  const loadMore = async () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    try {
+      const res = await api.get('/api/admin/orders', { params: { ...queryParams(), cursor: nextCursor } });
+      setOrders(prev => [...prev, ...res.data.items]);
+      setNextCursor(res.data.nextCursor);
+    } catch (error) {
+      console.error(error);
+      toast.error("Erreur de chargement");
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
+  // Nouveau filtre : on repart de la premiere page (le curseur precedent ne vaut plus)
+  useEffect(() => { setNextCursor(null); fetchOrders(); }, [filters]);
+
+  const applySearch = (e) => {
+    e.preventDefault();
+    setFilters({ email: searchTerm.trim().toLowerCase(), status: statusFilter });
+  };
+
+  const changeStatus = (value) => {
+    setStatusFilter(value);
+    setFilters(prev => ({ ...prev, status: value }));
+  };
 
   const updateStatus = async (id, newStatus) => {
     try {
@@ -43,18 +87,20 @@ const AdminOrders = () => {
     return <span className={`${style} px-3 py-1 rounded-full text-xs font-bold border flex items-center gap-1 w-fit`}>{status}</span>;
   };
 
-  const filtered = orders.filter(o => o.id.includes(searchTerm) || (o.userName && o.userName.toLowerCase().includes(searchTerm.toLowerCase())));
-
   return (
     <div className="p-4 sm:p-6 bg-slate-950 min-h-screen text-slate-200">
       <h1 className="text-3xl font-bold text-white flex items-center gap-3 mb-8">
         <Package className="text-blue-500" /> Commandes Clients
       </h1>
 
-      <div className="bg-slate-900 p-4 rounded-xl border border-slate-800 mb-6 flex items-center gap-3">
+      <form onSubmit={applySearch} className="bg-slate-900 p-4 rounded-xl border border-slate-800 mb-6 flex items-center gap-3">
         <Search className="text-slate-400" size={20} />
-        <input type="text" placeholder="Recherche..." value={searchTerm} onChange={(e) => setSearchTerm(e.target.value)} className="w-full bg-transparent outline-none text-white" />
-      </div>
+        <input type="email" placeholder="Email client (Entrée pour rechercher)" value={searchTerm} onChange={(e) => setSearchTerm(e.target.value)} className="w-full bg-transparent outline-none text-white" />
+        <select value={statusFilter} onChange={(e) => changeStatus(e.target.value)} className="bg-slate-950 border border-slate-800 rounded-lg px-3 py-2 text-sm text-white outline-none">
+          <option value="">Tous les statuts</option>
+          {statuses.map(s => <option key={s} value={s}>{s}</option>)}
+        </select>
+      </form>
 
       <div className="bg-slate-900 rounded-xl border border-slate-800 overflow-x-auto shadow-2xl">
         <table className="w-full text-left min-w-[900px]">
@@ -70,9 +116,9 @@ const AdminOrders = () => {
           <tbody className="divide-y divide-slate-800">
             {loading ? (
               <tr><td colSpan="5" className="p-20 text-center"><Loader className="animate-spin mx-auto text-blue-500" /></td></tr>
-            ) : filtered.length === 0 ? (
+            ) : orders.length === 0 ? (
               <tr><td colSpan="5" className="p-16 text-center text-slate-500 text-sm">Aucune commande trouvée.</td></tr>
-            ) : filtered.map((order) => (
+            ) : orders.map((order) => (
               <tr key={order.id} className="hover:bg-slate-800/50">
                 <td className="p-6"><div className="font-mono text-xs text-blue-400">#{order.id.slice(-6).toUpperCase()}</div><div className="text-[10px] text-slate-500 mt-1">{new Date(order.createdAt).toLocaleDateString()}</div></td>
                 <td className="p-6"><div className="font-bold">{order.userName || "Client"}</div><div className="text-[10px] text-slate-500">{order.phone}</div></td>
@@ -89,6 +135,14 @@ const AdminOrders = () => {
           </tbody>
         </table>
       </div>
+
+      {nextCursor && !loading && (
+        <div className="flex justify-center mt-6">
+          <button onClick={loadMore} disabled={loadingMore} className="px-6 py-2 rounded-lg bg-slate-800 text-slate-200 text-xs font-bold uppercase tracking-widest hover:bg-slate-700 disabled:opacity-50">
+            {loadingMore ? 'Chargement...' : 'Charger plus'}
+          </button>
+        </div>
+      )}
     </div>
   );
 };
@@ -26,24 +26,26 @@ const DashboardHome = () => {
         const fetchData = async () => {
             try {
                 const statsRes = await api.get('/api/admin/stats');
-                setKpi(statsRes.data || { revenue: 0, usersCount: 0, productsCount: 0, ordersCount: 0 });
+                const stats = statsRes.data || { revenue: 0, usersCount: 0, productsCount: 0, ordersCount: 0 };
+                setKpi(stats);
+                const counts = stats.statusCounts || {};
+                const delivered = counts['Livré'] || 0;
+                const cancelled = counts['Annulé'] || 0;
+                setGraphData([
+                    { name: 'Livré', value: delivered, fill: '#10b981' },
+                    { name: 'En cours', value: Math.max(0, (stats.ordersCount || 0) - delivered - cancelled), fill: '#f59e0b' },
+                    { name: 'Annulé', value: cancelled, fill: '#ef4444' },
+                ]);
 
-                const ordersRes = await api.get('/api/admin/orders');
+                const ordersRes = await api.get('/api/admin/orders', { params: { limit: 6 } });
                 if (ordersRes.data) {
-                    const data = Array.isArray(ordersRes.data) ? ordersRes.data : [];
-                    setRecentOrders(data.slice(0, 6));
-                    setGraphData([
-                        { name: 'Livré', value: data.filter(o => o.status === 'Livré').length, fill: '#10b981' },
-                        { name: 'En cours', value: data.filter(o => o.status !== 'Livré' && o.status !== 'Annulé').length, fill: '#f59e0b' },
-                        { name: 'Annulé', value: data.filter(o => o.status === 'Annulé').length, fill: '#ef4444' },
-                    ]);
+                    setRecentOrders(Array.isArray(ordersRes.data.items) ? ordersRes.data.items : []);
                 }
 
-                const productsRes = await api.get('/api/products');
+                const productsRes = await api.get('/api/products', { params: { sort: 'recent', limit: 6, view: 'card' } });
                 if (productsRes.data) {
-                    const items = Array.isArray(productsRes.data) ? productsRes.data : [];
-                    const sorted = [...items].sort((a, b) => new Date(b.createdAt || 0) - new Date(a.createdAt || 0));
-                    setRecentProducts(sorted.slice(0, 6));
+                    const items = Array.isArray(productsRes.data.items) ? productsRes.data.items : [];
+                    setRecentProducts(items);
                 }
 
                 const settingsRes = await api.get('/api/settings');
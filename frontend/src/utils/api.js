@@ -22,10 +22,23 @@ apiInstance.interceptors.request.use((config) => {
     return config;
 });
 
+const IDEMPOTENT_RETRY_MAX = 10;
+
 // Intercepteur pour gerer la deconnexion sur erreur 401
 apiInstance.interceptors.response.use(
     (response) => response,
     (error) => {
+        const config = error.config;
+        // 409 + Retry-After sur une requete a Idempotency-Key : le premier envoi est encore en cours
+        // cote serveur, on renvoie la meme requete (meme cle) pour lire sa reponse.
+        // Un 409 sans Retry-After (stock insuffisant...) est une vraie erreur.
+        const retryAfter = Number(error.response?.headers?.['retry-after']);
+        if (error.response?.status === 409 && retryAfter > 0 && config?.headers?.['Idempotency-Key']) {
+            config.idempotentRetries = (config.idempotentRetries || 0) + 1;
+            if (config.idempotentRetries <= IDEMPOTENT_RETRY_MAX) {
+                return new Promise((resolve) => setTimeout(resolve, retryAfter * 1000)).then(() => apiInstance(config));
+            }
+        }
         if (error.response && error.response.status === 401) {
             clearAuth();
             if (window.location.pathname.startsWith('/admin')) {
@@ -0,0 +1,19 @@
+import api from './api';
+
+let bootstrapPromise = null;
+
+/**
+ * Donnees du premier affichage (reglages, categories, 1re page produits, user)
+ * Une seule requete partagee entre Navbar et Home
+ */
+export const loadBootstrap = () => {
+    if (!bootstrapPromise) {
+        bootstrapPromise = api.get('/api/bootstrap')
+            .then(res => res.data)
+            .catch((err) => {
+                bootstrapPromise = null;
+                throw err;
+            });
+    }
+    return bootstrapPromise;
+};